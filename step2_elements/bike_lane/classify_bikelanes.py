@@ -34,9 +34,26 @@ else:
 
 ###########################################################
 #### ---- 📌 Block 1 — Helpers to fetch GSV & SAT ---- ####
-import requests
 from PIL import Image
 from io import BytesIO
+from image_fetcher import ImageFetcher
+from image_cache import ImageCache, image_key
+
+# Endpoints (point them at a local stand-in server to test without the Google API)
+GSV_URL = "https://maps.googleapis.com/maps/api/streetview"
+SAT_URL = "https://maps.googleapis.com/maps/api/staticmap"
+
+# Image cache shared with the other elements (use the same folder as their IMAGE_CACHE_DIR; None disables it)
+IMAGE_CACHE_DIR = None
+IMAGE_CACHE_MAX_GB = 50
+
+# Shared keep-alive pool: 8 requests in flight, retries on 429/5xx with jittered backoff
+image_cache = ImageCache(IMAGE_CACHE_DIR, max_bytes=int(IMAGE_CACHE_MAX_GB * 1e9)) if IMAGE_CACHE_DIR else None
+fetcher = ImageFetcher(concurrency=8, rate_limit=None, max_retries=4, timeout=30, cache=image_cache)
+
+# Decode downloads once in memory (at the model input size) and classify them without reading the
+# files back; the files are still written, in the background. Keeps ~0.45 MB per image until Block 3.
+IN_MEMORY_IMAGES = False
 
 # Filter midpoint +  one side
 points_gdf = points_gdf.query("is_midpoint == True and side == 'side1'")
@@ -49,41 +66,55 @@ os.makedirs(os.path.join(WORK_DIR, "outputs"), exist_ok=True)
 save_dir = os.path.join(WORK_DIR, "images")
 output_dir = os.path.join(WORK_DIR, "outputs")
 
-# Function to download street view imagery using pano_id
-def download_gsv(pano_id, heading, fov=120, pitch=-30, fname="temp.jpg"):
-    url = (
-        "https://maps.googleapis.com/maps/api/streetview"
+# URL of the street view imagery using pano_id
+def gsv_url(pano_id, heading, fov=120, pitch=-30):
+    return (
+        f"{GSV_URL}"
         f"?size=640x640&pano={pano_id}&heading={heading}"
         f"&fov={fov}&pitch={pitch}&source=outdoor&key={API_KEY}"
     )
-    r = requests.get(url)
-    if r.status_code == 200:
-        with open(fname, "wb") as f:
-            f.write(r.content)
-        return fname
-    else:
-        print(f"⚠️ Failed GSV: {r.status_code}")
-        return None
 
-# Function to download satellite imagery using location info
-def download_sat(lat, lon, zoom=21, fname="temp.jpg"):
-    url = (
-        "https://maps.googleapis.com/maps/api/staticmap"
+# URL of the satellite imagery using location info
+def sat_url(lat, lon, zoom=21):
+    return (
+        f"{SAT_URL}"
         f"?center={lat},{lon}&zoom={zoom}&size=640x640"
         f"&maptype=satellite&key={API_KEY}"
     )
-    r = requests.get(url)
-    if r.status_code == 200:
-        with open(fname, "wb") as f:
-            f.write(r.content)
-        return fname
-    else:
-        print(f"⚠️ Failed SAT: {r.status_code}")
+
+# Cache keys (normalized request parameters, shared with the other elements)
+def gsv_key(pano_id, heading, fov=120, pitch=-30):
+    return image_key("streetview", pano=pano_id, heading=heading, pitch=pitch, fov=fov, size="640x640", source="outdoor")
+
+def sat_key(lat, lon, zoom=21):
+    return image_key("satellite", lat=lat, lon=lon, zoom=zoom, size="640x640", maptype="satellite")
+
+# Function to download street view imagery using pano_id
+def download_gsv(pano_id, heading, fov=120, pitch=-30, fname="temp.jpg"):
+    path, status = fetcher.fetch(gsv_url(pano_id, heading, fov, pitch), fname, cache_key=gsv_key(pano_id, heading, fov, pitch))
+    if path is None:
+        print(f"⚠️ Failed GSV: {status}")
+    return path
+
+# Function to download satellite imagery using location info
+def download_sat(lat, lon, zoom=21, fname="temp.jpg"):
+    path, status = fetcher.fetch(sat_url(lat, lon, zoom), fname, cache_key=sat_key(lat, lon, zoom))
+    if path is None:
+        print(f"⚠️ Failed SAT: {status}")
+    return path
+
+# Downloaded bytes → RGB image resized like Block 3's transform (None if they are not an image)
+def decode_rgb(content, input_size=384):
+    try:
+        img = Image.open(BytesIO(content)).convert("RGB")
+    except OSError:
         return None
+    return img.resize((input_size, input_size), Image.BILINEAR)
 
-# Download images for all points
+# Download images for all points (concurrently through the shared pool)
 results = []
-for idx, row in tqdm(points_gdf.iterrows(), total=len(points_gdf)):
+jobs = []
+for idx, row in points_gdf.iterrows():
     pano_id = row["pano_id"]
     seg_id = str(row["link_id"])
     lat, lon = row.geometry.y, row.geometry.x
@@ -96,9 +127,9 @@ for idx, row in tqdm(points_gdf.iterrows(), total=len(points_gdf)):
     f_gsv2 = os.path.join(save_dir, f"{seg_id}_MID_GSV2.jpg")
     f_sat  = os.path.join(save_dir, f"{seg_id}_SAT.jpg")
 
-    download_gsv(pano_id, heading, fname=f_gsv1)
-    download_gsv(pano_id, opp_heading, fname=f_gsv2)
-    download_sat(lat, lon, fname=f_sat)
+    jobs.append(("GSV", gsv_url(pano_id, heading), f_gsv1, gsv_key(pano_id, heading)))
+    jobs.append(("GSV", gsv_url(pano_id, opp_heading), f_gsv2, gsv_key(pano_id, opp_heading)))
+    jobs.append(("SAT", sat_url(lat, lon), f_sat, sat_key(lat, lon)))
 
     results.append({
         "segment_id": seg_id,
@@ -106,6 +137,16 @@ for idx, row in tqdm(points_gdf.iterrows(), total=len(points_gdf)):
         "GSV1": f_gsv1, "GSV2": f_gsv2, "SAT": f_sat
     })
 
+decode = decode_rgb if IN_MEMORY_IMAGES else None
+futures = [(kind, fname, fetcher.submit(url, fname, cache_key=key, decode=decode)) for kind, url, fname, key in jobs]
+images = {}   # {file path: decoded image} with IN_MEMORY_IMAGES
+for kind, fname, future in tqdm(futures, total=len(futures)):
+    path, status, *image = future.result()
+    if path is None:
+        print(f"⚠️ Failed {kind}: {status}")
+    elif image and image[0] is not None:
+        images[fname] = image[0]
+
 print(f"✅ Download complete. {len(results)} segments saved to {save_dir}")
 
 
@@ -179,12 +220,17 @@ models = load_bike_lane_model(CHECKPOINT_PATH, device)
 #### ---- 📌 Block 3 — Run classification model ---- ####
 from torchvision import transforms
 
-def apply_bike_lane_model(results, output_dir, models, device, input_size=384):
+def apply_bike_lane_model(results, output_dir, models, device, input_size=384, images=None):
     model_gsv1, model_gsv2, model_sat, model_fusion = models
     transform = transforms.Compose([
         transforms.Resize((input_size, input_size)),
         transforms.ToTensor()
     ])
+    images = images or {}
+
+    # Decoded at download (IN_MEMORY_IMAGES), else read from disk
+    def load_rgb(fname):
+        return images[fname] if fname in images else Image.open(fname).convert("RGB")
     label_map = {0: "No Bike Lane", 1: "Designated", 2: "Protected"}
 
     results_out = []
@@ -193,9 +239,9 @@ def apply_bike_lane_model(results, output_dir, models, device, input_size=384):
         try:
             f_gsv1, f_gsv2, f_sat = row["GSV1"], row["GSV2"], row["SAT"]
 
-            img1 = transform(Image.open(f_gsv1).convert("RGB")).unsqueeze(0).to(device)
-            img2 = transform(Image.open(f_gsv2).convert("RGB")).unsqueeze(0).to(device)
-            img3 = transform(Image.open(f_sat).convert("RGB")).unsqueeze(0).to(device)
+            img1 = transform(load_rgb(f_gsv1)).unsqueeze(0).to(device)
+            img2 = transform(load_rgb(f_gsv2)).unsqueeze(0).to(device)
+            img3 = transform(load_rgb(f_sat)).unsqueeze(0).to(device)
 
             with torch.no_grad():
                 o1p, o1t = model_gsv1(img1)
@@ -239,4 +285,5 @@ def apply_bike_lane_model(results, output_dir, models, device, input_size=384):
     print(f"✅ Predictions saved: {results_csv}")
     return results_df
 
-results_df = apply_bike_lane_model(results, output_dir, models, device)
\ No newline at end of file
+results_df = apply_bike_lane_model(results, output_dir, models, device, images=images)
+fetcher.close()  # waits for images still being written in the background
\ No newline at end of file
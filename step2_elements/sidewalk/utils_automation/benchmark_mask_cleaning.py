@@ -0,0 +1,63 @@
+import time
+import argparse
+
+import numpy as np
+import cv2
+from skimage.measure import label, regionprops
+
+from mask_cleaning import remove_small_regions, remove_small_regions_bincount
+
+
+def speckled_mask(size=640, speckle_density=0.02, seed=0):
+    """Synthetic binary mask: a few large sidewalk-like bands plus random speckle noise."""
+    rng = np.random.default_rng(seed)
+    mask = np.zeros((size, size), dtype=np.uint8)
+    mask[int(size * 0.70):int(size * 0.85), :] = 255
+    mask[int(size * 0.40):int(size * 0.45), int(size * 0.2):int(size * 0.8)] = 255
+    for _ in range(10):
+        x, y = rng.integers(0, size, 2)
+        cv2.circle(mask, (int(x), int(y)), int(rng.integers(5, 30)), 255, -1)
+    mask[rng.random((size, size)) < speckle_density] = 255
+    return mask
+
+
+def remove_small_regions_legacy(binary_mask, min_area):
+    """Previous per-region loop of process_sidewalk_edges / process_road_edges."""
+    labeled_image, _ = label(binary_mask, return_num=True, connectivity=2)
+    props = regionprops(labeled_image)
+    mask = np.zeros_like(binary_mask)
+    for prop in props:
+        if prop.area < min_area:
+            mask[labeled_image == prop.label] = 255
+    clean = binary_mask.copy()
+    clean[mask == 255] = 0
+    return clean
+
+
+def _time(fn, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark small-region removal on synthetic speckled masks.")
+    parser.add_argument("--densities", type=float, nargs="+", default=[0.001, 0.01, 0.05])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    min_area = (640 * 640) / (14**2)
+    print(f"{'speckle':>8} {'regions':>8} {'legacy [ms]':>12} {'bincount [ms]':>14} {'cv2 [ms]':>10} {'speedup':>8}")
+    for density in args.densities:
+        mask = speckled_mask(speckle_density=density)
+        labeled_image, n_regions = label(mask, return_num=True, connectivity=2)
+
+        t_legacy, ref = _time(remove_small_regions_legacy, mask, min_area, repeat=args.repeat)
+        t_bincount, out_bincount = _time(remove_small_regions_bincount, mask, labeled_image, min_area, repeat=args.repeat)
+        t_cv2, out_cv2 = _time(remove_small_regions, mask, min_area, repeat=args.repeat)
+
+        assert np.array_equal(ref, out_bincount) and np.array_equal(ref, out_cv2), "cleaned masks differ"
+        print(f"{density:>8} {n_regions:>8} {t_legacy * 1e3:>12.1f} {t_bincount * 1e3:>14.1f} {t_cv2 * 1e3:>10.1f} {t_legacy / t_cv2:>7.0f}x")
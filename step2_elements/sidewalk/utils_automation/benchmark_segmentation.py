@@ -0,0 +1,109 @@
+import os
+import glob
+import json
+import time
+import argparse
+
+import numpy as np
+
+from config import LABEL_INDEX, SEG_BATCH_SIZE, SEG_INT8, SEG_ROI
+from segmentation import load_segmentation_model, predict_masks
+
+IOU_LABELS = ["sidewalk", "road"]
+
+
+def image_paths(inputs, limit=None):
+    """Image files given directly or found (recursively, *.jpg) in the given folders."""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(sorted(glob.glob(os.path.join(item, "**", "*.jpg"), recursive=True)))
+        else:
+            paths.append(item)
+    # Debug overlays saved next to the downloads are not inputs
+    paths = [p for p in paths if not p.endswith("_segmented.jpg")]
+    return paths[:limit] if limit else paths
+
+
+def run_backend(backend, paths, batch_size, int8, warmup=1, roi=None):
+    """
+    Masks of `paths` (full frame, or only the ROI band mapped back to full frame) and the per-image
+    latencies (s) of each batch, after `warmup` untimed batches.
+    """
+    t0 = time.perf_counter()
+    model = load_segmentation_model(backend=backend, int8=int8, roi=roi, server=None)
+    load_s = time.perf_counter() - t0
+
+    for _ in range(warmup):
+        predict_masks(model, paths[:batch_size], roi=roi)
+
+    masks, latencies = [], []
+    for start in range(0, len(paths), batch_size):
+        batch = paths[start:start + batch_size]
+        t0 = time.perf_counter()
+        _, batch_masks = predict_masks(model, batch, roi=roi)
+        latencies.extend([(time.perf_counter() - t0) / len(batch)] * len(batch))
+        masks.extend(batch_masks)
+    model_mb = os.path.getsize(model.path) / 2**20 if hasattr(model, "path") else None  # exported file only
+    return masks, np.asarray(latencies), load_s, model_mb
+
+
+def iou(reference, masks, label):
+    """IoU of `label` pixels over all images (summed intersection / summed union), and per image."""
+    idx = LABEL_INDEX[label]
+    inter = np.array([np.logical_and(r == idx, m == idx).sum() for r, m in zip(reference, masks)])
+    union = np.array([np.logical_or(r == idx, m == idx).sum() for r, m in zip(reference, masks)])
+    per_image = np.where(union > 0, inter / np.maximum(union, 1), 1.0)
+    return (inter.sum() / union.sum() if union.sum() else 1.0), per_image
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare segmentation backends and ROI crops (latency, and sidewalk/road IoU against the first backend on full frames).")
+    parser.add_argument("images", nargs="+", help="Image files or folders of downloaded *.jpg images")
+    parser.add_argument("--backends", nargs="+", default=["mmseg", "onnx", "torchscript"],
+                        help="Backends to compare; the first one is the IoU reference")
+    parser.add_argument("--int8", action=argparse.BooleanOptionalAction, default=SEG_INT8,
+                        help="Dynamic INT8 quantization of the exported backends")
+    parser.add_argument("--roi", type=int, nargs=2, default=SEG_ROI, metavar=("TOP", "BOTTOM"),
+                        help="Also run every backend on this row band (default: SEG_ROI)")
+    parser.add_argument("--batch-size", type=int, default=SEG_BATCH_SIZE)
+    parser.add_argument("--limit", type=int, default=64, help="Max images (0 = all)")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed batches per backend")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    paths = image_paths(args.images, args.limit)
+    print(f"{len(paths)} images, batch size {args.batch_size}, int8={args.int8}, roi={args.roi}")
+    variants = [(backend, None) for backend in args.backends]
+    if args.roi:
+        variants += [(backend, tuple(args.roi)) for backend in args.backends]
+
+    rows = []
+    reference = None
+    for backend, roi in variants:
+        masks, latencies, load_s, model_mb = run_backend(backend, paths, args.batch_size, args.int8, args.warmup, roi)
+        row = {
+            "backend": backend if roi is None else f"{backend}+roi", "load_s": load_s, "model_mb": model_mb,
+            "mean_ms": float(latencies.mean() * 1e3), "p50_ms": float(np.percentile(latencies, 50) * 1e3),
+            "p90_ms": float(np.percentile(latencies, 90) * 1e3), "images_per_s": float(1 / latencies.mean()),
+        }
+        if reference is None:
+            reference = masks
+        for label in IOU_LABELS:
+            total, per_image = iou(reference, masks, label)
+            row[f"{label}_iou"] = float(total)
+            row[f"{label}_iou_min"] = float(per_image.min())
+        row["pixel_agreement"] = float(np.mean([(r == m).mean() for r, m in zip(reference, masks)]))
+        rows.append(row)
+
+    columns = ["backend", "load_s", "model_mb", "mean_ms", "p50_ms", "p90_ms", "images_per_s",
+               "sidewalk_iou", "sidewalk_iou_min", "road_iou", "road_iou_min", "pixel_agreement"]
+    print(" ".join(f"{c:>16}" for c in columns))
+    for row in rows:
+        print(" ".join(f"{row[c]:>16.3f}" if isinstance(row[c], float) else f"{row[c] or '-':>16}" for c in columns))
+    print(f"(IoU and pixel agreement against '{args.backends[0]}' on full frames; ROI rows outside the band count as misses)")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"images": len(paths), "batch_size": args.batch_size, "int8": args.int8, "roi": args.roi,
+                       "results": rows}, f, indent=2)
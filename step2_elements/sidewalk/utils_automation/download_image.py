@@ -1,28 +1,74 @@
 import os
-import requests
-from config import API_KEY, OUTPUT_DIR
+import hashlib
+import threading
+from collections import namedtuple
 
-def get_streetview_image(panoid, heading, fov, pitch, save_dir, side):
-    """Download Google Street View image given panoid, heading, pitch, and side."""
-    base_url = "https://maps.googleapis.com/maps/api/streetview"
-    url = f"{base_url}?size=640x640&pano={panoid}&heading={heading}&fov={fov}&pitch={pitch}&source=outdoor&key={API_KEY}"
+import cv2
+import numpy as np
+from config import (API_KEY, OUTPUT_DIR, STREETVIEW_URL, FETCH_CONCURRENCY, FETCH_RATE_LIMIT,
+                    FETCH_MAX_RETRIES, FETCH_TIMEOUT, IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_GB, IN_MEMORY_IMAGES)
+from image_fetcher import ImageFetcher
+from image_cache import ImageCache, image_key
+
+# One connection pool for every download thread of the run, backed by the cross-element image cache
+# (opened by the first download, so importing this module creates no files)
+fetcher = ImageFetcher(
+    concurrency=FETCH_CONCURRENCY, rate_limit=FETCH_RATE_LIMIT,
+    max_retries=FETCH_MAX_RETRIES, timeout=FETCH_TIMEOUT,
+)
+_cache_lock = threading.Lock()
+
+# An image decoded from the downloaded bytes, with the SHA-256 of those bytes (its segmentation cache key)
+DecodedImage = namedtuple("DecodedImage", ["image", "digest"])
+
+# IN_MEMORY_IMAGES: {(link_id, side, panoid, pitch): DecodedImage} waiting for segmentation (see take_decoded)
+_decoded = {}
+
+
+def decode_image(content):
+    """Decode downloaded image bytes into a BGR array (None if they are not an image)."""
+    image = cv2.imdecode(np.frombuffer(content, np.uint8), cv2.IMREAD_COLOR)
+    return None if image is None else DecodedImage(image, hashlib.sha256(content).hexdigest())
+
+
+def take_decoded(img_results):
+    """
+    Remove and return the decoded images of the keys of `img_results` ({key: DecodedImage}; empty
+    unless IN_MEMORY_IMAGES). Segmentation takes them, so they are only held between the two stages.
+    """
+    return {key: image for key in img_results if (image := _decoded.pop(key, None)) is not None}
+
+
+def open_image_cache():
+    """Attach the image cache in IMAGE_CACHE_DIR (None = no cache) to the fetcher, once; returns it."""
+    with _cache_lock:
+        if IMAGE_CACHE_DIR and fetcher.cache is None:
+            fetcher.cache = ImageCache(IMAGE_CACHE_DIR, max_bytes=int(IMAGE_CACHE_MAX_GB * 1e9))
+    return fetcher.cache
+
+
+def streetview_request(panoid, heading, fov, pitch, save_dir, side):
+    """URL, file path and image cache key of the Google Street View image for panoid, heading, pitch, and side."""
+    url = f"{STREETVIEW_URL}?size=640x640&pano={panoid}&heading={heading}&fov={fov}&pitch={pitch}&source=outdoor&key={API_KEY}"
 
     # Folder first groups by panoid+heading
     folder_name = str(panoid)        # only panoid
     folder_path = os.path.join(save_dir, folder_name, side)
-    os.makedirs(folder_path, exist_ok=True)
 
     filename = f"pitch{pitch}_heading{heading}.jpg"
     file_path = os.path.join(folder_path, filename)
+    cache_key = image_key("streetview", pano=panoid, heading=heading, pitch=pitch, fov=fov, size="640x640", source="outdoor")
+    return url, file_path, cache_key
 
-    response = requests.get(url)
-    if response.status_code == 200:
-        with open(file_path, "wb") as file:
-            file.write(response.content)
-        return file_path
-    else:
-        print(f"Failed to download image (pitch={pitch}), Status Code: {response.status_code}")
-        return None
+
+def get_streetview_image(panoid, heading, fov, pitch, save_dir, side):
+    """Download Google Street View image given panoid, heading, pitch, and side."""
+    url, file_path, cache_key = streetview_request(panoid, heading, fov, pitch, save_dir, side)
+    open_image_cache()
+    img_path, status = fetcher.fetch(url, file_path, cache_key=cache_key)
+    if img_path is None:
+        print(f"Failed to download image (pitch={pitch}), Status Code: {status}")
+    return img_path
 
 
 def adjust_heading(pano_heading, bearing):
@@ -41,6 +87,7 @@ def adjust_heading(pano_heading, bearing):
 def download_images_for_temp(temp_gdf, pitch_values=[0, -10], fov=65, save_dir=OUTPUT_DIR):
     """Download images for each side (side1, side2) with adjusted headings."""
     all_results = {}
+    jobs = []
 
     for idx, row in temp_gdf.iterrows():
         panoid = row["pano_id"]
@@ -63,18 +110,29 @@ def download_images_for_temp(temp_gdf, pitch_values=[0, -10], fov=65, save_dir=O
         # print(f"\n📍 Processing link_id={row['link_id']} | {side} | panoid={panoid} | heading={heading} | FOV={current_fov}")
 
         for pitch in pitch_values:
-            img_path = get_streetview_image(
+            key = (row["link_id"], side, panoid, pitch)
+            jobs.append((key, *streetview_request(
                 panoid=panoid,
                 heading=heading,
                 fov=current_fov,
                 pitch=pitch,
                 save_dir=save_dir,
                 side=side
-            )
-            if img_path:
-                print(f"✅ Saved: {img_path}")
-                all_results[(row["link_id"], side, panoid, pitch)] = img_path
-            else:
-                print(f"⚠️ Failed for panoid={panoid}, pitch={pitch}, side={side}")
+            )))
+
+    open_image_cache()
+    # All images of the link are fetched concurrently through the shared pool; with IN_MEMORY_IMAGES
+    # they are decoded on the fetch threads and written to disk in the background
+    fetched = fetcher.fetch_many(jobs, decode=decode_image if IN_MEMORY_IMAGES else None)
+    for key, (img_path, status, *decoded) in fetched.items():
+        _, side, panoid, pitch = key
+        if decoded and decoded[0] is not None:
+            _decoded[key] = decoded[0]
+        if img_path:
+            print(f"✅ Saved: {img_path}")
+            all_results[key] = img_path
+        else:
+            print(f"Failed to download image (pitch={pitch}), Status Code: {status}")
+            print(f"⚠️ Failed for panoid={panoid}, pitch={pitch}, side={side}")
 
     return all_results
\ No newline at end of file
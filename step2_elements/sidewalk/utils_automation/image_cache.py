@@ -0,0 +1,175 @@
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+import uuid
+
+HEADING_DECIMALS = 1   # Headings closer than this are treated as the same image
+COORD_DECIMALS = 7     # lat / lon precision (~1 cm)
+
+
+def _normalize(name, value):
+    """Canonical text of one request parameter."""
+    if name == "heading":
+        value = round(float(value) % 360, HEADING_DECIMALS)
+    elif name in ("lat", "lon"):
+        value = round(float(value), COORD_DECIMALS)
+    elif hasattr(value, "item"):  # NumPy scalar
+        value = value.item()
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+def image_key(kind, **params):
+    """
+    Normalized cache key of an image request.
+
+    Parameters:
+    - kind: Endpoint the image comes from ("streetview", "satellite", "thumbnail"); images of
+      different endpoints never share a key.
+    - params: Request parameters that determine the image (pano, heading, pitch, fov, size, source,
+      lat, lon, zoom, ...), never the API key. Headings are taken modulo 360 and rounded to
+      HEADING_DECIMALS, and whole floats match ints (fov=100.0 is fov=100).
+
+    Returns:
+    - e.g. "streetview|fov=95|heading=123.4|pano=abc|pitch=-10|size=640x640|source=outdoor"
+    """
+    return "|".join([kind] + [f"{name}={_normalize(name, params[name])}" for name in sorted(params)])
+
+
+def _link_or_copy(src, dst):
+    """Place `src` at `dst` atomically, as a hard link when both are on the same file system."""
+    folder = os.path.dirname(dst) or "."
+    os.makedirs(folder, exist_ok=True)
+    try:
+        if os.path.samefile(src, dst):
+            return
+    except FileNotFoundError:
+        pass
+    tmp_path = os.path.join(folder, f".{os.path.basename(dst)}.{uuid.uuid4().hex}.part")
+    try:
+        try:
+            os.link(src, tmp_path)
+        except OSError:
+            shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, dst)
+    finally:
+        # Renaming onto another link of the same file is a no-op that keeps tmp_path
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class ImageCache:
+    """
+    Size-bounded LRU cache of downloaded imagery shared by every element (sidewalk, street_buffer,
+    bike_lane, street_parking), so an image requested with the same normalized parameters is
+    downloaded once per cache directory.
+
+    Files are named by the SHA-256 of their image_key; an SQLite index (WAL mode, so many readers
+    in several processes and threads can use it at once) records their size and last access.
+    When `max_bytes` is exceeded, the least recently used images are deleted.
+    Images are handed to the elements as hard links where possible, so elements must replace
+    (never rewrite in place) their own copies.
+
+    Layout: <cache_dir>/index.sqlite, <cache_dir>/<digest[:2]>/<digest>.jpg
+    """
+
+    def __init__(self, cache_dir, max_bytes=None):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index_path = os.path.join(cache_dir, "index.sqlite")
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            "key TEXT PRIMARY KEY, digest TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn().execute("CREATE INDEX IF NOT EXISTS images_accessed ON images (accessed)")
+        self.hits = 0
+        self.misses = 0
+
+    def _conn(self):
+        """SQLite connection of the calling thread (connections are not shared across threads or forks)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.index_path, timeout=60, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def path_for(self, key):
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], f"{digest}.jpg")
+
+    def get(self, key):
+        """Return the path of the cached image for `key` (marking it recently used), or None on a miss."""
+        conn = self._conn()
+        path = self.path_for(key)
+        if conn.execute("SELECT 1 FROM images WHERE key = ?", (key,)).fetchone() is None:
+            self.misses += 1
+            return None
+        if not os.path.exists(path):
+            conn.execute("DELETE FROM images WHERE key = ?", (key,))
+            self.misses += 1
+            return None
+        conn.execute("UPDATE images SET accessed = ? WHERE key = ?", (time.time(), key))
+        self.hits += 1
+        return path
+
+    def copy_to(self, key, dst):
+        """Place the cached image for `key` at `dst`. Returns False on a miss."""
+        path = self.get(key)
+        if path is None:
+            return False
+        try:
+            _link_or_copy(path, dst)
+        except FileNotFoundError:  # evicted by another process in the meantime
+            return False
+        return True
+
+    def put(self, key, src):
+        """Add the image file `src` under `key`, then evict least recently used images over max_bytes."""
+        path = self.path_for(key)
+        _link_or_copy(src, path)
+        now = time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO images (key, digest, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+            (key, os.path.basename(path)[:-4], os.path.getsize(path), now, now),
+        )
+        if self.max_bytes is not None:
+            self.evict(self.max_bytes)
+        return path
+
+    def total_bytes(self):
+        return self._conn().execute("SELECT COALESCE(SUM(size), 0) FROM images").fetchone()[0]
+
+    def evict(self, max_bytes):
+        """Delete least recently used images until the cache holds at most `max_bytes`. Returns the number deleted."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")  # one evicting process at a time
+        try:
+            excess = conn.execute("SELECT COALESCE(SUM(size), 0) FROM images").fetchone()[0] - max_bytes
+            victims = []
+            if excess > 0:
+                for key, size in conn.execute("SELECT key, size FROM images ORDER BY accessed"):
+                    victims.append(key)
+                    excess -= size
+                    if excess <= 0:
+                        break
+                conn.executemany("DELETE FROM images WHERE key = ?", [(key,) for key in victims])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        for key in victims:
+            try:
+                os.remove(self.path_for(key))
+            except FileNotFoundError:
+                pass
+        return len(victims)
@@ -0,0 +1,198 @@
+import os
+import glob
+import json
+import time
+import uuid
+import pstats
+import cProfile
+import resource
+import threading
+import contextlib
+from multiprocessing import util
+
+import numpy as np
+import pandas as pd
+
+# Report of the calling process (set by activate(); stage() does nothing without one)
+_active = None
+
+# Per process: open report files and cProfile profilers ({(stage, thread id): Profile})
+_files = {}
+_profiles = {}
+_pid = None
+_lock = threading.Lock()
+_profiling = threading.local()   # .on: a profiler is running in this thread
+
+
+def _reset_after_fork():
+    """Drop file handles and profilers inherited from the parent process."""
+    global _pid
+    if _pid != os.getpid():
+        _files.clear()
+        _profiles.clear()
+        _pid = os.getpid()
+
+
+def peak_rss_mb():
+    """Peak resident set size of the calling process so far (MB)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class RunReport:
+    """
+    Machine-readable report of a run: one JSON line per stage call with its wall time, CPU time
+    (of the calling thread), peak RSS of the process, item count and the (link_id, side) it worked on.
+
+    Records of every thread and geometry worker process are appended to the same file, tagged with
+    the run's `run_id`; summary() turns them into one row per stage. Stages named in `profile`
+    ("all" for every stage) also run under cProfile; each process writes
+    <profile_dir>/<stage>-<pid>-<thread>.prof when it exits (merged by write_profiles()).
+
+    Pickles to its settings, so it can be handed to worker processes.
+    """
+
+    def __init__(self, path, run_id=None, profile=(), profile_dir=None):
+        self.path = path
+        self.run_id = run_id or f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self.profile = set(profile)
+        self.profile_dir = profile_dir or os.path.join(os.path.dirname(path) or ".", "profiles", self.run_id)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def __getstate__(self):
+        return {"path": self.path, "run_id": self.run_id, "profile": self.profile, "profile_dir": self.profile_dir}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def write(self, record):
+        """Append one record (a JSON line) to the report."""
+        line = json.dumps({"run_id": self.run_id, **record}, default=str) + "\n"
+        with _lock:
+            _reset_after_fork()
+            file = _files.get(self.path)
+            if file is None:
+                file = _files[self.path] = open(self.path, "a", buffering=1)
+            file.write(line)
+
+    def _profiler(self, name):
+        if not self.profile or ("all" not in self.profile and name not in self.profile):
+            return None
+        if getattr(_profiling, "on", False):  # nested stage: already covered by the outer profile
+            return None
+        with _lock:
+            _reset_after_fork()
+            if not _profiles:
+                # Dump when this process exits (pool workers skip atexit but run multiprocessing finalizers)
+                util.Finalize(None, _dump_profiles, args=(self.profile_dir,), exitpriority=10)
+            key = (name, threading.get_ident())
+            if key not in _profiles:
+                _profiles[key] = cProfile.Profile()
+            return _profiles[key]
+
+    @contextlib.contextmanager
+    def stage(self, name, link_id=None, side=None, items=None, **fields):
+        """
+        Time the block as one call of stage `name`. Yields the record, so the block can fill in
+        'items' (or other fields) once it knows them.
+        """
+        record = {"stage": name, "link_id": link_id, "side": side, "items": items, **fields}
+        profiler = self._profiler(name)
+        wall, cpu = time.perf_counter(), time.thread_time()
+        if profiler is not None:
+            try:
+                profiler.enable()
+                _profiling.on = True
+            except ValueError:  # another profiling tool is active
+                profiler = None
+        try:
+            yield record
+        except BaseException as exc:
+            record["error"] = repr(exc)
+            raise
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                _profiling.on = False
+            record.update(
+                wall_s=time.perf_counter() - wall, cpu_s=time.thread_time() - cpu, peak_rss_mb=peak_rss_mb(),
+                pid=os.getpid(), thread=threading.current_thread().name, end=time.time(),
+            )
+            self.write(record)
+
+    def records(self):
+        """This run's records as a DataFrame."""
+        if not os.path.exists(self.path):
+            return pd.DataFrame()
+        with open(self.path) as file:
+            rows = [json.loads(line) for line in file if line.strip()]
+        df = pd.DataFrame(rows)
+        return df[df["run_id"] == self.run_id].reset_index(drop=True) if not df.empty else df
+
+    def summary(self, run_stage="run"):
+        """
+        One row per stage: calls, items, wall/CPU totals, wall-time percentiles (ms) and peak RSS.
+        'busy' is the stage's summed wall time over the wall time of `run_stage`; stages running in
+        several threads or processes at once can exceed 1. Stages nest (e.g. plotting inside the
+        edge stages), so their times overlap.
+        """
+        df = self.records()
+        if df.empty:
+            return pd.DataFrame()
+        run_wall = df.loc[df["stage"] == run_stage, "wall_s"].sum() or np.nan
+        rows = []
+        for name, group in df.groupby("stage", sort=False):
+            wall_ms = group["wall_s"].to_numpy() * 1e3
+            rows.append({
+                "stage": name, "calls": len(group), "items": group["items"].fillna(0).sum(),
+                "wall_s": group["wall_s"].sum(), "cpu_s": group["cpu_s"].sum(),
+                "mean_ms": wall_ms.mean(), "p50_ms": np.percentile(wall_ms, 50), "p90_ms": np.percentile(wall_ms, 90),
+                "max_ms": wall_ms.max(), "busy": group["wall_s"].sum() / run_wall,
+                "peak_rss_mb": group["peak_rss_mb"].max(), "errors": int(group.get("error", pd.Series(dtype=object)).notna().sum()),
+            })
+        return pd.DataFrame(rows)
+
+    def write_summary(self):
+        """Print the summary table and save it as <report>_summary.csv; returns the table."""
+        table = self.summary()
+        if table.empty:
+            return table
+        table.to_csv(os.path.splitext(self.path)[0] + "_summary.csv", index=False)
+        with pd.option_context("display.width", 200, "display.max_columns", None):
+            print(table.to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+        return table
+
+    def write_profiles(self, top=15):
+        """Merge the cProfile dumps of all processes and threads into <profile_dir>/<stage>.prof and print the top functions."""
+        _dump_profiles(self.profile_dir)
+        merged = {}
+        for path in glob.glob(os.path.join(self.profile_dir, "*-*-*.prof")):
+            merged.setdefault(os.path.basename(path).rsplit("-", 2)[0], []).append(path)
+        for name, paths in sorted(merged.items()):
+            stats = pstats.Stats(*paths)
+            out_path = os.path.join(self.profile_dir, f"{name}.prof")
+            stats.dump_stats(out_path)
+            print(f"\n📈 Profile of '{name}' ({len(paths)} threads/processes) → {out_path}")
+            stats.sort_stats("cumulative").print_stats(top)
+
+
+def _dump_profiles(profile_dir):
+    """Write this process's profilers as <profile_dir>/<stage>-<pid>-<thread>.prof."""
+    with _lock:
+        if _pid != os.getpid() or not _profiles:
+            return
+        os.makedirs(profile_dir, exist_ok=True)
+        for (name, ident), profiler in _profiles.items():
+            profiler.dump_stats(os.path.join(profile_dir, f"{name}-{os.getpid()}-{ident}.prof"))
+
+
+def activate(report):
+    """Make `report` the report of the calling process (None turns instrumentation off)."""
+    global _active
+    _active = report
+
+
+def stage(name, link_id=None, side=None, items=None, **fields):
+    """RunReport.stage of the active report, or a no-op that yields a throwaway record."""
+    if _active is None:
+        return contextlib.nullcontext({})
+    return _active.stage(name, link_id=link_id, side=side, items=items, **fields)
@@ -1,160 +1,351 @@
 import os
+import time
+import argparse
 import warnings
-import torch
+from functools import partial
 import pandas as pd
 import numpy as np
+import pyarrow as pa
 
-from config import API_KEY, OUTPUT_DIR, GEOJSON_PATH
+from config import API_KEY, OUTPUT_DIR, GEOJSON_PATH, SEG_BATCH_SIZE, LINKS_PER_BATCH, DOWNLOAD_THREADS, GEOMETRY_WORKERS, QUEUE_SIZE, MASK_FORMAT, RUN_JOURNAL_PATH, RESULT_FORMAT, RESULT_DIR, RESULT_BATCH_ROWS, REPORT_PATH, SEG_ROI, GATE_MIN_SIDEWALK_FRACTION, IN_MEMORY_IMAGES, GEOMETRY_PARAMS, SEG_BACKEND, SEG_INT8, SEG_INPUT_SIZE
 from load_points import load_midpoints
-from download_image import download_images_for_temp
-from segmentation import load_segmentation_model, run_segmentation
+from download_image import download_images_for_temp, take_decoded, fetcher
+from segmentation import load_segmentation_model, segment_images, horizon_row
+from pipeline import run_pipeline
+from run_journal import RunJournal, resumable_download, resumable_segment, finished_link
+from result_sink import ParquetResultSink
+from instrumentation import RunReport, activate, stage
+from pano_gate import GateStats, rejected_units, timed_measure
 from sidewalk_processing import process_sidewalk_edges, estimate_sidewalk_width
 
 # Suppress PyTorch / Python warnings
 warnings.filterwarnings("ignore")
-torch._C._jit_set_profiling_mode(False)
-torch._C._jit_set_profiling_executor(False)
 
 # ==============================
 # Parameters
 # ==============================
 PITCH_VALUES = [0, -10]   # Pitches we want
 FOV = 70                  # Field of View (degrees)
+OUTPUT_COLUMNS = ["width", "error_code"]   # Results checkpointed per side in the run journal
+RESULT_SCHEMA = pa.schema([               # Columns saved per side
+    ("link_id", pa.string()), ("point_id", pa.int32()), ("bearing", pa.float64()), ("side", pa.string()),
+    ("pano_id", pa.string()), ("pano_lat", pa.float64()), ("pano_lon", pa.float64()),
+    ("pano_heading", pa.float64()), ("pano_date", pa.string()),
+    ("width", pa.float64()), ("error_code", pa.int8()),
+])
+
+
+def measure_link(temp_gdf, results, seg_results, journal=None, report=None, params=GEOMETRY_PARAMS):
+    """
+    Run edge detection and width estimation for one link.
+
+    Parameters:
+    - temp_gdf: Rows of the link (one per side).
+    - results: {(link_id, side, panoid, pitch): img_path} for the link's downloaded images.
+    - seg_results: {(link_id, side, panoid, pitch): mask} for the link's segmented images.
+    - journal: Optional RunJournal; sides with an 'edges' or 'width' checkpoint resume from it,
+      and newly finished stages are checkpointed.
+    - report: Optional RunReport receiving the stage timings (activated in the worker process).
+    - params: Edge detection and width thresholds (GEOMETRY_PARAMS; replay.py passes other values).
+
+    Returns:
+    - temp_gdf with 'width' and 'error_code' columns.
+    """
+    if report is not None:
+        activate(report)
+    print(f"\n=== Processing {temp_gdf['link_id'].iloc[0]} ({len(temp_gdf)} rows) ===")
+    unit_rows = {(row["link_id"], row["side"]): row for _, row in temp_gdf.iterrows()}
+
+    # ------------------------------
+    # Step 4: Extract sidewalk edges
+    # ------------------------------
+    print("\n⏳ Detecting sidewalk edges...")
+    edge_results = {}
+    error_map = {}
+    resumed_edges = set()
+    resumed_widths = {}
+
+    if journal is not None:
+        for unit, row in unit_rows.items():
+            widths = journal.load(row, "width")
+            if widths is not None:
+                resumed_widths[unit] = widths
+            edges = journal.load(row, "edges")
+            if edges is not None:
+                edge_results.update(edges["lines"])
+                error_map.update(edges["errors"])
+                resumed_edges.add(unit)
+
+    # Early rejection: sides whose first pitch shows (almost) no sidewalk are marked "no sidewalk" (error 0)
+    # without edge detection, like sides where edge detection finds none
+    gated = rejected_units(seg_results, PITCH_VALUES[0], GATE_MIN_SIDEWALK_FRACTION)
+    seg_results = {key: mask for key, mask in seg_results.items() if key[:2] not in gated}
+    for unit in gated:
+        error_map[unit] = 0
+
+    for key, mask in seg_results.items():
+        link_id, side, panoid, pitch = key
+        save_dir = os.path.dirname(results[key])
+
+        with stage("sidewalk_edges", link_id=link_id, side=side, pitch=pitch) as record:
+            lines_df, err = process_sidewalk_edges(mask, results[key], save_dir, pitch, params=params)
+            record["items"] = 0 if lines_df is None else len(lines_df)
+        if lines_df is not None:
+            edge_results[key] = lines_df
+            error_map[(link_id, side)] = None
+        else:
+            error_map[(link_id, side)] = err
+
+    if journal is not None:
+        for unit, row in unit_rows.items():
+            if unit not in resumed_edges and journal.done(row, "segmented"):
+                journal.record(row, "edges", {
+                    "lines": {key: df for key, df in edge_results.items() if key[:2] == unit},
+                    "errors": {unit: error_map[unit]} if unit in error_map else {},
+                })
+
+
+    # ------------------------------
+    # Step 5: Combine results per side
+    # ------------------------------
+    print("\n⏳ Combining results per side...")
+    width_results = {}
+    error_results = {}
+
+    grouped = pd.DataFrame(list(edge_results.keys()), columns=["link_id", "side", "panoid", "pitch"])
+    groups = dict(list(grouped.groupby(["link_id", "side"])))
+
+    # Every side with edges or an edge detection outcome, so sides without any edge rows
+    # (no sidewalk, failed detection) get their width / error code here too
+    for lid, side in dict.fromkeys(list(groups) + list(error_map)):
+        if (lid, side) in resumed_widths:
+            continue
+        combined_lines = pd.DataFrame()
+        for _, row in groups.get((lid, side), grouped.iloc[:0]).iterrows():
+            key = (row["link_id"], row["side"], row["panoid"], row["pitch"])
+            if key in edge_results:
+                lines_df = edge_results[key].copy()
+                lines_df["pitch"] = row["pitch"]
+                combined_lines = pd.concat([combined_lines, lines_df], ignore_index=True)
+
+        if combined_lines.empty:
+            if error_map.get((lid, side)) == 0:
+                width_results[(lid, side)] = 0  # no sidewalk → width=0
+                error_results[(lid, side)] = None
+            else:
+                width_results[(lid, side)] = None
+                error_results[(lid, side)] = error_map.get((lid, side), 1)
+            continue
+
+        save_dir = os.path.dirname(results[(lid, side, row["panoid"], row["pitch"])])
+        with stage("width", link_id=lid, side=side, items=len(combined_lines)):
+            width = estimate_sidewalk_width(combined_lines, save_dir, link_id=lid, side=side)
+
+        if width is None:
+            width_results[(lid, side)] = None
+            error_results[(lid, side)] = 3
+        elif width < 0:
+            width_results[(lid, side)] = None
+            error_results[(lid, side)] = 4
+        else:
+            width_results[(lid, side)] = width
+            error_results[(lid, side)] = None
+
+    # ------------------------------
+    # Step 6: Merge widths back into temp_gdf
+    # ------------------------------
+    temp_gdf["width"] = np.nan
+    temp_gdf["error_code"] = None
+
+    for idx, row in temp_gdf.iterrows():
+        key = (row["link_id"], row["side"])
+        if key in resumed_widths:
+            for col in OUTPUT_COLUMNS:
+                temp_gdf.at[idx, col] = resumed_widths[key][col]
+            continue
+
+        width_val = width_results.get(key, None)
+        err_val = error_results.get(key, None)
+
+        if width_val is not None:
+            temp_gdf.at[idx, "width"] = round(width_val, 2)
+        elif width_val == 0:
+            temp_gdf.at[idx, "width"] = 0
+        else:
+            temp_gdf.at[idx, "width"] = np.nan
+
+        temp_gdf.at[idx, "error_code"] = err_val
+        if journal is not None and journal.done(row, "edges"):
+            journal.record(row, "width", {col: temp_gdf.at[idx, col] for col in OUTPUT_COLUMNS})
+
+    print(temp_gdf[["link_id", "side", "width", "error_code"]])
+    return temp_gdf
+
+
+def link_output_path(temp_gdf):
+    """OUTPUT_DIR/<first panoid>.csv of one link."""
+    return os.path.join(OUTPUT_DIR, f"{temp_gdf['pano_id'].iloc[0]}.csv")
+
+
+def save_link(temp_gdf, sink=None):
+    """Step 7: Save results of one link to the ParquetResultSink `sink`, or as OUTPUT_DIR/<first panoid>.csv."""
+    cols_to_keep = RESULT_SCHEMA.names
+
+    with stage("save", link_id=temp_gdf["link_id"].iloc[0], items=len(temp_gdf)):
+        if sink is not None:
+            sink.append(temp_gdf[cols_to_keep])
+            print(f"✅ Saved {temp_gdf['link_id'].iloc[0]} to {sink.result_dir}")
+            return
+
+        output_path = link_output_path(temp_gdf)
+        temp_gdf[cols_to_keep].to_csv(output_path, index=False)
+        print(f"✅ Saved {output_path}")
+
 
 # ==============================
 # Main Entry
 # ==============================
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimate sidewalk widths for the points in GEOJSON_PATH (see config.py).")
+    parser.add_argument("--profile", nargs="+", default=[], metavar="STAGE",
+                        help="Also run these stages under cProfile ('all' for every stage): "
+                             "model, download, segmentation, sidewalk_edges, width, plotting, save")
+    args = parser.parse_args()
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    # Per-stage timings (wall/CPU time, peak RSS, item counts) as JSON lines
+    report = None
+    if REPORT_PATH or args.profile:
+        report = RunReport(REPORT_PATH or os.path.join(OUTPUT_DIR, "reports", "run_report.jsonl"), profile=args.profile)
+        activate(report)
+        print(f"📊 Run report: {report.path} (run {report.run_id})")
+
     # ------------------------------
     # Step 0: Load candidate points
     # ------------------------------
     print("⏳ Loading midpoints...")
     link_groups = load_midpoints(GEOJSON_PATH)
 
+    # ------------------------------
+    # Resume: skip links finished by an earlier (interrupted) run
+    # ------------------------------
+    sink = ParquetResultSink(RESULT_DIR, RESULT_SCHEMA, batch_rows=RESULT_BATCH_ROWS) if RESULT_FORMAT == "parquet" else None
+    journal = None
+    if RUN_JOURNAL_PATH:
+        saved_links = sink.links() if sink is not None else None
+        params = {"element": "sidewalk", "pitch_values": PITCH_VALUES, "fov": FOV}
+        if GATE_MIN_SIDEWALK_FRACTION is not None:
+            params["gate"] = GATE_MIN_SIDEWALK_FRACTION  # changes which pitches are segmented
+        params["seg_backend"] = SEG_BACKEND  # masks of another backend are segmented again
+        if SEG_BACKEND != "mmseg":
+            params["seg_int8"], params["seg_input_size"] = SEG_INT8, SEG_INPUT_SIZE
+        if SEG_ROI is not None:
+            params["seg_roi"] = SEG_ROI  # masks cropped to another band are segmented again
+        params["geometry"] = GEOMETRY_PARAMS  # links measured with other thresholds are processed again
+        journal = RunJournal(RUN_JOURNAL_PATH, params=params)
+        pending = {}
+        for link_id, temp_gdf in link_groups.items():
+            done_gdf = finished_link(journal, temp_gdf, OUTPUT_COLUMNS)
+            if done_gdf is None:
+                pending[link_id] = temp_gdf
+            elif sink is not None and str(link_id) not in saved_links:
+                save_link(done_gdf, sink)
+            elif sink is None and not os.path.exists(link_output_path(done_gdf)):
+                save_link(done_gdf)
+        print(f"♻️ Run journal: {len(link_groups) - len(pending)} links already finished, {len(pending)} to process")
+        link_groups = pending
+    unit_rows = {(row["link_id"], row["side"]): row for temp_gdf in link_groups.values() for _, row in temp_gdf.iterrows()}
+
     # ------------------------------
     # Step 1: Load segmentation model once
     # ------------------------------
     print("\n⏳ Loading segmentation model...")
-    model = load_segmentation_model()
+    with stage("model"):
+        model = load_segmentation_model()
+    if SEG_ROI is not None and SEG_ROI[0] > horizon_row(min(PITCH_VALUES), FOV):
+        print(f"⚠️ SEG_ROI starts at row {SEG_ROI[0]}, below the horizon at pitch {min(PITCH_VALUES)} "
+              f"(row {horizon_row(min(PITCH_VALUES), FOV):.0f}); edges above it are not segmented")
 
     # ------------------------------
-    # Process each link_id separately
+    # Steps 2-7: Stream links through download → segmentation → edges/widths → output
+    # (stages run concurrently with bounded queues; segmentation batches span several links)
     # ------------------------------
-    for link_id, temp_gdf in link_groups.items():
-        print(f"\n=== Processing {link_id} ({len(temp_gdf)} rows) ===")
-
-        # ------------------------------
-        # Step 2: Download Street View images
-        # ------------------------------
-        print("\n⏳ Downloading Street View images...")
-        results = download_images_for_temp(temp_gdf, pitch_values=PITCH_VALUES, fov=FOV)
-
-        # ------------------------------
-        # Step 3: Run segmentation
-        # ------------------------------
+    # Early rejection: only the first pitch is downloaded and segmented up front; the other pitches
+    # only for sides whose first-pitch mask shows enough sidewalk
+    gate_stats = GateStats() if GATE_MIN_SIDEWALK_FRACTION is not None else None
+    first_pitches = PITCH_VALUES[:1] if gate_stats is not None else PITCH_VALUES
+
+    def download_rows(rows, pitch_values=PITCH_VALUES):
+        print(f"\n=== Downloading {rows['link_id'].iloc[0]} ({len(rows)} rows) ===")
+        t0 = time.perf_counter()
+        with stage("download", link_id=rows["link_id"].iloc[0]) as record:
+            img_results = download_images_for_temp(rows, pitch_values=pitch_values, fov=FOV)
+            record["items"] = len(img_results)
+        if gate_stats is not None:
+            gate_stats.add_time("download", time.perf_counter() - t0, len(img_results))
+        return img_results
+
+    def segment_all(img_results, images=None):
         print("\n⏳ Running segmentation on downloaded images...")
-        seg_results = {}
-        for key, img_path in results.items():
-            link_id, side, panoid, pitch = key
-            save_dir = os.path.dirname(img_path)
-
-            pixel_df = run_segmentation(model, img_path, save_dir)
-            if pixel_df is None or pixel_df.empty:
-                print(f"⚠️ Skipping segmentation for {img_path} (empty result).")
-                continue
-
-            seg_results[key] = pixel_df
-            print(f"✅ Segmentation done for {img_path}")
-
-        print(f"\n🎉 Total images segmented: {len(seg_results)}")
-
-        # ------------------------------
-        # Step 4: Extract sidewalk edges
-        # ------------------------------
-        print("\n⏳ Detecting sidewalk edges...")
-        edge_results = {}
-        error_map = {}
-        
-        for key, pixel_df in seg_results.items():
-            link_id, side, panoid, pitch = key
-            save_dir = os.path.dirname(results[key])
-
-            lines_df, err = process_sidewalk_edges(pixel_df, results[key], save_dir, pitch)
-            if lines_df is not None:
-                edge_results[key] = lines_df
-                error_map[(link_id, side)] = None
-            else:
-                error_map[(link_id, side)] = err
-
-
-        # ------------------------------
-        # Step 5: Combine results per side
-        # ------------------------------
-        print("\n⏳ Combining results per side...")
-        width_results = {}
-        error_results = {}
-        
-        grouped = pd.DataFrame(list(edge_results.keys()), columns=["link_id", "side", "panoid", "pitch"])
-
-        for (lid, side), group in grouped.groupby(["link_id", "side"]):
-            combined_lines = pd.DataFrame()
-            for _, row in group.iterrows():
-                key = (row["link_id"], row["side"], row["panoid"], row["pitch"])
-                if key in edge_results:
-                    lines_df = edge_results[key].copy()
-                    lines_df["pitch"] = row["pitch"]
-                    combined_lines = pd.concat([combined_lines, lines_df], ignore_index=True)
-
-            if combined_lines.empty:
-                if error_map.get((lid, side)) == 0:
-                    width_results[(lid, side)] = 0  # no sidewalk → width=0
-                    error_results[(lid, side)] = None
-                else:
-                    width_results[(lid, side)] = None
-                    error_results[(lid, side)] = error_map.get((lid, side), 1)
-                continue
-
-            save_dir = os.path.dirname(results[(lid, side, row["panoid"], row["pitch"])])
-            width = estimate_sidewalk_width(combined_lines, save_dir, link_id=lid, side=side)
+        t0 = time.perf_counter()
+        with stage("segmentation", items=len(img_results), links=len({key[0] for key in img_results})):
+            seg_results = segment_images(model, img_results, batch_size=SEG_BATCH_SIZE, images=images)
+        if gate_stats is not None:
+            gate_stats.add_time("segmentation", time.perf_counter() - t0, len(img_results))
+        return seg_results
 
-            if width is None:
-                width_results[(lid, side)] = None
-                error_results[(lid, side)] = 3
-            elif width < 0:
-                width_results[(lid, side)] = None
-                error_results[(lid, side)] = 4
-            else:
-                width_results[(lid, side)] = width
-                error_results[(lid, side)] = None
+    def download(temp_gdf):
+        return resumable_download(journal, temp_gdf, partial(download_rows, pitch_values=first_pitches),
+                                  n_images=len(first_pitches))
 
-        # ------------------------------
-        # Step 6: Merge widths back into temp_gdf
-        # ------------------------------
-        temp_gdf["width"] = np.nan
-        temp_gdf["error_code"] = None
-
-        for idx, row in temp_gdf.iterrows():
-            key = (row["link_id"], row["side"])
-            width_val = width_results.get(key, None)
-            err_val = error_results.get(key, None)
-
-            if width_val is not None:
-                temp_gdf.at[idx, "width"] = round(width_val, 2)
-            elif width_val == 0:
-                temp_gdf.at[idx, "width"] = 0
-            else:
-                temp_gdf.at[idx, "width"] = np.nan
+    def gate(temp_gdf, results, seg_results):
+        """Rows of a link that pass the gate and need their other pitches."""
+        rejected = rejected_units(seg_results, PITCH_VALUES[0], GATE_MIN_SIDEWALK_FRACTION)
+        gate_stats.add_gate(len(temp_gdf), len(rejected), len(PITCH_VALUES))
+        keep = [
+            (row["link_id"], row["side"]) not in rejected and not (journal is not None and journal.done(row, "edges"))
+            for _, row in temp_gdf.iterrows()
+        ]
+        return temp_gdf[keep]
 
-            temp_gdf.at[idx, "error_code"] = err_val
+    def download_more(rows):
+        return download_rows(rows, pitch_values=PITCH_VALUES[1:])
 
-        print(temp_gdf[["link_id", "side", "width", "error_code"]])
+    def segment(img_results):
+        # Images decoded at download (IN_MEMORY_IMAGES) are taken here, also for units the journal skips
+        images = take_decoded(img_results) if IN_MEMORY_IMAGES else None
+        return resumable_segment(journal, unit_rows, img_results, partial(segment_all, images=images), MASK_FORMAT)
 
-        # ------------------------------
-        # Step 7: Save results per panoid
-        # ------------------------------
-        cols_to_keep = ["link_id", "point_id", "bearing", "side", "pano_id", "pano_lat", "pano_lon", "pano_heading", "pano_date", "width", "error_code"]
+    measure = partial(measure_link, journal=journal, report=report)
+    save = partial(save_link, sink=sink)
+    if gate_stats is not None:
+        measure = partial(timed_measure, measure, PITCH_VALUES[0], GATE_MIN_SIDEWALK_FRACTION)
+        save = gate_stats.saving(save)
 
-        panoid = temp_gdf["pano_id"].iloc[0]
-        output_path = os.path.join(OUTPUT_DIR, f"{panoid}.csv")
-        temp_gdf[cols_to_keep].to_csv(output_path, index=False)
-        print(f"✅ Saved {output_path}")
\ No newline at end of file
+    try:
+        with stage("run", items=len(link_groups)):
+            n_links = run_pipeline(
+                link_groups.items(), download, segment, measure, save,
+                download_threads=DOWNLOAD_THREADS,
+                geometry_workers=GEOMETRY_WORKERS,
+                queue_size=QUEUE_SIZE,
+                images_per_batch=SEG_BATCH_SIZE,
+                links_per_batch=LINKS_PER_BATCH,
+                gate=gate if gate_stats is not None else None,
+                download_more=download_more,
+            )
+    finally:
+        fetcher.close()  # waits for downloads still being written in the background
+        if sink is not None:
+            sink.close()
+    if sink is not None:
+        print(f"✅ Results: {sink.compact()}")
+    print(f"\n🎉 Total links processed: {n_links}")
+    if gate_stats is not None:
+        gate_stats.print_summary()
+
+    if report is not None:
+        print(f"\n📊 Stage summary (run {report.run_id}):")
+        report.write_summary()
+        if args.profile:
+            report.write_profiles()
\ No newline at end of file
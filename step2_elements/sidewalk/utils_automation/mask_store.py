@@ -0,0 +1,134 @@
+import os
+import re
+import numpy as np
+import pandas as pd
+import cv2
+
+# Supported on-disk mask formats:
+# - "npy": raw uint8 array, can be memory-mapped (fastest reads)
+# - "png": lossless single-channel PNG (smallest files)
+MASK_FORMATS = ("npy", "png")
+
+_MASK_NAME_RE = re.compile(
+    r"pitch(?P<pitch>-?\d+)_heading(?P<heading>[-\d.]+?)(?:_fov(?P<fov>[\d.]+))?_mask\.(?P<fmt>npy|png)$"
+)
+# Per-pixel CSVs written next to the images by older versions of run_segmentation
+_PIXEL_CSV_NAME_RE = re.compile(
+    r"pitch(?P<pitch>-?\d+)_heading(?P<heading>[-\d.]+?)(?:_fov(?P<fov>[\d.]+))?_pixel_categories\.csv$"
+)
+
+
+def mask_path(root, pano_id, side, heading, pitch, fov=None, fmt="npy"):
+    """
+    Return the store path of the mask for one (pano_id, side, heading, pitch, fov) image.
+
+    Layout mirrors the image folders: <root>/<pano_id>/<side>/pitch{pitch}_heading{heading}[_fov{fov}]_mask.<fmt>
+    """
+    if fmt not in MASK_FORMATS:
+        raise ValueError(f"Unknown mask format '{fmt}', expected one of {MASK_FORMATS}")
+    name = f"pitch{pitch}_heading{heading}"
+    if fov is not None:
+        # Same text as image_cache keys: whole numbers without decimals, fractional fovs kept (90.5 != 90)
+        fov = float(fov)
+        name += f"_fov{int(fov) if fov.is_integer() else fov}"
+    return os.path.join(root, str(pano_id), side, f"{name}_mask.{fmt}")
+
+
+def mask_path_for_image(img_path, fmt="npy"):
+    """Return the mask path stored next to a downloaded image (same key as the image)."""
+    if fmt not in MASK_FORMATS:
+        raise ValueError(f"Unknown mask format '{fmt}', expected one of {MASK_FORMATS}")
+    return os.path.splitext(img_path)[0] + f"_mask.{fmt}"
+
+
+def parse_mask_path(path, pattern=_MASK_NAME_RE):
+    """
+    Recover the key of a stored mask from its path.
+
+    Returns:
+    - dict with 'pano_id', 'side', 'heading', 'pitch', 'fov' (None if absent), or None if not a mask file.
+    """
+    match = pattern.match(os.path.basename(path))
+    if match is None:
+        return None
+    side_dir = os.path.dirname(path)
+    return {
+        "pano_id": os.path.basename(os.path.dirname(side_dir)),
+        "side": os.path.basename(side_dir),
+        "heading": float(match["heading"]),
+        "pitch": int(match["pitch"]),
+        "fov": float(match["fov"]) if match["fov"] else None,
+    }
+
+
+def save_mask(mask, path):
+    """
+    Save a (H, W) uint8 label-index mask. The format is taken from the file extension.
+    The file is written to a temporary name first, so readers never see a partial mask.
+    """
+    mask = np.ascontiguousarray(mask, dtype=np.uint8)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+
+    if path.endswith(".png"):
+        ok, buf = cv2.imencode(".png", mask)
+        if not ok:
+            raise IOError(f"Could not encode mask as PNG: {path}")
+        with open(tmp_path, "wb") as f:
+            f.write(buf.tobytes())
+    elif path.endswith(".npy"):
+        with open(tmp_path, "wb") as f:
+            np.save(f, mask)
+    else:
+        raise ValueError(f"Unknown mask format for {path}, expected one of {MASK_FORMATS}")
+
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_mask(path, mmap=True):
+    """
+    Load a stored mask as a (H, W) uint8 array.
+    `.npy` masks are memory-mapped read-only when `mmap` is True, so only the touched pages are read.
+    """
+    if path.endswith(".npy"):
+        return np.load(path, mmap_mode="r" if mmap else None)
+    if path.endswith(".png"):
+        mask = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        if mask is None:
+            raise IOError(f"Could not read mask: {path}")
+        return mask
+    raise ValueError(f"Unknown mask format for {path}, expected one of {MASK_FORMATS}")
+
+
+def iter_masks(root):
+    """Yield (path, key) for every stored mask under `root`."""
+    for dirpath, _, filenames in os.walk(root):
+        for fname in sorted(filenames):
+            key = parse_mask_path(os.path.join(dirpath, fname))
+            if key is not None:
+                yield os.path.join(dirpath, fname), key
+
+
+def iter_pixel_categories_csvs(root):
+    """Yield (path, key) for every legacy `*_pixel_categories.csv` under `root` (keys as in iter_masks)."""
+    for dirpath, _, filenames in os.walk(root):
+        for fname in sorted(filenames):
+            key = parse_mask_path(os.path.join(dirpath, fname), _PIXEL_CSV_NAME_RE)
+            if key is not None:
+                yield os.path.join(dirpath, fname), key
+
+
+def load_pixel_categories_csv(csv_path, labels):
+    """
+    Read a legacy `*_pixel_categories.csv` (one x, y, label row per pixel) into a label-index mask.
+
+    Parameters:
+    - csv_path: Path to the CSV written by older versions of run_segmentation.
+    - labels: Array of label names; the mask stores each pixel's index into it.
+    """
+    pixel_df = pd.read_csv(csv_path, usecols=["x", "y", "label"])
+    codes = pd.Categorical(pixel_df["label"], categories=list(labels)).codes
+    mask = np.zeros((pixel_df["y"].max() + 1, pixel_df["x"].max() + 1), dtype=np.uint8)
+    mask[pixel_df["y"].to_numpy(), pixel_df["x"].to_numpy()] = codes
+    return mask
@@ -0,0 +1,96 @@
+import time
+import threading
+
+import numpy as np
+
+from config import LABEL_INDEX
+
+
+def label_fractions(mask, labels=("sidewalk", "road")):
+    """Pixel fraction of each label in a label-index mask (one bincount over the mask)."""
+    mask = np.asarray(mask)
+    counts = np.bincount(mask.ravel(), minlength=256)
+    return {label: counts[LABEL_INDEX[label]] / mask.size for label in labels}
+
+
+def rejected_units(seg_results, gate_pitch, min_sidewalk_fraction):
+    """
+    (link_id, side) units whose `gate_pitch` mask has less than `min_sidewalk_fraction` sidewalk pixels
+    (empty set when the gate is off). Their other pitches are not needed: they get error code 0.
+    """
+    if min_sidewalk_fraction is None:
+        return set()
+    return {
+        (key[0], key[1]) for key, mask in seg_results.items()
+        if key[3] == gate_pitch and label_fractions(mask, ("sidewalk",))["sidewalk"] < min_sidewalk_fraction
+    }
+
+
+def timed_measure(measure, gate_pitch, min_sidewalk_fraction, temp_gdf, results, seg_results):
+    """
+    measure(temp_gdf, results, seg_results), plus its wall time and the number of masks it ran edge
+    detection on, so GateStats can price the geometry the gate skips. Runs in the geometry workers.
+    """
+    t0 = time.perf_counter()
+    measured = measure(temp_gdf, results, seg_results)
+    gated = rejected_units(seg_results, gate_pitch, min_sidewalk_fraction)
+    n_masks = sum(1 for key in seg_results if key[:2] not in gated)
+    return measured, time.perf_counter() - t0, n_masks
+
+
+class GateStats:
+    """
+    What early rejection saved in a run: sides checked and rejected, images not downloaded (API calls),
+    masks not segmented and masks not sent to edge detection. Seconds saved are estimated from this
+    run's measured cost per image of download, segmentation and geometry (work summed over the
+    concurrent stages, not the run's wall time).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sides = 0
+        self.rejected = 0
+        self.skipped_images = 0
+        self.skipped_masks = 0
+        self._time = {"download": [0.0, 0], "segmentation": [0.0, 0], "geometry": [0.0, 0]}
+
+    def add_time(self, stage, seconds, n_items):
+        """Add the wall time of one call of `stage` ('download', 'segmentation' or 'geometry') over n_items."""
+        with self._lock:
+            self._time[stage][0] += seconds
+            self._time[stage][1] += n_items
+
+    def add_gate(self, n_sides, n_rejected, n_pitches):
+        """Count one link's gate decision; each rejected side skips n_pitches - 1 images and all n_pitches edge detections."""
+        with self._lock:
+            self.sides += n_sides
+            self.rejected += n_rejected
+            self.skipped_images += n_rejected * (n_pitches - 1)
+            self.skipped_masks += n_rejected * n_pitches
+
+    def saving(self, save):
+        """Wrap save(temp_gdf) to take timed_measure()'s results, recording the geometry time."""
+        def save_measured(measured):
+            temp_gdf, seconds, n_masks = measured
+            self.add_time("geometry", seconds, n_masks)
+            return save(temp_gdf)
+        return save_measured
+
+    def per_item(self, stage):
+        seconds, n_items = self._time[stage]
+        return seconds / n_items if n_items else 0.0
+
+    def summary(self):
+        saved_s = (self.skipped_images * (self.per_item("download") + self.per_item("segmentation"))
+                   + self.skipped_masks * self.per_item("geometry"))
+        return {
+            "sides": self.sides, "rejected": self.rejected, "api_calls_saved": self.skipped_images,
+            "segmentations_saved": self.skipped_images, "edge_detections_saved": self.skipped_masks,
+            "seconds_saved": saved_s,
+        }
+
+    def print_summary(self):
+        s = self.summary()
+        print(f"🚧 Early rejection: {s['rejected']}/{s['sides']} sides rejected on their first pitch; "
+              f"saved {s['api_calls_saved']} API calls, {s['segmentations_saved']} segmentations and "
+              f"{s['edge_detections_saved']} edge detections (≈ {s['seconds_saved']:.1f} s)")
@@ -0,0 +1,128 @@
+import os
+import pickle
+import numpy as np
+
+from config import PLOT_MODE
+from instrumentation import stage
+
+# Suffix of the plot specs written in "deferred" mode (next to where the figure would be saved)
+PLOT_SPEC_SUFFIX = ".plot.pkl"
+
+# Cityscapes palette (RGB), indexed like config.LABELS
+CITYSCAPES_PALETTE = np.array([
+    [128, 64, 128], [244, 35, 232], [70, 70, 70], [102, 102, 156], [190, 153, 153], [153, 153, 153],
+    [250, 170, 30], [220, 220, 0], [107, 142, 35], [152, 251, 152], [70, 130, 180], [220, 20, 60],
+    [255, 0, 0], [0, 0, 142], [0, 0, 70], [0, 60, 100], [0, 80, 100], [0, 0, 230], [119, 11, 32]
+], dtype=np.uint8)
+
+
+def pyplot():
+    """matplotlib.pyplot, imported on the first figure drawn (runs with PLOT_MODE "off" never load it)."""
+    import matplotlib
+    matplotlib.use("Agg")  # Figures are only saved to disk, never shown
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def plot_segmented_overlay(out_path, img_path, mask_path, img=None):
+    """
+    Draw the segmentation mask over its image (deferred replacement of mmseg's show_result_pyplot).
+    `img` is the BGR image if it is already in memory (otherwise it is read from img_path).
+    """
+    import cv2
+    from mask_store import load_mask
+
+    img = cv2.cvtColor(cv2.imread(img_path) if img is None else img, cv2.COLOR_BGR2RGB)
+    mask = np.asarray(load_mask(mask_path))
+    palette = np.vstack([CITYSCAPES_PALETTE, np.zeros((256 - len(CITYSCAPES_PALETTE), 3), np.uint8)])
+    overlay = (0.5 * img + 0.5 * palette[mask]).astype(np.uint8)
+
+    plt = pyplot()
+    plt.figure(figsize=(8, 6))
+    plt.imshow(overlay)
+    plt.axis("off")
+    plt.savefig(out_path, bbox_inches='tight', pad_inches=0)
+    plt.close()
+
+
+def plot_final_lines(out_path, lines_df, shape, color='lime'):
+    """Draw the segmented edge lines of one image on a black canvas (*_final_lines.jpg)."""
+    plt = pyplot()
+    plt.figure(figsize=(10, 10))
+    plt.imshow(np.zeros(shape, dtype=np.uint8), cmap='gray')
+    for _, r in lines_df.iterrows():
+        plt.plot([r['x1'], r['x2']], [r['y1'], r['y2']], color=color, linewidth=2)
+    plt.gca()
+    plt.savefig(out_path, bbox_inches='tight', pad_inches=0)
+    plt.close()
+
+
+def plot_top_bottom_edges(out_path, lines_df):
+    """Draw the top/bottom edges of both pitches against the central line (top_bottom_edges.jpg)."""
+    plt = pyplot()
+    plt.figure(figsize=(6.4, 6.4))
+    cases = lines_df['case'].unique()
+    color_map = plt.get_cmap('tab10')
+    for _, row in lines_df.iterrows():
+        color = color_map(cases.tolist().index(row['case']))
+        plt.plot([row['x1'], row['x2']], [row['y1'], row['y2']], color=color, linewidth=2)
+    plt.axhline(y=320, color='red', linestyle='--', label='Central Line (y = 320)', linewidth=1.5)
+    plt.xlim([0, 640])
+    plt.ylim([0, 640])
+    plt.gca().invert_yaxis()
+    plt.xlabel('X')
+    plt.ylabel('Y')
+    plt.title('Lines with Central Line and dist_btwn Labels (No Decimal Points)')
+    plt.grid(True)
+    plt.legend()
+    plt.savefig(out_path, bbox_inches='tight', pad_inches=0)
+    plt.close()
+
+
+PLOTTERS = {
+    "segmented_overlay": plot_segmented_overlay,
+    "final_lines": plot_final_lines,
+    "top_bottom_edges": plot_top_bottom_edges,
+}
+
+
+def emit_plot(kind, out_path, **data):
+    """
+    Produce a debug figure according to PLOT_MODE.
+
+    - "full": draw and save the figure now.
+    - "off": skip it (headless fast mode).
+    - "deferred": pickle the figure's data next to `out_path` (+ PLOT_SPEC_SUFFIX) so
+      render_plots.py can draw it later, in parallel and only for the links that need it.
+
+    Returns:
+    - out_path if the figure was saved now, otherwise None.
+    """
+    if PLOT_MODE == "off":
+        return None
+    with stage("plotting", kind=kind, mode=PLOT_MODE):
+        if PLOT_MODE == "deferred":
+            save_plot_spec(kind, out_path, **data)
+            return None
+        PLOTTERS[kind](out_path, **data)
+    return out_path
+
+
+def save_plot_spec(kind, out_path, **data):
+    """Write the data needed to draw one figure later."""
+    spec_path = out_path + PLOT_SPEC_SUFFIX
+    tmp_path = f"{spec_path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        pickle.dump({"kind": kind, "out_path": out_path, "data": data}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, spec_path)
+    return spec_path
+
+
+def render_plot_spec(spec_path, keep_spec=False):
+    """Draw the figure described by a deferred plot spec and return the figure path."""
+    with open(spec_path, "rb") as f:
+        spec = pickle.load(f)
+    PLOTTERS[spec["kind"]](spec["out_path"], **spec["data"])
+    if not keep_spec:
+        os.remove(spec_path)
+    return spec["out_path"]
@@ -0,0 +1,158 @@
+import os
+import re
+import sys
+import glob
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from config import OUTPUT_DIR, GEOJSON_PATH, GEOMETRY_PARAMS, LABELS
+from load_points import load_midpoints
+from download_image import adjust_heading
+from mask_store import iter_masks, iter_pixel_categories_csvs, load_mask, load_pixel_categories_csv
+from result_sink import ParquetResultSink, read_results
+import plotting
+from main import PITCH_VALUES, RESULT_SCHEMA, measure_link, save_link
+
+# A stored mask matches a link's image when its heading is within this of adjust_heading() (degrees)
+HEADING_TOLERANCE = 0.5
+
+
+def parse_params(params_file=None, overrides=()):
+    """
+    GEOMETRY_PARAMS updated from a JSON file of {name: value} and then from NAME=VALUE strings
+    (values parsed as JSON, so numbers stay numbers). Unknown names raise a ValueError.
+    """
+    params = dict(GEOMETRY_PARAMS)
+    updates = {}
+    if params_file:
+        with open(params_file) as f:
+            updates.update(json.load(f))
+    for item in overrides:
+        name, sep, value = item.partition("=")
+        if not sep:
+            raise ValueError(f"Expected NAME=VALUE, got '{item}'")
+        try:
+            updates[name.strip()] = json.loads(value)
+        except json.JSONDecodeError:
+            updates[name.strip()] = value
+    unknown = sorted(set(updates) - set(params))
+    if unknown:
+        raise ValueError(f"Unknown geometry parameters {unknown}, expected some of {sorted(params)}")
+    params.update(updates)
+    return params
+
+
+def index_masks(root):
+    """
+    {(pano_id, side, pitch): [(heading, path, fmt)]} of the stored masks under `root`, and of the legacy
+    `_pixel_categories.csv` files for images without a stored mask (fmt 'csv').
+    """
+    index = {}
+    for path, key in iter_masks(root):
+        index.setdefault((key["pano_id"], key["side"], key["pitch"]), []).append((key["heading"], path, "mask"))
+    for path, key in iter_pixel_categories_csvs(root):
+        entries = index.setdefault((key["pano_id"], key["side"], key["pitch"]), [])
+        if not any(abs(heading - key["heading"]) <= HEADING_TOLERANCE for heading, _, _ in entries):
+            entries.append((key["heading"], path, "csv"))
+    return index
+
+
+def mask_sources(temp_gdf, index, pitch_values=PITCH_VALUES):
+    """{(link_id, side, panoid, pitch): (path, fmt)} of the stored masks of one link's images."""
+    sources = {}
+    for _, row in temp_gdf.iterrows():
+        heading = adjust_heading(row["pano_heading"], row["bearing"])
+        for pitch in pitch_values:
+            candidates = [
+                (abs((h - heading + 180) % 360 - 180), path, fmt)
+                for h, path, fmt in index.get((str(row["pano_id"]), row["side"], pitch), [])
+            ]
+            if candidates:
+                diff, path, fmt = min(candidates)
+                if diff <= HEADING_TOLERANCE:
+                    sources[(row["link_id"], row["side"], row["pano_id"], pitch)] = (path, fmt)
+    return sources
+
+
+def image_path_for(path):
+    """Path of the downloaded image a stored mask or pixel CSV belongs to (only its folder and name are used)."""
+    return re.sub(r"(_mask\.(npy|png)|_pixel_categories\.csv)$", ".jpg", path)
+
+
+def _init_worker(verbose):
+    # Replays must not overwrite the debug figures of the pipeline run
+    plotting.PLOT_MODE = "off"
+    if not verbose:
+        sys.stdout = open(os.devnull, "w")
+
+
+def replay_link(temp_gdf, sources, params):
+    """measure_link() of one link on its stored masks. Runs in the worker processes."""
+    results = {key: image_path_for(path) for key, (path, fmt) in sources.items()}
+    seg_results = {
+        key: load_mask(path, mmap=False) if fmt == "mask" else load_pixel_categories_csv(path, LABELS)
+        for key, (path, fmt) in sources.items()
+    }
+    return measure_link(temp_gdf, results, seg_results, params=params)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute widths from the stored masks with other geometry parameters (no download or segmentation).")
+    parser.add_argument("masks", nargs="?", default=OUTPUT_DIR,
+                        help="Folder of stored masks (*_mask.npy/png) or legacy *_pixel_categories.csv files (default: config.OUTPUT_DIR)")
+    parser.add_argument("--out", required=True, help="Result folder (Parquet, RESULT_SCHEMA) of the replay; must be new or empty")
+    parser.add_argument("--overwrite", action="store_true", help="Delete the results and params.json already in --out first")
+    parser.add_argument("--csv", help="Also write the replayed result table to this CSV file")
+    parser.add_argument("--params", help="JSON file of {name: value} overrides of GEOMETRY_PARAMS")
+    parser.add_argument("--set", nargs="+", default=[], metavar="NAME=VALUE", help="Overrides of GEOMETRY_PARAMS (after --params)")
+    parser.add_argument("--geojson", default=GEOJSON_PATH, help="Points of the run (default: config.GEOJSON_PATH)")
+    parser.add_argument("--links", nargs="+", help="Only replay these link_ids")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--verbose", action="store_true", help="Show the workers' per-link output")
+    args = parser.parse_args()
+
+    params = parse_params(args.params, args.set)
+    changed = {name: value for name, value in params.items() if value != GEOMETRY_PARAMS[name]}
+    print(f"⚙️ Geometry parameters changed from config.py: {changed or 'none'}")
+
+    link_groups = load_midpoints(args.geojson)
+    if args.links:
+        link_groups = {lid: grp for lid, grp in link_groups.items() if str(lid) in args.links}
+    index = index_masks(args.masks)
+    jobs = {lid: mask_sources(grp, index) for lid, grp in link_groups.items()}
+    missing = [lid for lid, sources in jobs.items() if not sources]
+    jobs = {lid: sources for lid, sources in jobs.items() if sources}
+    print(f"⏳ Replaying {len(jobs)} links from {sum(len(s) for s in jobs.values())} stored masks "
+          f"({len(missing)} links without masks skipped)...")
+
+    # One replay per folder, so the table always matches its params.json
+    previous = glob.glob(os.path.join(args.out, "part-*.parquet")) + glob.glob(os.path.join(args.out, "params.json"))
+    if previous and not args.overwrite:
+        raise SystemExit(f"❌ {args.out} already holds a replay ({len(previous)} files); use another --out or --overwrite")
+    for path in previous:
+        os.remove(path)
+
+    sink = ParquetResultSink(args.out, RESULT_SCHEMA)
+    with open(os.path.join(args.out, "params.json"), "w") as f:
+        json.dump({"masks": os.path.abspath(args.masks), "params": params}, f, indent=2)
+
+    t0 = time.perf_counter()
+    failed = []
+    with ProcessPoolExecutor(max_workers=args.workers or os.cpu_count(), initializer=_init_worker,
+                             initargs=(args.verbose,)) as pool:
+        futures = {pool.submit(replay_link, link_groups[lid], sources, params): lid for lid, sources in jobs.items()}
+        for future in as_completed(futures):
+            try:
+                save_link(future.result(), sink)
+            except Exception as e:
+                failed.append(futures[future])
+                print(f"⚠️ {futures[future]}: {type(e).__name__}: {e}")
+    sink.compact()
+
+    if args.csv:
+        read_results(args.out, schema=RESULT_SCHEMA).to_csv(args.csv, index=False)
+        print(f"✅ Saved {args.csv}")
+    print(f"✅ Replayed {len(jobs) - len(failed)} links in {time.perf_counter() - t0:.1f}s "
+          f"({len(failed)} failed) → {args.out}")
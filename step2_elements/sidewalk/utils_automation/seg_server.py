@@ -0,0 +1,246 @@
+import os
+import json
+import time
+import errno
+import socket
+import signal
+import struct
+import argparse
+import threading
+import socketserver
+
+import cv2
+import numpy as np
+
+from config import SEG_SERVER_SOCKET, SEG_ROI
+
+# Messages: 4-byte big-endian header length, JSON header, then the binary payloads listed in header["sizes"]
+_HEADER = struct.Struct("!I")
+
+
+def _recv_exact(sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    while view:
+        k = sock.recv_into(view)
+        if k == 0:
+            raise ConnectionError("Segmentation server connection closed")
+        view = view[k:]
+    return buf
+
+
+def send_message(sock, header, payloads=()):
+    payloads = list(payloads)
+    data = json.dumps({**header, "sizes": [len(p) for p in payloads]}).encode()
+    sock.sendall(_HEADER.pack(len(data)) + data)
+    for payload in payloads:
+        sock.sendall(payload)
+
+
+def recv_message(sock):
+    """(header, payloads) of one message."""
+    (n,) = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    header = json.loads(_recv_exact(sock, n))
+    return header, [_recv_exact(sock, size) for size in header.pop("sizes")]
+
+
+def encode_mask(mask):
+    """Label-index mask → PNG bytes (lossless, a few KB for 640 x 640); b"" for an empty result."""
+    if mask is None:
+        return b""
+    ok, buf = cv2.imencode(".png", np.ascontiguousarray(mask, dtype=np.uint8))
+    if not ok:
+        raise IOError("Could not encode mask as PNG")
+    return buf.tobytes()
+
+
+def decode_mask(data):
+    if not data:
+        return None
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+
+
+class SegmentationClient:
+    """
+    Client of a running seg_server.py: segments images with the server's warm model, so a run
+    does not load the model itself. Usable wherever a model from load_segmentation_model() is
+    (segmentation.predict_masks sends it the images and the ROI band).
+
+    Images are sent as file paths (the server reads them) or as raw BGR arrays (images decoded
+    in memory); masks come back PNG-encoded. One connection, used by one request at a time.
+
+    Parameters:
+    - socket_path: Unix socket the server listens on (SEG_SERVER_SOCKET).
+    - timeout: Seconds to wait for a response.
+    """
+
+    def __init__(self, socket_path=SEG_SERVER_SOCKET, timeout=600):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._sock = None
+        self._lock = threading.Lock()
+        self.info = self._request({"op": "info"})[0]
+
+    @property
+    def tag(self):
+        return self.info["tag"]
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        return sock
+
+    def _request(self, header, payloads=()):
+        with self._lock:
+            if self._sock is None:
+                self._sock = self._connect()
+            try:
+                send_message(self._sock, header, payloads)
+                response, data = recv_message(self._sock)
+            except OSError:
+                self.close_connection()
+                raise
+        if "error" in response:
+            raise RuntimeError(f"Segmentation server: {response['error']}")
+        return response, data
+
+    def close_connection(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def predict(self, img_paths, roi=None, images=None):
+        """
+        Label-index masks (None for empty results) of the images, segmented by the server like
+        segmentation.predict_masks(model, img_paths, roi, images) would segment them locally.
+        """
+        items, payloads = [], []
+        for i, path in enumerate(img_paths):
+            img = images[i] if images is not None else None
+            if img is None:
+                items.append({"path": os.path.abspath(path)})
+            else:
+                img = np.ascontiguousarray(img, dtype=np.uint8)
+                items.append({"path": os.path.abspath(path), "shape": list(img.shape)})
+                payloads.append(img.reshape(-1).data)
+        _, data = self._request({"op": "predict", "images": items, "roi": list(roi) if roi else None}, payloads)
+        return [decode_mask(mask) for mask in data]
+
+
+def connect(socket_path=SEG_SERVER_SOCKET):
+    """SegmentationClient of the server at `socket_path`, or None if no server is listening there."""
+    if not socket_path or not os.path.exists(socket_path):
+        return None
+    try:
+        return SegmentationClient(socket_path)
+    except OSError as exc:
+        print(f"⚠️ No segmentation server at {socket_path} ({exc}); loading the model in this run")
+        return None
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    """One client connection: answer its requests until it disconnects."""
+
+    def handle(self):
+        while True:
+            try:
+                header, payloads = recv_message(self.request)
+            except ConnectionError:
+                return
+            try:
+                response, data = self.server.answer(header, payloads)
+            except Exception as exc:
+                response, data = {"error": f"{type(exc).__name__}: {exc}"}, []
+            send_message(self.request, response, data)
+
+
+class SegmentationServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Keeps segmentation models loaded (one per ROI band asked for) and segments the batches sent by
+    SegmentationClients of any element. Requests run one at a time on the model.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path):
+        super().__init__(socket_path, _Handler)
+        # Imported here so clients only need this module's light imports
+        import segmentation
+        self._segmentation = segmentation
+        self._models = {}
+        self._model_lock = threading.Lock()
+        self.requests = 0
+        self.images = 0
+
+    def model(self, roi):
+        roi = tuple(roi) if roi else None
+        if roi not in self._models:
+            t0 = time.perf_counter()
+            self._models[roi] = self._segmentation.load_segmentation_model(roi=roi, server=None)
+            print(f"✅ Model loaded for roi={roi} in {time.perf_counter() - t0:.1f} s")
+        return self._models[roi]
+
+    def answer(self, header, payloads):
+        if header["op"] == "info":
+            seg = self._segmentation
+            return {"tag": seg.model_tag(), "config_file": os.path.abspath(seg.CONFIG_FILE),
+                    "checkpoint_file": os.path.abspath(seg.CHECKPOINT_FILE),
+                    "pid": os.getpid(), "requests": self.requests, "images": self.images}, []
+        if header["op"] != "predict":
+            raise ValueError(f"Unknown op {header['op']!r}")
+
+        items, arrays = header["images"], iter(payloads)
+        paths = [item["path"] for item in items]
+        images = None
+        if any("shape" in item for item in items):
+            images = [np.frombuffer(next(arrays), np.uint8).reshape(item["shape"]) if "shape" in item else None
+                      for item in items]
+        with self._model_lock:
+            model = self.model(header["roi"])
+            _, masks = self._segmentation.predict_masks(model, paths, roi=header["roi"], images=images)
+            self.requests += 1
+            self.images += len(paths)
+        return {}, [encode_mask(mask) for mask in masks]
+
+
+def _remove_stale_socket(socket_path):
+    """Remove a socket file left by a server that is gone; refuse to start if one is still listening."""
+    if not os.path.exists(socket_path):
+        return
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError as exc:
+        if exc.errno not in (errno.ECONNREFUSED, errno.ENOENT):
+            raise
+        os.remove(socket_path)
+    else:
+        raise SystemExit(f"❌ A segmentation server is already listening on {socket_path}")
+    finally:
+        sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep the segmentation model loaded and serve masks to the element pipelines over a Unix socket.")
+    parser.add_argument("--socket", default=SEG_SERVER_SOCKET or "/tmp/segmentation.sock",
+                        help="Socket path (set the same SEG_SERVER_SOCKET in the pipelines' config.py)")
+    parser.add_argument("--roi", type=int, nargs=2, default=SEG_ROI, metavar=("TOP", "BOTTOM"),
+                        help="ROI band to load the model for at startup (default: SEG_ROI); others load on first request")
+    args = parser.parse_args()
+
+    _remove_stale_socket(args.socket)
+    os.makedirs(os.path.dirname(os.path.abspath(args.socket)), exist_ok=True)
+    server = SegmentationServer(args.socket)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)  # `kill` stops it like Ctrl+C
+    try:
+        server.model(args.roi)
+        print(f"🟢 Segmentation server listening on {args.socket} (pid {os.getpid()})")
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        print(f"🛑 Segmentation server stopped after {server.requests} requests ({server.images} images)")
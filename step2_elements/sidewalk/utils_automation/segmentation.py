@@ -1,36 +1,119 @@
-import torch
 import numpy as np
-import pandas as pd
-import csv
 import os
-import pickle
-import mmcv
-import matplotlib.pyplot as plt
-from mmseg.apis import init_model, inference_model, show_result_pyplot
-from config import LABELS, CONFIG_FILE, CHECKPOINT_FILE, DEVICE
+import cv2
+from config import CONFIG_FILE, CHECKPOINT_FILE, DEVICE, MASK_FORMAT, SEG_BATCH_SIZE, NUM_THREADS, SEG_CACHE_DIR, PLOT_MODE
+from config import SEG_BACKEND, SEG_INT8, SEG_INPUT_SIZE, SEG_EXPORT_DIR, SEG_ROI, ROI_FILL_LABEL, SEG_SERVER_SOCKET
+from mask_store import mask_path_for_image, save_mask
+from plotting import save_plot_spec, plot_segmented_overlay, pyplot
+from seg_cache import SegmentationCache
+from seg_backend import ExportedSegmenter, load_exported_segmenter, backend_tag
+from seg_server import SegmentationClient, connect as connect_seg_server
+
+def horizon_row(pitch, fov, height=640):
+    """Image row of the horizon for a camera pitched by `pitch` degrees (negative = down) with a vertical `fov`."""
+    return height / 2 + (height / 2) * np.tan(np.radians(pitch)) / np.tan(np.radians(fov / 2))
+
+def _fit_test_resize(model, band_height, frame_size=SEG_INPUT_SIZE):
+    """
+    Make mmseg's keep-ratio test Resize scale an ROI band by the same factor as a full frame.
+    Otherwise the band's short side is blown up to the full short edge (1024), which costs more
+    than segmenting the whole frame.
+    """
+    pipeline = getattr(getattr(model, "cfg", None), "test_pipeline", None) or []
+    for transform in pipeline:
+        if transform.get("type") == "Resize" and transform.get("keep_ratio") and "scale" in transform:
+            long_edge, short_edge = max(transform["scale"]), min(transform["scale"])
+            factor = min(long_edge / max(frame_size), short_edge / min(frame_size))
+            transform["scale"] = (long_edge, int(round(factor * band_height)))
+
+def model_tag(backend=SEG_BACKEND, int8=SEG_INT8):
+    """Name of the masks a backend produces: "mmseg", or the exported model's backend_tag()."""
+    return "mmseg" if backend == "mmseg" else backend_tag(backend, int8, SEG_INPUT_SIZE)
+
+def _server_matches(client, backend, int8):
+    """True if the server runs the model this run would load (same backend tag, config and checkpoint)."""
+    info = client.info
+    expected = {"tag": model_tag(backend, int8), "config_file": os.path.abspath(CONFIG_FILE),
+                "checkpoint_file": os.path.abspath(CHECKPOINT_FILE)}
+    mismatched = [f"{name} {info.get(name)!r} != {value!r}" for name, value in expected.items() if info.get(name) != value]
+    if mismatched:
+        print(f"⚠️ Segmentation server model differs from config.py ({'; '.join(mismatched)}); loading the model in this run")
+    return not mismatched
 
 # Load the model once to avoid reloading for each image
-def load_segmentation_model():
-    """Load the SegFormer segmentation model."""
-    model = init_model(CONFIG_FILE, CHECKPOINT_FILE, device=DEVICE)
+def load_segmentation_model(backend=SEG_BACKEND, int8=SEG_INT8, roi=SEG_ROI, server=SEG_SERVER_SOCKET):
+    """
+    Load the SegFormer segmentation model: the mmseg model, or an ExportedSegmenter for the
+    "onnx" / "torchscript" backends (exported on first use, see seg_backend.py).
+    With an ROI band (top, bottom), the model is set up for images cropped to that band.
+    When a seg_server.py listens on `server` with the same model (backend tag, config and checkpoint),
+    a SegmentationClient of its already loaded model is returned instead; with another model the run
+    loads its own, so cached and checkpointed masks always come from the configured model.
+    torch and mmseg are imported here, so only runs that segment locally load them.
+    """
+    if server:
+        client = connect_seg_server(server)
+        if client is not None and not _server_matches(client, backend, int8):
+            client.close_connection()
+            client = None
+        if client is not None:
+            print(f"✅ Using the segmentation server at {server} ({client.tag}, pid {client.info['pid']})")
+            return client
+    if backend != "mmseg":
+        # ExportedSegmenter sets its own thread count; the ONNX backend runs without torch
+        input_size = SEG_INPUT_SIZE if roi is None else (roi[1] - roi[0], SEG_INPUT_SIZE[1])
+        return load_exported_segmenter(CONFIG_FILE, CHECKPOINT_FILE, backend, SEG_EXPORT_DIR,
+                                       input_size=input_size, int8=int8, num_threads=NUM_THREADS)
+    import torch
+    torch._C._jit_set_profiling_mode(False)
+    torch._C._jit_set_profiling_executor(False)
+    if NUM_THREADS:
+        # Fixed intra-op thread count (mainly matters on CPU-only nodes)
+        torch.set_num_threads(NUM_THREADS)
+    from mmseg.apis import init_model
+    model = init_model(CONFIG_FILE, CHECKPOINT_FILE, device=DEVICE or ("cuda" if torch.cuda.is_available() else "cpu"))
+    if roi is not None:
+        _fit_test_resize(model, roi[1] - roi[0])
     # print(f"Model loaded on {DEVICE}")
     return model
 
-def run_segmentation(model, img_path, save_dir):
-    """Run segmentation model, save segmented image, and store results."""
-    os.makedirs(save_dir, exist_ok=True)
+def _mask_file_path(img_path, save_dir):
+    return os.path.join(save_dir, os.path.basename(mask_path_for_image(img_path, MASK_FORMAT)))
 
-    # Run segmentation
-    result = inference_model(model, img_path)
+def _save_segmented_image(model, img_path, result, save_dir, img=None, mask=None):
+    """
+    Save the segmentation overlay for one image as *_segmented.jpg (according to PLOT_MODE).
+    Without an mmseg result (exported backends, ROI crops) it is drawn from the stored mask;
+    nothing is drawn when there is no `mask` (empty result), as no mask was stored.
+    `img` is the image already decoded in memory, if any (its file may still be being written).
+    """
+    if PLOT_MODE == "off":
+        return
+    if mask is None and (result is None or PLOT_MODE == "deferred"):
+        return
 
     # Define segmented image save path
     segmented_img_path = os.path.join(save_dir, os.path.basename(img_path).replace(".jpg", "_segmented.jpg"))
 
+    if PLOT_MODE == "deferred":
+        # Drawn later by render_plots.py from the image and the stored mask
+        save_plot_spec("segmented_overlay", segmented_img_path,
+                       img_path=img_path, mask_path=_mask_file_path(img_path, save_dir))
+        return
+
+    if result is None:
+        plot_segmented_overlay(segmented_img_path, img_path, _mask_file_path(img_path, save_dir), img=img)
+        return
+
+    import mmcv
+    from mmseg.apis import show_result_pyplot
+    plt = pyplot()
+
     # Ensure visualization backend saves correctly
     plt.figure(figsize=(8, 6))
-    
+
     # ✅ Pass `save_dir` directly into `show_result_pyplot`
-    vis_result = show_result_pyplot(model, img_path, result, show=False)
+    vis_result = show_result_pyplot(model, img_path if img is None else img, result, show=False)
 
     # Convert to RGB and save the segmented image
     plt.imshow(mmcv.bgr2rgb(vis_result))
@@ -38,21 +121,194 @@ def run_segmentation(model, img_path, save_dir):
     plt.savefig(segmented_img_path, bbox_inches='tight', pad_inches=0)
     plt.close()
 
-    # Convert segmentation result to numpy
-    result_mat = torch.Tensor.cpu(result.pred_sem_seg.data).squeeze().numpy()
-    
-    if result_mat.size == 0:
+def _result_to_mask(img_path, result):
+    """Convert one mmseg result to a (H, W) uint8 array of LABELS indices (None if empty)."""
+    mask = result.pred_sem_seg.data.cpu().squeeze().numpy().astype(np.uint8)
+
+    if mask.size == 0:
         print(f"Warning: Empty segmentation result for {img_path}")
         return
 
-    # Extract pixel data
-    height, width = result_mat.shape
-    pixel_data = [(x, y, LABELS[result_mat[y, x]]) for y in range(height) for x in range(width)]
+    return mask
+
+def _read_image(img_path):
+    img = cv2.imread(img_path)
+    if img is None:
+        raise FileNotFoundError(f"Cannot read image {img_path}")
+    return img
+
+def _crop_roi(img, roi):
+    """Rows roi = (top, bottom) of an image (path or BGR array), and (top, bottom, height, width) to paste the mask back."""
+    if isinstance(img, str):
+        img = _read_image(img)
+    height, width = img.shape[:2]
+    top, bottom = max(roi[0], 0), min(roi[1], height)
+    return np.ascontiguousarray(img[top:bottom]), (top, bottom, height, width)
+
+def _paste_roi(mask, band):
+    """Full-frame mask from the mask of an ROI band; rows outside the band get ROI_FILL_LABEL."""
+    if mask is None:
+        return None
+    top, bottom, height, width = band
+    full = np.full((height, width), ROI_FILL_LABEL, dtype=np.uint8)
+    full[top:bottom] = mask
+    return full
+
+def predict_masks(model, img_paths, roi=SEG_ROI, images=None):
+    """
+    Segment a list of images in one forward pass.
+    With an ROI band (top, bottom), only those rows are segmented and the masks are mapped back
+    to full-frame coordinates (load the model with the same `roi`).
+    With `images` (BGR arrays already decoded in memory, None where an image is only on disk, in
+    the order of img_paths), the model gets arrays instead of reading the files.
+
+    Returns:
+    - results: mmseg results (None for an ExportedSegmenter or a SegmentationClient, which have no mmseg data samples, and for ROI crops).
+    - masks: Label-index masks (None for empty results), in the order of img_paths.
+    """
+    if isinstance(model, SegmentationClient):
+        # The server reads the images it is not sent and crops the ROI band itself
+        return [None] * len(img_paths), model.predict(img_paths, roi=roi, images=images)
+
+    if images is None:
+        inputs = list(img_paths)
+    else:
+        # All arrays: mmseg picks its image loader from the first input of a batch
+        inputs = [_read_image(path) if img is None else img for path, img in zip(img_paths, images)]
+    if roi is None:
+        bands = None
+    else:
+        inputs, bands = zip(*(_crop_roi(img, roi) for img in inputs))
+
+    if isinstance(model, ExportedSegmenter):
+        results, masks = [None] * len(img_paths), model.predict(inputs)
+    else:
+        from mmseg.apis import inference_model
+        # A list input runs the whole batch through the model in one forward pass
+        results = inference_model(model, list(inputs))
+        masks = [_result_to_mask(path, result) for path, result in zip(img_paths, results)]
+
+    if bands is not None:
+        # mmseg results of the crops cannot be drawn over the full image; the overlay uses the mask
+        results = [None] * len(img_paths)
+        masks = [_paste_roi(mask, band) for mask, band in zip(masks, bands)]
+    return results, masks
+
+def _store_mask(img_path, mask, save_dir):
+    """Save the mask to the mask store (replaces the old per-pixel _pixel_categories.csv)."""
+    if mask is None:
+        return
+    save_mask(mask, _mask_file_path(img_path, save_dir))
+    return mask
+
+_seg_cache = None
+
+def get_segmentation_cache():
+    """Return the segmentation cache shared across pipelines, or None when SEG_CACHE_DIR is not set."""
+    global _seg_cache
+    if _seg_cache is None and SEG_CACHE_DIR:
+        # Exported backends and ROI crops give slightly different masks, so they get their own cache entries
+        extra = "" if SEG_BACKEND == "mmseg" else model_tag()
+        if SEG_ROI is not None:
+            extra += f"-roi{SEG_ROI[0]}-{SEG_ROI[1]}"
+        _seg_cache = SegmentationCache(SEG_CACHE_DIR, CONFIG_FILE, CHECKPOINT_FILE, extra=extra)
+    return _seg_cache
+
+def run_segmentation(model, img_path, save_dir):
+    """
+    Run segmentation model, save segmented image, and return the label-index mask.
+    Images already in the segmentation cache skip inference (and the segmented overlay).
+    """
+    os.makedirs(save_dir, exist_ok=True)
+
+    cache = get_segmentation_cache()
+    if cache is not None:
+        cache_key = cache.key_for(img_path)
+        mask = cache.get(cache_key)
+        if mask is not None:
+            return _store_mask(img_path, mask, save_dir)
+
+    # Run segmentation
+    (result,), (mask,) = predict_masks(model, [img_path])
+    if cache is not None and mask is not None:
+        cache.put(cache_key, mask)
+
+    mask = _store_mask(img_path, mask, save_dir)
+    _save_segmented_image(model, img_path, result, save_dir, mask=mask)
+    return mask  # ✅ Label-index mask, e.g. mask == LABEL_INDEX["sidewalk"]
+
+def run_segmentation_batch(model, img_paths, save_dirs, batch_size=SEG_BATCH_SIZE, images=None):
+    """
+    Run segmentation on many images, `batch_size` images per forward pass.
+    Images already in the segmentation cache are not sent to the model.
+
+    Parameters:
+    - img_paths: List of image paths.
+    - save_dirs: List of output directories (one per image).
+    - batch_size: Number of images passed to the model at once.
+    - images: Optional list of decoded images (download_image.DecodedImage, or None for images only
+      on disk), in the order of img_paths; see IN_MEMORY_IMAGES.
+
+    Returns:
+    - masks: List of label-index masks (None for empty results), in the order of img_paths.
+    """
+    for save_dir in set(save_dirs):
+        os.makedirs(save_dir, exist_ok=True)
+
+    masks = [None] * len(img_paths)
+    cache = get_segmentation_cache()
+    cache_keys = [None] * len(img_paths)
+    todo = []
+    for i, img_path in enumerate(img_paths):
+        if cache is not None:
+            # Same key as cache.key_for(): the digest of the image bytes
+            decoded = images[i] if images is not None else None
+            cache_keys[i] = cache.key_for(img_path) if decoded is None else decoded.digest
+            mask = cache.get(cache_keys[i])
+            if mask is not None:
+                masks[i] = _store_mask(img_path, mask, save_dirs[i])
+                continue
+        todo.append(i)
+
+    for start in range(0, len(todo), batch_size):
+        batch = todo[start:start + batch_size]
+
+        batch_images = None
+        if images is not None:
+            batch_images = [None if images[i] is None else images[i].image for i in batch]
+
+        batch_results, batch_masks = predict_masks(model, [img_paths[i] for i in batch], images=batch_images)
+
+        for j, (i, result, mask) in enumerate(zip(batch, batch_results, batch_masks)):
+            if cache is not None and mask is not None:
+                cache.put(cache_keys[i], mask)
+            masks[i] = _store_mask(img_paths[i], mask, save_dirs[i])
+            _save_segmented_image(model, img_paths[i], result, save_dirs[i],
+                                  img=None if batch_images is None else batch_images[j], mask=masks[i])
+    return masks
+
+def segment_images(model, img_results, batch_size=SEG_BATCH_SIZE, images=None):
+    """
+    Segment every downloaded image in `img_results` ({(link_id, side, panoid, pitch): img_path}),
+    batching across links, and return {key: mask} for the non-empty results.
+    `images` ({key: DecodedImage}, see download_image.take_decoded) are segmented from memory.
+    """
+    keys = list(img_results.keys())
+    img_paths = [img_results[key] for key in keys]
+    save_dirs = [os.path.dirname(path) for path in img_paths]
+
+    masks = run_segmentation_batch(model, img_paths, save_dirs, batch_size=batch_size,
+                                   images=None if images is None else [images.get(key) for key in keys])
 
-    # ✅ Return DataFrame instead of saving a pickle file
-    pixel_df = pd.DataFrame(pixel_data, columns=["x", "y", "label"])
-    
-    csv_file_path = os.path.join(save_dir, os.path.basename(img_path).replace(".jpg", "_pixel_categories.csv"))
-    pixel_df.to_csv(csv_file_path, index=False)
+    seg_results = {}
+    for key, img_path, mask in zip(keys, img_paths, masks):
+        if mask is None:
+            print(f"⚠️ Skipping segmentation for {img_path} (empty result).")
+            continue
+        seg_results[key] = mask
+        print(f"✅ Segmentation done for {img_path}")
 
-    return pixel_df  # ✅ Directly return the DataFrame
\ No newline at end of file
+    cache = get_segmentation_cache()
+    if cache is not None:
+        print(f"♻️ Segmentation cache: {cache.hits} hits, {cache.misses} misses so far")
+    return seg_results
\ No newline at end of file
@@ -0,0 +1,68 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# Modules that must import without the model / plotting stack: the geometry helpers and the tools built on them
+MODULES = ["config", "mask_store", "sidewalk_processing", "road_processing", "buffer_calculation",
+           "segmentation", "seg_server", "render_plots", "replay", "main"]
+# Imported only by the stage that needs them (model loading, drawing figures, the fsolve fallback)
+HEAVY = ["torch", "torchvision", "mmseg", "mmcv", "matplotlib", "scipy", "skimage", "onnxruntime"]
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_time(module, repeat=3):
+    """
+    Fastest cold import of `module` over `repeat` fresh interpreters (s, from python -X importtime),
+    and the HEAVY packages it pulled in.
+    """
+    best, heavy = None, set()
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                              cwd=HERE, capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f"import {module} failed:\n{proc.stderr.strip().splitlines()[-1]}")
+        seconds = None
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            _, cumulative, name = line.split("|")
+            name = name.strip()
+            if name.split(".")[0] in HEAVY:
+                heavy.add(name.split(".")[0])
+            if name == module:
+                seconds = int(cumulative) / 1e6
+        best = seconds if best is None else min(best, seconds)
+    return best, sorted(heavy)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import time of the utils_automation modules; fails if one imports the heavy model / plotting packages or is slower than --max-seconds.")
+    parser.add_argument("modules", nargs="*", help="Modules to check (default: MODULES found in this folder)")
+    parser.add_argument("--max-seconds", type=float, default=2.0, help="Slowest allowed import of one module")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh interpreters per module (the fastest counts)")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    modules = args.modules or [m for m in MODULES if os.path.exists(os.path.join(HERE, f"{m}.py"))]
+    rows, failures = [], []
+    print(f"{'module':>20} {'import [s]':>11}  heavy packages")
+    for module in modules:
+        seconds, heavy = import_time(module, args.repeat)
+        rows.append({"module": module, "seconds": seconds, "heavy": heavy})
+        print(f"{module:>20} {seconds:>11.3f}  {', '.join(heavy) or '-'}")
+        if heavy:
+            failures.append(f"{module} imports {', '.join(heavy)}")
+        if seconds > args.max_seconds:
+            failures.append(f"{module} takes {seconds:.2f}s to import (> {args.max_seconds}s)")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"max_seconds": args.max_seconds, "results": rows}, f, indent=2)
+    for failure in failures:
+        print(f"❌ {failure}")
+    if failures:
+        sys.exit(1)
+    print(f"✅ {len(modules)} modules import in under {args.max_seconds}s without {', '.join(HEAVY)}")
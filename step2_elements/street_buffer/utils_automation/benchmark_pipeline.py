@@ -0,0 +1,274 @@
+import io
+import json
+import time
+import argparse
+import contextlib
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+import cv2
+
+import plotting
+from config import LABEL_INDEX
+from mask_cleaning import remove_small_regions
+from image_processing_a import filter_horizontal_lines, remove_overlapping_lines_with_buffer
+from image_processing_b import add_unique_id_to_lines, segment_all_lines_by_vertical_boundaries, vertical_boundaries
+from image_processing_c import assign_top_or_bottom_and_filter, add_distances, create_final_result_df
+from pitch_solver import CAMERA_HEIGHT, solve_target_pitch, width_from_pitches
+from sidewalk_processing import process_sidewalk_edges, estimate_sidewalk_width
+
+try:  # Buffer stages (street_buffer/utils_automation only)
+    from road_processing import process_road_edges, filter_top_road_edge
+    from buffer_calculation import combine_sidewalk_and_road_edges, calculate_buffer_width
+except ImportError:
+    process_road_edges = None
+
+SIZE = 640                # Street View image size (pixels)
+PITCHES = (0, -10)        # Pitches downloaded per location
+MIN_AREA = (640 * 640) / (14**2)   # Small-region threshold of process_sidewalk_edges / process_road_edges
+
+
+# ==============================
+# Synthetic Cityscapes-label masks
+# ==============================
+def edge_row(distance, fov, pitch, camera_height=CAMERA_HEIGHT):
+    """Image row of a ground line `distance` m in front of the camera (pinhole camera, SIZE x SIZE image)."""
+    focal = (SIZE / 2) / np.tan(np.radians(fov / 2))
+    depression = np.degrees(np.arctan(camera_height / distance))
+    return SIZE / 2 + focal * np.tan(np.radians(depression + pitch))
+
+
+def random_scene(rng, fovs, n_occluders=3, tilt=4):
+    """
+    Ground truth of one location: distances (m) of the road top edge, sidewalk bottom edge and
+    sidewalk top edge, the FOV, a small tilt of the edges and a few occluders (cars on the road,
+    poles on the sidewalk).
+    """
+    road_top = rng.uniform(4.0, 7.0)
+    buffer = rng.uniform(0.8, 2.0)
+    sidewalk = rng.uniform(1.5, 3.5)
+    occluders = []
+    for _ in range(n_occluders):
+        if rng.random() < 0.5:  # car
+            occluders.append(dict(label="car", col=int(rng.integers(0, SIZE - 160)), width=int(rng.integers(60, 160)),
+                                  distance=road_top - rng.uniform(0.5, 2.0), height=int(rng.integers(40, 100))))
+        else:                   # pole
+            occluders.append(dict(label="pole", col=int(rng.integers(0, SIZE - 14)), width=int(rng.integers(6, 14)),
+                                  distance=road_top + buffer + rng.uniform(0.2, sidewalk - 0.2), height=int(rng.integers(150, 400))))
+    return dict(
+        road_top=road_top, sidewalk_bottom=road_top + buffer, sidewalk_top=road_top + buffer + sidewalk,
+        fov=float(rng.choice(fovs)), tilt=rng.uniform(-tilt, tilt), occluders=occluders,
+        sidewalk_width=sidewalk, buffer_width=buffer,
+    )
+
+
+def synthetic_mask(scene, pitch, rng, speckle=30):
+    """(SIZE, SIZE) label-index mask of `scene` seen at `pitch`, with `speckle` random small blobs of other labels."""
+    fov = scene["fov"]
+    rows = np.arange(SIZE)[:, None]
+    # Edges tilt by scene['tilt'] pixels across the image, around the image center
+    slope = scene["tilt"] * (np.arange(SIZE)[None, :] - SIZE / 2) / SIZE
+
+    mask = np.full((SIZE, SIZE), LABEL_INDEX["sky"], dtype=np.uint8)
+    mask[rows >= edge_row(1e4, fov, pitch) - 80 + slope] = LABEL_INDEX["building"]   # Up to 80 px above the horizon
+    mask[rows >= edge_row(scene["sidewalk_top"], fov, pitch) + slope] = LABEL_INDEX["sidewalk"]
+    mask[rows >= edge_row(scene["sidewalk_bottom"], fov, pitch) + slope] = LABEL_INDEX["terrain"]
+    mask[rows >= edge_row(scene["road_top"], fov, pitch) + slope] = LABEL_INDEX["road"]
+
+    for occ in scene["occluders"]:
+        bottom = int(round(edge_row(occ["distance"], fov, pitch)))
+        mask[max(bottom - occ["height"], 0):max(bottom, 0), occ["col"]:occ["col"] + occ["width"]] = LABEL_INDEX[occ["label"]]
+
+    labels = [LABEL_INDEX[name] for name in ("road", "sidewalk", "building", "vegetation", "terrain")]
+    for _ in range(speckle):
+        x, y = rng.integers(0, SIZE, 2)
+        cv2.circle(mask, (int(x), int(y)), int(rng.integers(2, 8)), int(rng.choice(labels)), -1)
+    return mask
+
+
+# ==============================
+# Stages (same calls and parameters as the pipeline)
+# ==============================
+class StageTimer:
+    """Collects wall-clock durations (s) per stage name."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    @contextlib.contextmanager
+    def __call__(self, stage):
+        t0 = time.perf_counter()
+        yield
+        self.samples[stage].append(time.perf_counter() - t0)
+
+
+def detect_edges(mask, label, pitch, timer):
+    """process_sidewalk_edges / process_road_edges stage by stage (without plots). Returns (segmented_df, error)."""
+    with timer("mask cleaning"):
+        binary = np.where(mask == LABEL_INDEX[label], 255, 0).astype(np.uint8)
+        clean = remove_small_regions(binary, MIN_AREA)
+    if not np.any(clean):
+        return None, 0
+
+    with timer("canny"):
+        edges = cv2.Canny(clean, 30, 100, apertureSize=5)
+    if edges is None or not np.any(edges):
+        return None, 1
+
+    with timer("hough"):
+        lines = cv2.HoughLinesP(edges, 1, np.pi / 180, threshold=25, minLineLength=20, maxLineGap=30)
+    if lines is None:
+        return None, 2
+    lines_df = pd.DataFrame([line[0] for line in lines], columns=["x1", "y1", "x2", "y2"])
+
+    with timer("horizontal filtering"):
+        horiz_df = filter_horizontal_lines(lines_df, tolerance=10)
+    with timer("overlap removal"):
+        filtered_df = remove_overlapping_lines_with_buffer(horiz_df, buffer_distance=5, overlap_threshold=0.7)
+    with timer("boundary segmentation"):
+        lines_with_id = add_unique_id_to_lines(filtered_df)
+        segmented_df = segment_all_lines_by_vertical_boundaries(lines_with_id, vertical_boundaries)
+    if segmented_df.empty:
+        return None, 3
+
+    segmented_df["case"] = pitch
+    return segmented_df, None
+
+
+def sidewalk_width(combined_lines, timer):
+    """estimate_sidewalk_width stage by stage (without plots and prints)."""
+    with timer("top/bottom assignment"):
+        typed = assign_top_or_bottom_and_filter(combined_lines)
+    with timer("distances"):
+        final_result_df = create_final_result_df(add_distances(typed.copy()))
+    with timer("pitch solving + width"):
+        try:
+            p_0_top, p_10_top = final_result_df.loc[0, "top"], final_result_df.loc[-10, "top"]
+            p_0_bottom, p_10_bottom = final_result_df.loc[0, "bottom"], final_result_df.loc[-10, "bottom"]
+        except KeyError:
+            return typed, None
+        T_top, _, _ = solve_target_pitch(p_0_top, p_10_top)
+        T_bottom, _, _ = solve_target_pitch(p_0_bottom, p_10_bottom)
+        width = width_from_pitches(T_top[0], T_bottom[0])
+    return typed, width
+
+
+def check_edges(staged, process_edges, mask, pitch):
+    """Assert that detect_edges matched the pipeline's own process_*_edges on `mask`."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        expected = process_edges(mask, "benchmark.jpg", ".", pitch)
+    assert staged[1] == expected[1], f"staged edges differ from {process_edges.__name__}"
+    if staged[0] is not None:
+        pd.testing.assert_frame_equal(staged[0], expected[0])
+
+
+def run_location(scene, rng, timer, speckle=30, check=False):
+    """Run every stage on the two pitches of one synthetic location. Returns {'sidewalk': width, 'buffer': width}."""
+    masks = {pitch: synthetic_mask(scene, pitch, rng, speckle=speckle) for pitch in PITCHES}
+
+    sidewalk_lines, road_lines = [], []
+    for pitch, mask in masks.items():
+        lines_df, err = detect_edges(mask, "sidewalk", pitch, timer)
+        if check:
+            check_edges((lines_df, err), process_sidewalk_edges, mask, pitch)
+        if lines_df is not None:
+            sidewalk_lines.append(lines_df.assign(pitch=pitch))
+
+        if process_road_edges is not None:
+            road_df, err = detect_edges(mask, "road", pitch, timer)
+            if check:
+                check_edges((road_df, err), process_road_edges, mask, pitch)
+            if road_df is not None:
+                with timer("road top filter"):
+                    road_lines.append(filter_top_road_edge(road_df).assign(pitch=pitch))
+
+    widths = {"sidewalk": None, "buffer": None}
+    if not sidewalk_lines:
+        return widths
+    combined_sidewalk = pd.concat(sidewalk_lines, ignore_index=True)
+    typed, widths["sidewalk"] = sidewalk_width(combined_sidewalk.copy(), timer)
+    if check:
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = estimate_sidewalk_width(combined_sidewalk.copy(), ".")
+        assert (widths["sidewalk"] is None and expected is None) or np.isclose(widths["sidewalk"], expected), \
+            "staged sidewalk width differs from estimate_sidewalk_width"
+
+    if road_lines:
+        with timer("buffer width"), contextlib.redirect_stdout(io.StringIO()):
+            combined = combine_sidewalk_and_road_edges(typed, pd.concat(road_lines, ignore_index=True), ".")
+            widths["buffer"] = None if combined.empty else calculate_buffer_width(combined, ".")
+    return widths
+
+
+# ==============================
+# Report
+# ==============================
+def latency_table(samples):
+    """Per-stage latency distribution (ms) and share of the total time."""
+    total = sum(sum(durations) for durations in samples.values())
+    rows = []
+    for stage, durations in samples.items():
+        ms = np.asarray(durations) * 1e3
+        rows.append({
+            "stage": stage, "n": len(ms), "mean": ms.mean(), "p50": np.percentile(ms, 50),
+            "p90": np.percentile(ms, 90), "p99": np.percentile(ms, 99), "max": ms.max(),
+            "share": ms.sum() / 1e3 / total,
+        })
+    return pd.DataFrame(rows)
+
+
+def accuracy_table(truth, estimates):
+    """Recovered widths against ground truth per element (failures = no width returned)."""
+    rows = []
+    for element in ("sidewalk", "buffer"):
+        pairs = [(t[f"{element}_width"], e[element]) for t, e in zip(truth, estimates) if element in e]
+        if element == "buffer" and process_road_edges is None:
+            continue
+        found = np.array([(t, e) for t, e in pairs if e is not None and np.isfinite(e)]).reshape(-1, 2)
+        err = np.abs(found[:, 1] - found[:, 0]) if len(found) else np.array([np.nan])
+        rows.append({
+            "element": element, "n": len(pairs), "failed": len(pairs) - len(found),
+            "|err| p50 [m]": np.nanpercentile(err, 50), "|err| p90 [m]": np.nanpercentile(err, 90),
+            "|err| max [m]": np.nanmax(err), "bias [m]": np.nanmean(found[:, 1] - found[:, 0]) if len(found) else np.nan,
+        })
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the geometry stages of the pipeline on synthetic segmentation masks (no GPU, API key or mmseg needed).")
+    parser.add_argument("--locations", type=int, default=200, help="Synthetic locations (two masks each)")
+    parser.add_argument("--fovs", type=float, nargs="+", default=[70, 80, 95, 110], help="FOVs to draw scenes from")
+    parser.add_argument("--speckle", type=int, default=30, help="Noise blobs per mask")
+    parser.add_argument("--occluders", type=int, default=3, help="Cars / poles per location")
+    parser.add_argument("--tilt", type=float, default=4, help="Max edge tilt across the image (pixels)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--check", action="store_true", help="Also check the staged results against process_sidewalk_edges / estimate_sidewalk_width")
+    parser.add_argument("--json", help="Write the latency and accuracy tables to this JSON file")
+    args = parser.parse_args()
+
+    plotting.PLOT_MODE = "off"
+    rng = np.random.default_rng(args.seed)
+    timer = StageTimer()
+    truth, estimates = [], []
+    t0 = time.perf_counter()
+    for _ in range(args.locations):
+        scene = random_scene(rng, args.fovs, n_occluders=args.occluders, tilt=args.tilt)
+        truth.append(scene)
+        estimates.append(run_location(scene, rng, timer, speckle=args.speckle, check=args.check))
+    elapsed = time.perf_counter() - t0
+
+    latency = latency_table(timer.samples)
+    accuracy = accuracy_table(truth, estimates)
+    pd.set_option("display.width", 200)
+    print(f"{args.locations} locations ({2 * args.locations} masks) in {elapsed:.2f}s "
+          f"({elapsed / args.locations * 1e3:.1f} ms per location{', checks included' if args.check else ''})\n")
+    print("Stage latency [ms]")
+    print(latency.to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+    print("\nRecovered widths vs ground truth")
+    print(accuracy.to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "seconds": elapsed, "latency_ms": latency.to_dict("records"),
+                       "accuracy": accuracy.to_dict("records")}, f, indent=2)
@@ -1,11 +1,10 @@
 import os
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from scipy.optimize import fsolve
 
 from image_processing_c import add_distances
-from calculation import equations_top, equations_bottom
+from pitch_solver import solve_target_pitch, width_from_pitches
+from plotting import emit_plot
 
 
 def select_bottommost_sidewalk_edges(sidewalk_lines_df, save_dir, link_id=None, side=None):
@@ -47,67 +46,9 @@ def select_bottommost_sidewalk_edges(sidewalk_lines_df, save_dir, link_id=None,
     )
 
     # ===================== VISUALIZATION =====================
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(20, 10))
-
-    # LEFT PLOT: All sidewalk bottom edges (separated by case)
-    ax1.set_xlim([0, 640])
-    ax1.set_ylim([0, 640])
-    ax1.invert_yaxis()
-    ax1.set_title(f'All Sidewalk Bottom Edges\n{link_id} | {side}', fontsize=14, weight='bold')
-    ax1.set_xlabel('X (pixels)', fontsize=12)
-    ax1.set_ylabel('Y (pixels)', fontsize=12)
-    ax1.grid(True, alpha=0.3)
-
-    for _, row in sidewalk_bottom.iterrows():
-        if row['case'] == 0:
-            color = 'lightcoral'
-            linestyle = '--'
-        else:  # case == -10
-            color = 'lightblue'
-            linestyle = '-'
-        ax1.plot(
-            [row['x1'], row['x2']], [row['y1'], row['y2']],
-            color=color, linestyle=linestyle, linewidth=2, alpha=0.6
-        )
-
-    from matplotlib.lines import Line2D
-    legend_elements_left = [
-        Line2D([0], [0], color='lightcoral', linewidth=2, linestyle='--', label='All Pitch 0°'),
-        Line2D([0], [0], color='lightblue', linewidth=2, linestyle='-', label='All Pitch -10°'),
-    ]
-    ax1.legend(handles=legend_elements_left, loc='upper right', fontsize=11)
-
-    # RIGHT PLOT: Only bottommost edges per (cluster, case)
-    ax2.set_xlim([0, 640])
-    ax2.set_ylim([0, 640])
-    ax2.invert_yaxis()
-    ax2.set_title(f'Bottommost Sidewalk Edges (Selected)\n{link_id} | {side}', fontsize=14, weight='bold')
-    ax2.set_xlabel('X (pixels)', fontsize=12)
-    ax2.set_ylabel('Y (pixels)', fontsize=12)
-    ax2.grid(True, alpha=0.3)
-
-    for _, row in bottommost_sidewalk_df.iterrows():
-        if row['case'] == 0:
-            color = 'red'
-            linestyle = '--'
-        else:  # case == -10
-            color = 'blue'
-            linestyle = '-'
-        ax2.plot(
-            [row['x1'], row['x2']], [row['y1'], row['y2']],
-            color=color, linestyle=linestyle, linewidth=3
-        )
-
-    legend_elements_right = [
-        Line2D([0], [0], color='red', linewidth=3, linestyle='--', label='Selected Pitch 0°'),
-        Line2D([0], [0], color='blue', linewidth=3, linestyle='-', label='Selected Pitch -10°'),
-    ]
-    ax2.legend(handles=legend_elements_right, loc='upper right', fontsize=11)
-
-    plt.tight_layout()
     plot_path = os.path.join(save_dir, "sidewalk_bottommost_selection.jpg")
-    plt.savefig(plot_path, bbox_inches='tight', pad_inches=0, dpi=150)
-    plt.close()
+    emit_plot("bottommost_selection", plot_path, sidewalk_bottom=sidewalk_bottom,
+              bottommost_sidewalk_df=bottommost_sidewalk_df, link_id=link_id, side=side)
 
     return bottommost_sidewalk_df
 
@@ -338,65 +279,6 @@ def combine_sidewalk_and_road_edges(sidewalk_lines_df, road_lines_df, save_dir,
     
 #     return buffer_width
 
-def _plot_buffer_edges(edges_with_distances, save_dir, link_id, side):
-    """Helper to draw buffer_edges.jpg from edges_with_distances."""
-    plt.figure(figsize=(12, 10))
-
-    matched_clusters = sorted(edges_with_distances['cluster'].unique())
-
-    for cluster in matched_clusters:
-        cluster_data = edges_with_distances[edges_with_distances['cluster'] == cluster]
-
-        for case in sorted(cluster_data['case'].unique()):
-            pitch_data = cluster_data[cluster_data['case'] == case]
-
-            sidewalk_edge = pitch_data[pitch_data['type'] == 'bottom']
-            road_edge = pitch_data[pitch_data['type'] == 'top']
-
-            linestyle = '--' if case == 0 else '-'
-            alpha = 0.7
-
-            # Sidewalk: blue (0°), sky blue (-10°)
-            if not sidewalk_edge.empty:
-                sw_row = sidewalk_edge.iloc[0]
-                sw_color = 'blue' if case == 0 else 'skyblue'
-                plt.plot(
-                    [sw_row['x1'], sw_row['x2']],
-                    [sw_row['y1'], sw_row['y2']],
-                    color=sw_color,
-                    linestyle=linestyle,
-                    linewidth=3,
-                    alpha=alpha,
-                )
-
-            # Road: red (0°), orange (-10°)
-            if not road_edge.empty:
-                rd_row = road_edge.iloc[0]
-                rd_color = 'red' if case == 0 else 'orange'
-                plt.plot(
-                    [rd_row['x1'], rd_row['x2']],
-                    [rd_row['y1'], rd_row['y2']],
-                    color=rd_color,
-                    linestyle=linestyle,
-                    linewidth=3,
-                    alpha=alpha,
-                )
-
-    plt.axhline(y=320, color='red', linestyle='--', linewidth=1.5, alpha=0.6)
-    plt.xlim([0, 640])
-    plt.ylim([0, 640])
-    plt.gca().invert_yaxis()
-    plt.xlabel('X (pixels)', fontsize=12, weight='bold')
-    plt.ylabel('Y (pixels)', fontsize=12, weight='bold')
-    plt.title(f'Buffer Edges: {link_id} | {side}', fontsize=13, weight='bold')
-    plt.grid(True, alpha=0.3)
-
-    plot_path = os.path.join(save_dir, "buffer_edges.jpg")
-    plt.savefig(plot_path, bbox_inches='tight', pad_inches=0, dpi=150)
-    plt.close()
-
-    print(f"✅ Buffer visualization saved: {plot_path}")
-
 def calculate_buffer_width(combined_df, save_dir, link_id=None, side=None,
                            proximity_threshold=10,
                            alignment_threshold=5,
@@ -460,7 +342,8 @@ def calculate_buffer_width(combined_df, save_dir, link_id=None, side=None,
         if aligned_ratio >= alignment_ratio_threshold:
             print("➡️  Classified as NO STREET BUFFER based on alignment frequency rule.")
             # Still save the visualization, then return None
-            _plot_buffer_edges(edges_with_distances, save_dir, link_id, side)
+            emit_plot("buffer_edges", os.path.join(save_dir, "buffer_edges.jpg"),
+                      edges_with_distances=edges_with_distances, link_id=link_id, side=side)
             return None
     else:
         print(f"[{link_id} | {side}] No valid clusters at pitch 0° for alignment check.")
@@ -483,7 +366,8 @@ def calculate_buffer_width(combined_df, save_dir, link_id=None, side=None,
     avg_distance = (avg_distance_p0 + avg_distance_p10) / 2
 
     # Draw visualization (using a helper for neatness)
-    _plot_buffer_edges(edges_with_distances, save_dir, link_id, side)
+    emit_plot("buffer_edges", os.path.join(save_dir, "buffer_edges.jpg"),
+              edges_with_distances=edges_with_distances, link_id=link_id, side=side)
 
     # If global average distance across pitches is very small → treat as no buffer
     if avg_distance < proximity_threshold:
@@ -491,24 +375,15 @@ def calculate_buffer_width(combined_df, save_dir, link_id=None, side=None,
         return None
 
     # ---------- Geometric buffer-width calculation ----------
-    T_init_sidewalk = 8 if p_10_sidewalk < 0 else 13
-    T_init_road = 8 if p_10_road < 0 else 13
-
-    T_sol_sidewalk = fsolve(equations_bottom, T_init_sidewalk,
-                            args=(p_0_sidewalk, p_10_sidewalk))
-    T_sol_road = fsolve(equations_top, T_init_road,
-                        args=(p_0_road, p_10_road))
-
-    print(f"Target Pitch (Sidewalk Bottom) [{link_id} | {side}]: {T_sol_sidewalk}")
-    print(f"Target Pitch (Road Top) [{link_id} | {side}]: {T_sol_road}")
-
-    T_sidewalk = T_sol_sidewalk[0]
-    T_road = T_sol_road[0]
+    T_sidewalk, ok_sidewalk, _ = solve_target_pitch(p_0_sidewalk, p_10_sidewalk)
+    T_road, ok_road, _ = solve_target_pitch(p_0_road, p_10_road)
 
-    cot_T_sidewalk = 1 / np.tan(np.radians(T_sidewalk))
-    cot_T_road = 1 / np.tan(np.radians(T_road))
+    print(f"Target Pitch (Sidewalk Bottom) [{link_id} | {side}]: {T_sidewalk}")
+    print(f"Target Pitch (Road Top) [{link_id} | {side}]: {T_road}")
+    if not (ok_sidewalk[0] and ok_road[0]):
+        print(f"⚠️ Target pitch did not converge for {link_id} | {side}")
 
-    buffer_width = 2.5 * (cot_T_sidewalk - cot_T_road)
+    buffer_width = width_from_pitches(T_sidewalk[0], T_road[0])
 
     if buffer_width < 0:
         print(f"⚠️ Calculated negative buffer width: {buffer_width:.2f}m")
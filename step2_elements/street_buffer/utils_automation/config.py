@@ -6,7 +6,6 @@
 
 import os
 import numpy as np
-import torch, torchvision
 
 ### Google API Key ###
 API_KEY = "YOUR_API_KEY"
@@ -15,14 +14,107 @@ API_KEY = "YOUR_API_KEY"
 GEOJSON_PATH = "..YOUR/PATH/POINT_EPSG4326.geojson"
 
 ### !--- Semantic segmentation ###
-DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+DEVICE = None   # e.g. "cuda:0" or "cpu"; None = "cuda" when available, else "cpu" (checked when the model is loaded)
 CONFIG_FILE = '..YOUR/PATH/mmsegmentation/configs/segformer/segformer_mit-b5_8xb1-160k_cityscapes-1024x1024.py'
 CHECKPOINT_FILE = "..YOUR/PATH/mmsegmentation/checkpoints/segformer_mit-b5_8x1_1024x1024_160k_cityscapes_20211206_072934-87a052ec.pth"
 LABELS = np.array([
     "road", "sidewalk", "building", "wall", "fence", "pole", "traffic light", "traffic sign",
     "vegetation", "terrain", "sky", "person", "rider", "car", "truck", "bus", "train", "motorcycle", "bicycle"
 ])
+LABEL_INDEX = {name: idx for idx, name in enumerate(LABELS)}
 
 # Directory for saving outputs
-OUTPUT_DIR = "..YOUR/PATH/outputs_automation"
-os.makedirs(OUTPUT_DIR, exist_ok=True)
\ No newline at end of file
+OUTPUT_DIR = "..YOUR/PATH/outputs_automation"   # Created by main.py
+
+### Segmentation mask store: "npy" (memory-mappable) or "png" (smaller, lossless) ###
+MASK_FORMAT = "npy"
+
+### Batched segmentation ###
+SEG_BATCH_SIZE = 8      # Images per SegFormer forward pass
+LINKS_PER_BATCH = 16    # Max links whose images are segmented together
+NUM_THREADS = None      # Fixed torch intra-op thread count (e.g. physical cores on CPU nodes); None = torch default
+
+### Segmentation backend ###
+# "mmseg": SegFormer through mmseg (default; its test pipeline upsamples 640x640 images to 1024x1024)
+# "onnx": the model exported once to ONNX and run with onnxruntime at SEG_INPUT_SIZE (CPU nodes)
+# "torchscript": the model exported once to TorchScript and run with torch at SEG_INPUT_SIZE (CPU nodes)
+SEG_BACKEND = "mmseg"
+SEG_INT8 = True               # Dynamic INT8 quantization of the exported model
+SEG_INPUT_SIZE = (640, 640)   # (height, width) the exported model runs at (the downloaded image size)
+SEG_EXPORT_DIR = os.path.join(OUTPUT_DIR, "exported_models")  # Exported models, reused across runs
+
+### Region of interest for segmentation ###
+# Only rows SEG_ROI = (top, bottom) of the 640x640 images are segmented; the rest of each mask is set to
+# ROI_FILL_LABEL (no class). Edges lie on the ground, below the horizon of the steepest pitch
+# (row 320 - 320 * tan(10°) / tan(FOV / 2) at pitch -10: ≈ 239 at FOV 70, ≈ 253 at FOV 80), so keep `top`
+# a little above it and `bottom` at 640, e.g. (224, 640). None segments the full frame.
+SEG_ROI = None
+ROI_FILL_LABEL = 255
+
+### Segmentation server (keeps the model loaded across runs and elements; start it with `python seg_server.py`) ###
+SEG_SERVER_SOCKET = None   # e.g. "/tmp/segmentation.sock": runs use the server listening there (else load the model themselves)
+
+### Early rejection of panos without sidewalk ###
+# Only the first pitch in PITCH_VALUES is downloaded and segmented up front. A side whose first-pitch mask has
+# less than GATE_MIN_SIDEWALK_FRACTION sidewalk pixels is reported as no sidewalk (buffer_error_code 0, as when edge detection finds none) right away: its other
+# pitches are not downloaded or segmented and no edge detection runs. 1 / 196 is the smallest sidewalk
+# region edge detection keeps. None disables the gate.
+GATE_MIN_SIDEWALK_FRACTION = None   # e.g. 1 / 196
+
+### !--- Segmentation cache shared by the sidewalk and street_buffer pipelines ###
+# Use the same folder in both pipelines' config.py so images segmented by one are reused by the other.
+SEG_CACHE_DIR = "..YOUR/PATH/segmentation_cache"  # None disables the cache
+
+### Debug figures ###
+# "full": draw every figure during the run (default)
+# "off": skip them (headless fast mode)
+# "deferred": only save the figure data (*.plot.pkl); draw later with render_plots.py
+PLOT_MODE = "full"
+
+### Geometry parameters (edges and widths; `python replay.py --set NAME=VALUE` recomputes results from stored masks) ###
+GEOMETRY_PARAMS = {
+    "small_sidewalk_threshold": (640 * 640) / (14**2),  # Sidewalk blobs smaller than this (pixels) are removed
+    "small_road_threshold": (640 * 640) / (14**2),      # Road blobs smaller than this (pixels) are removed
+    "canny_low": 30, "canny_high": 100,                 # Canny hysteresis thresholds
+    "hough_threshold": 25,                              # HoughLinesP accumulator votes
+    "min_line_length": 20, "max_line_gap": 30,          # HoughLinesP segment length / gap (pixels)
+    "tolerance": 10,                                    # Lines within this many degrees of horizontal are kept
+    "buffer_distance": 5, "overlap_threshold": 0.7,     # Duplicate lines: buffer (pixels) and overlap ratio
+    "proximity_threshold": 10,                          # Edges closer than this on average (pixels): no buffer
+    "alignment_threshold": 5,                           # Pitch-0 gap (pixels) under which a cluster counts as aligned
+    "alignment_ratio_threshold": 0.2,                   # Share of aligned clusters that means no buffer
+}
+
+### Streaming pipeline (download → segmentation → edges/widths run concurrently) ###
+DOWNLOAD_THREADS = 4      # Threads downloading images
+GEOMETRY_WORKERS = None   # Processes for edge detection + width solving; None = all cores, 0 = main process
+QUEUE_SIZE = 8            # Links buffered between two stages (bounds memory)
+
+### Image download (shared keep-alive pool; retries 429/5xx with jittered backoff) ###
+STREETVIEW_URL = "https://maps.googleapis.com/maps/api/streetview"  # Point at a local stand-in server for offline tests
+FETCH_CONCURRENCY = 8     # Requests in flight across all download threads
+FETCH_RATE_LIMIT = None   # Requests per second (token bucket); None = unlimited
+FETCH_MAX_RETRIES = 4     # Retries per image after the first attempt
+FETCH_TIMEOUT = 30        # Seconds per request
+
+### !--- Image cache shared by all elements (sidewalk, street_buffer, bike_lane, street_parking) ###
+# Use the same folder everywhere so an image requested with the same parameters is downloaded once.
+IMAGE_CACHE_DIR = "..YOUR/PATH/image_cache"  # None disables the cache
+IMAGE_CACHE_MAX_GB = 50                      # Least recently used images are evicted beyond this size
+
+### In-memory images (downloads are decoded once and segmented from memory; files are written in the background) ###
+IN_MEMORY_IMAGES = False
+
+### Run journal (resume an interrupted run; per (link_id, side): downloaded → segmented → edges → width) ###
+RUN_JOURNAL_PATH = os.path.join(OUTPUT_DIR, "run_journal.sqlite")  # None disables resuming
+
+### Results (one typed Parquet table per run instead of one CSV per link) ###
+RESULT_FORMAT = "parquet"   # "parquet" = append to RESULT_DIR (read with result_sink.read_results); "csv" = OUTPUT_DIR/<pano_id>.csv per link
+RESULT_DIR = os.path.join(OUTPUT_DIR, "results")
+RESULT_BATCH_ROWS = 5000    # Rows buffered before a part file is written
+
+### Combined sidewalk + street buffer mode (one download, segmentation and edge extraction for both) ###
+COMBINED_SIDEWALK = False   # True = also output the sidewalk `width` / `error_code` of each side (images use this pipeline's FOV)
+
+### Run report (per-stage wall/CPU time, peak RSS and item counts; `python main.py --profile STAGE` adds cProfile) ###
+REPORT_PATH = os.path.join(OUTPUT_DIR, "reports", "run_report.jsonl")  # JSON lines (+ run_report_summary.csv); own folder, so the summary is not read as a link result; None disables it
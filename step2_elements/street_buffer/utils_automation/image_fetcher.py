@@ -0,0 +1,244 @@
+import os
+import time
+import random
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Status codes worth retrying: rate limited or a transient server error
+RETRY_STATUS = frozenset({429, 500, 502, 503, 504})
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` requests per second on average, bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity is not None else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then take it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def atomic_write(path, content):
+    """Write bytes to a temporary file next to `path` and rename it, so readers never see a partial image."""
+    folder = os.path.dirname(path) or "."
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class ImageFetcher:
+    """
+    Shared image downloader: one keep-alive connection pool, at most `concurrency` requests
+    in flight, optional token-bucket rate limiting, jittered exponential backoff on 429/5xx
+    and connection errors, and atomic writes to disk. With an ImageCache, requests that carry a
+    cache key are served from the cache when possible and added to it after downloading.
+
+    fetch_image() also hands back the image decoded from the downloaded bytes, so the caller does not
+    read it back from disk; the file (and the cache entry) is then written by a background thread
+    (flush() waits for those writes, close() flushes).
+
+    Parameters:
+    - concurrency: Worker threads (and pooled connections per host).
+    - rate_limit: Requests per second across all threads (None = unlimited).
+    - max_retries: Retries after the first attempt for retryable failures.
+    - backoff: Base delay (s); retry k waits uniform(0, min(max_backoff, backoff * 2**k)),
+      or the server's Retry-After if it asks for longer.
+    - timeout: Per-request timeout (s), or a (connect, read) tuple.
+    - cache: Optional ImageCache shared with the other elements.
+    """
+
+    def __init__(self, concurrency=8, rate_limit=None, max_retries=4, backoff=0.5, max_backoff=30,
+                 timeout=30, headers=None, cache=None):
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.cache = cache
+        self.bucket = TokenBucket(rate_limit) if rate_limit else None
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if headers:
+            self.session.headers.update(headers)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._writer = None
+        self._writes = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+        self.flush()
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)
+            self._writer = None
+        self.session.close()
+
+    def flush(self):
+        """Wait for the background writes of fetch_image(); re-raises the first failed write."""
+        with self._executor_lock:
+            writes, self._writes = list(self._writes), set()
+        for future in writes:
+            future.result()
+
+    def _delay(self, attempt, response):
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, min(self.max_backoff, float(retry_after)))
+            except ValueError:
+                pass
+        return delay
+
+    def _get(self, url):
+        """
+        GET `url` with retries. Returns (content, status): the response bytes on a 200, else None with
+        the last HTTP status code (None after a connection error).
+        """
+        status = None
+        for attempt in range(self.max_retries + 1):
+            if self.bucket is not None:
+                self.bucket.acquire()
+            response = None
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+                status = response.status_code
+            except (requests.ConnectionError, requests.Timeout):
+                status = None
+            else:
+                if status == 200:
+                    return response.content, status
+                if status not in RETRY_STATUS:
+                    return None, status
+            if attempt < self.max_retries:
+                time.sleep(self._delay(attempt, response))
+        return None, status
+
+    def _store(self, path, content, cache_key=None):
+        """Write downloaded bytes to `path` and add them to the cache under `cache_key`."""
+        atomic_write(path, content)
+        if self.cache is not None and cache_key is not None:
+            self.cache.put(cache_key, path)
+
+    def _store_later(self, path, content, cache_key=None):
+        """_store() on the background writer thread (one thread, so writes do not compete with downloads)."""
+        with self._executor_lock:
+            if self._writer is None:
+                self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fetch-write")
+            future = self._writer.submit(self._store, path, content, cache_key)
+            self._writes.add(future)
+        future.add_done_callback(self._written)
+
+    def _written(self, future):
+        if future.exception() is None:
+            with self._executor_lock:
+                self._writes.discard(future)
+
+    def fetch(self, url, path, overwrite=True, cache_key=None):
+        """
+        Download `url` to `path`, or copy it from the cache when `cache_key` (see image_key) is cached.
+
+        Returns:
+        - (path, status) on success, (None, status) on failure; status is the last HTTP status code
+          (None after a connection error, or when no request was made: an existing file was kept
+          with overwrite=False, or the image came from the cache).
+        """
+        if not overwrite and os.path.exists(path):
+            return path, None
+        if self.cache is not None and cache_key is not None and self.cache.copy_to(cache_key, path):
+            return path, None
+
+        content, status = self._get(url)
+        if content is None:
+            return None, status
+        self._store(path, content, cache_key)
+        return path, status
+
+    def fetch_image(self, url, path, decode, overwrite=True, cache_key=None):
+        """
+        Like fetch(), but also returns decode(bytes) of the image, decoded on the fetch thread.
+        Downloaded bytes are decoded from memory and written to `path` in the background (see flush());
+        images kept on disk or copied from the cache are decoded from the file. When `decode` returns
+        None (bytes it cannot decode), the file is written before returning, so the caller can read it.
+
+        Returns:
+        - (path, status, image) on success, (None, status, None) on failure.
+        """
+        kept = not overwrite and os.path.exists(path)
+        if kept or (self.cache is not None and cache_key is not None and self.cache.copy_to(cache_key, path)):
+            with open(path, "rb") as file:
+                return path, None, decode(file.read())
+
+        content, status = self._get(url)
+        if content is None:
+            return None, status, None
+        image = decode(content)
+        if image is None:
+            self._store(path, content, cache_key)
+        else:
+            self._store_later(path, content, cache_key)
+        return path, status, image
+
+    def submit(self, url, path, overwrite=True, cache_key=None, decode=None):
+        """
+        Start fetch(url, path) on the fetcher's threads; returns a Future of (path, status),
+        or of fetch_image()'s (path, status, image) when `decode` is given.
+        """
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="fetch")
+            if decode is not None:
+                return self._executor.submit(self.fetch_image, url, path, decode, overwrite, cache_key)
+            return self._executor.submit(self.fetch, url, path, overwrite, cache_key)
+
+    def fetch_many(self, jobs, overwrite=True, decode=None):
+        """
+        Download many images concurrently.
+
+        Parameters:
+        - jobs: Iterable of (key, url, path) or (key, url, path, cache_key).
+        - decode: Optional bytes → image function; the images are then returned too (see fetch_image).
+
+        Returns:
+        - {key: (path or None, status)} in the order of `jobs`, or {key: (path or None, status, image)} with `decode`.
+        """
+        futures = [(key, self.submit(url, path, overwrite, *cache_key, decode=decode))
+                   for key, url, path, *cache_key in jobs]
+        return {key: future.result() for key, future in futures}
@@ -8,8 +8,11 @@ import os
 import numpy as np
 import pandas as pd
 import cv2
+import shapely
 from shapely.geometry import LineString
 
+from line_set import LineSet
+
 #### FILTER HORIZONTAL LINES ####
 # Function to calculate the angle of a line
 def calculate_line_angle(x1, y1, x2, y2):
@@ -30,17 +33,16 @@ def filter_horizontal_lines(lines_df, tolerance=10):
     Returns:
     - horizontal_lines_df: DataFrame with filtered horizontal lines.
     """
-    horizontal_lines = []
-    for _, line in lines_df.iterrows():
-        x1, y1, x2, y2 = line['x1'], line['y1'], line['x2'], line['y2']
-        angle = calculate_line_angle(x1, y1, x2, y2)
-        
-        # Check if the angle is within the horizontal tolerance range (around 0° or 180°)
-        if (0 <= angle <= tolerance) or (180 - tolerance <= angle <= 180 + tolerance) or (360 - tolerance <= angle <= 360):
-            line['angle'] = angle  # Add the calculated angle to the line data
-            horizontal_lines.append(line)
-    
-    return pd.DataFrame(horizontal_lines)
+    if lines_df.empty:
+        return pd.DataFrame()
+
+    lines = LineSet.from_frame(lines_df)
+    keep = lines.horizontal_mask(tolerance)  # around 0°, 180° or 360°
+
+    # Coordinates come out as floats, as with the former row-by-row filter
+    horizontal_lines_df = lines_df[keep].astype({col: float for col in ("x1", "y1", "x2", "y2")})
+    horizontal_lines_df['angle'] = lines.angle[keep]
+    return horizontal_lines_df
 
 
 #### ERASE THE OVERLAPPED LINES ####
@@ -60,9 +62,38 @@ def create_line_buffer(x1, y1, x2, y2, buffer_distance=5):
     buffer_polygon = line.buffer(buffer_distance)
     return buffer_polygon
 
+def _overlap_upper_bound(coords, bounds, i, j, buffer_distance):
+    """
+    Cheap upper bound of the buffer intersection area of line pairs (i, j).
+
+    Each buffer lies inside the capsule of radius `buffer_distance` around its line, whose
+    vertical cross-section is at most 2r / |cos(angle)| long (2r / |sin(angle)| horizontally).
+    The intersection is therefore bounded by the overlap of the bounding boxes, and by the
+    width (height) of that overlap times the shorter cross-section of the two lines.
+    """
+    dx = np.abs(coords[:, 1, 0] - coords[:, 0, 0])
+    dy = np.abs(coords[:, 1, 1] - coords[:, 0, 1])
+    length = np.hypot(dx, dy)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chord_x = np.where(length == 0, 2 * buffer_distance, 2 * buffer_distance * length / dx)
+        chord_y = np.where(length == 0, 2 * buffer_distance, 2 * buffer_distance * length / dy)
+
+    w = np.clip(np.minimum(bounds[i, 2], bounds[j, 2]) - np.maximum(bounds[i, 0], bounds[j, 0]), 0, None)
+    h = np.clip(np.minimum(bounds[i, 3], bounds[j, 3]) - np.maximum(bounds[i, 1], bounds[j, 1]), 0, None)
+    with np.errstate(invalid='ignore'):
+        by_x = np.where(w > 0, w * np.minimum(chord_x[i], chord_x[j]), 0)
+        by_y = np.where(h > 0, h * np.minimum(chord_y[i], chord_y[j]), 0)
+    return np.minimum.reduce([w * h, by_x, by_y])
+
 def remove_overlapping_lines_with_buffer(lines_df, buffer_distance=5, overlap_threshold=0.7):
     """
     Remove lines that overlap significantly based on a buffer intersection.
+
+    Lines are visited in order; a kept line drops every later kept line whose buffer overlaps
+    its own by more than `overlap_threshold` of the smaller buffer area. Instead of clipping
+    all pairs, candidates are pruned first (STRtree query for intersecting buffers, then an
+    analytic upper bound of the overlap), and only the remaining pairs are clipped exactly
+    with shapely, so the kept lines are the same as with the all-pairs comparison.
     
     Parameters:
     - lines_df: DataFrame containing lines with columns ['x1', 'y1', 'x2', 'y2'].
@@ -72,33 +103,45 @@ def remove_overlapping_lines_with_buffer(lines_df, buffer_distance=5, overlap_th
     Returns:
     - filtered_lines_df: DataFrame with overlapping lines removed.
     """
-    keep_mask = [True] * len(lines_df)
-    
-    # List to store buffered geometries for each line
-    buffers = []
-    
-    # Create buffers for each line
-    for i, row in lines_df.iterrows():
-        buffer_polygon = create_line_buffer(row['x1'], row['y1'], row['x2'], row['y2'], buffer_distance)
-        buffers.append(buffer_polygon)
-    
-    # Compare each line's buffer with others to find overlaps
-    for i in range(len(lines_df)):
-        if not keep_mask[i]:  # Skip if this line has already been marked as a duplicate
+    n = len(lines_df)
+    if n == 0:
+        return lines_df.reset_index(drop=True)
+
+    # Buffered geometries for each line (same polygons as create_line_buffer)
+    coords = lines_df[['x1', 'y1', 'x2', 'y2']].to_numpy(dtype=float).reshape(n, 2, 2)
+    buffers = shapely.buffer(shapely.linestrings(coords), buffer_distance, quad_segs=16)
+    areas = shapely.area(buffers)
+
+    # Candidate pairs i < j with intersecting buffers
+    tree = shapely.STRtree(buffers)
+    left, right = tree.query(buffers, predicate='intersects')
+    pair = left < right
+    i, j = left[pair], right[pair]
+
+    # Drop the pairs that cannot reach the threshold (small slack against rounding)
+    upper = _overlap_upper_bound(coords, shapely.bounds(buffers), i, j, buffer_distance)
+    possible = upper / np.minimum(areas[i], areas[j]) * (1 + 1e-9) > overlap_threshold
+    i, j = i[possible], j[possible]
+
+    # Candidates of each line, sorted by line order
+    order = np.lexsort((j, i))
+    i, j = i[order], j[order]
+    starts = np.searchsorted(i, np.arange(n + 1))
+
+    keep_mask = np.ones(n, dtype=bool)
+    for k in range(n):
+        if not keep_mask[k]:  # Skip if this line has already been marked as a duplicate
             continue
-        
-        for j in range(i + 1, len(lines_df)):
-            if not keep_mask[j]:  # Skip if this line has already been marked as a duplicate
-                continue
-            
-            # Check for buffer intersection
-            intersection_area = buffers[i].intersection(buffers[j]).area
-            min_area = min(buffers[i].area, buffers[j].area)
-            
-            # If the overlap is greater than the threshold, mark one line as a duplicate
-            if intersection_area / min_area > overlap_threshold:
-                keep_mask[j] = False  # Mark the second line as a near-duplicate
-    
+        others = j[starts[k]:starts[k + 1]]
+        others = others[keep_mask[others]]
+        if len(others) == 0:
+            continue
+
+        # Exact buffer intersection with the later lines still kept
+        intersection_area = shapely.area(shapely.intersection(buffers[k], buffers[others]))
+        min_area = np.minimum(areas[k], areas[others])
+        keep_mask[others[intersection_area / min_area > overlap_threshold]] = False
+
     # Filter the lines based on the keep mask
     filtered_lines_df = lines_df[keep_mask].reset_index(drop=True)
     
@@ -7,11 +7,9 @@
 import os
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import cv2
-from skimage.measure import regionprops
 from shapely.geometry import LineString, Polygon, Point, MultiPoint, GeometryCollection
 from image_processing_a import create_line_buffer
+from line_set import LineSet
 
 def add_unique_id_to_lines(lines_df):
     """
@@ -89,36 +87,24 @@ def segment_all_lines_by_vertical_boundaries(lines_df, vertical_boundaries):
     Returns:
     - segmented_lines_df: DataFrame with segmented lines, keeping track of the original line_id.
     """    
-    all_segments = []
-    
-    # Loop through each line in the DataFrame
-    for _, row in lines_df.iterrows():
-        line_id = row['line_id']
-        x1, y1, x2, y2 = row['x1'], row['y1'], row['x2'], row['y2']
-        
-        # Segment the line using the segmentation function
-        segments = segment_line_by_vertical_boundaries(x1, y1, x2, y2, vertical_boundaries)
-        
-        # Add the line_id and cluster to each segment and append to the list
-        for i, segment in enumerate(segments):
-            segment['line_id'] = f'{line_id}_{i+1}'  # Label each segment with the original line_id and segment number
-            
-            # Determine the cluster based on the segment's x-coordinates
-            if segment['x1'] < segment['x2']:
-                x_start, x_end = segment['x1'], segment['x2']
-            else:
-                x_start, x_end = segment['x2'], segment['x1']
-            
-            # Find which cluster the segment belongs to
-            for j in range(len(vertical_boundaries) - 1):
-                if vertical_boundaries[j] <= x_start < vertical_boundaries[j + 1]:
-                    segment['cluster'] = j + 1
-                    break
-            
-            all_segments.append(segment)
-    
-    # Convert the list of segments into a DataFrame
-    segmented_lines_df = pd.DataFrame(all_segments)
+    if lines_df.empty:
+        return pd.DataFrame()
+
+    lines = LineSet.from_frame(lines_df)
+    segments = lines.segment_by_boundaries(vertical_boundaries)
+
+    # Label each segment with the original line_id and segment number
+    parent_ids = lines_df['line_id'].astype(str).to_numpy()[segments.source]
+    segmented_lines_df = pd.DataFrame({
+        'x1': segments.x1,
+        'y1': segments.y1,
+        'x2': segments.x2,
+        'y2': segments.y2,
+        'line_id': [f'{line_id}_{part}' for line_id, part in zip(parent_ids, segments.part)],
+        'cluster': segments.cluster,
+    })
+    if segmented_lines_df['cluster'].notna().all():
+        segmented_lines_df['cluster'] = segmented_lines_df['cluster'].astype(int)
     return segmented_lines_df
 
 
@@ -0,0 +1,232 @@
+import numpy as np
+import pandas as pd
+
+# Codes of the 'type' column (index into TYPE_LABELS); labels not listed here get TYPE_OTHER
+TYPE_LABELS = ("", "top", "bottom", "bottom_road")
+TYPE_NONE, TYPE_TOP, TYPE_BOTTOM, TYPE_BOTTOM_ROAD = range(len(TYPE_LABELS))
+TYPE_OTHER = -1
+
+CENTRAL_LINE_Y = 320  # y of the central horizontal line of a 640 x 640 image
+
+
+def _column(df, name):
+    """Column as a float array (NaN where missing), or None if the column does not exist."""
+    if name not in df.columns:
+        return None
+    return pd.to_numeric(df[name], errors="coerce").to_numpy(dtype=float)
+
+
+def _group_ids(*keys):
+    """
+    Dense group ids of the rows for the given key arrays (like groupby with dropna=True).
+    Rows with a NaN key get -1. Returns (ids, number of groups).
+    """
+    n = len(keys[0])
+    valid = np.ones(n, dtype=bool)
+    for k in keys:
+        valid &= ~np.isnan(k)
+    ids = np.full(n, -1, dtype=np.int64)
+    if not valid.any():
+        return ids, 0
+    stacked = np.column_stack([k[valid] for k in keys])
+    _, inverse = np.unique(stacked, axis=0, return_inverse=True)
+    ids[valid] = inverse.ravel()
+    return ids, int(inverse.max()) + 1
+
+
+class LineSet:
+    """
+    Line segments stored as parallel NumPy arrays, so the per-line steps of the edge pipeline
+    (horizontal filtering, splitting at vertical boundaries, top/bottom ranking, distances)
+    run as array operations instead of DataFrame row loops.
+
+    Arrays (all of length n):
+    - x1, y1, x2, y2: End points.
+    - angle: Line angle in degrees [0, 360) (NaN until computed).
+    - cluster: 1-based vertical-boundary cluster (NaN if outside the boundaries).
+    - case: Pitch of the image the line comes from (NaN if unknown).
+    - type: Codes into TYPE_LABELS (TYPE_NONE if unassigned, TYPE_OTHER for unknown labels).
+    - source: Row position of each line in the DataFrame it came from.
+    - part: 1-based segment number after segment_by_boundaries (1 otherwise).
+    """
+
+    def __init__(self, x1, y1, x2, y2, angle=None, cluster=None, case=None, type=None, source=None, part=None):
+        self.x1 = np.asarray(x1)
+        self.y1 = np.asarray(y1)
+        self.x2 = np.asarray(x2)
+        self.y2 = np.asarray(y2)
+        n = len(self.x1)
+        self.angle = np.full(n, np.nan) if angle is None else np.asarray(angle, dtype=float)
+        self.cluster = np.full(n, np.nan) if cluster is None else np.asarray(cluster, dtype=float)
+        self.case = np.full(n, np.nan) if case is None else np.asarray(case, dtype=float)
+        self.type = np.full(n, TYPE_NONE, dtype=np.int8) if type is None else np.asarray(type, dtype=np.int8)
+        self.source = np.arange(n) if source is None else np.asarray(source)
+        self.part = np.ones(n, dtype=np.int64) if part is None else np.asarray(part)
+
+    def __len__(self):
+        return len(self.x1)
+
+    @classmethod
+    def from_frame(cls, df):
+        """Build a LineSet from a DataFrame with ['x1', 'y1', 'x2', 'y2'] and optional 'angle', 'cluster', 'case', 'type'."""
+        type_codes = None
+        if "type" in df.columns:
+            type_codes = pd.Categorical(df["type"], categories=list(TYPE_LABELS)).codes.astype(np.int8)
+        return cls(
+            df["x1"].to_numpy(dtype=float), df["y1"].to_numpy(dtype=float),
+            df["x2"].to_numpy(dtype=float), df["y2"].to_numpy(dtype=float),
+            angle=_column(df, "angle"), cluster=_column(df, "cluster"), case=_column(df, "case"),
+            type=type_codes,
+        )
+
+    def subset(self, idx):
+        """Lines selected by a boolean mask or an index array."""
+        return LineSet(
+            self.x1[idx], self.y1[idx], self.x2[idx], self.y2[idx],
+            angle=self.angle[idx], cluster=self.cluster[idx], case=self.case[idx],
+            type=self.type[idx], source=self.source[idx], part=self.part[idx],
+        )
+
+    # ------------------------------------------------------------------
+    # Horizontal filtering
+    # ------------------------------------------------------------------
+    def compute_angles(self):
+        """Angle of each line in degrees, in [0, 360)."""
+        angle = np.degrees(np.arctan2(self.y2 - self.y1, self.x2 - self.x1))
+        self.angle = np.where(angle < 0, angle + 360, angle)
+        return self.angle
+
+    def horizontal_mask(self, tolerance=10):
+        """True for lines within `tolerance` degrees of horizontal (around 0°, 180° or 360°)."""
+        angle = self.compute_angles()
+        return (
+            ((0 <= angle) & (angle <= tolerance))
+            | ((180 - tolerance <= angle) & (angle <= 180 + tolerance))
+            | ((360 - tolerance <= angle) & (angle <= 360))
+        )
+
+    def filter_horizontal(self, tolerance=10):
+        """Keep the approximately horizontal lines (with their angle set)."""
+        return self.subset(self.horizontal_mask(tolerance))
+
+    # ------------------------------------------------------------------
+    # Splitting at vertical boundaries
+    # ------------------------------------------------------------------
+    def segment_by_boundaries(self, boundaries):
+        """
+        Split every line at the vertical boundaries it strictly crosses and assign each piece
+        to the cluster j + 1 with boundaries[j] <= min(x) < boundaries[j + 1] (NaN if none).
+
+        Pieces keep the traversal order of segment_line_by_vertical_boundaries: the crossed
+        boundaries are visited in ascending x starting from (x1, y1), and the last piece ends
+        at (x2, y2).
+        """
+        b = np.sort(np.asarray(boundaries))
+        x1, y1, x2, y2 = (np.asarray(v, dtype=float) for v in (self.x1, self.y1, self.x2, self.y2))
+
+        x_min = np.minimum(x1, x2)
+        x_max = np.maximum(x1, x2)
+        first = np.searchsorted(b, x_min, side="right")   # first boundary > x_min
+        last = np.searchsorted(b, x_max, side="left")     # first boundary >= x_max
+        n_cross = np.maximum(last - first, 0)
+        n_pieces = n_cross + 1
+
+        # One row per piece: which line it comes from and its position k in that line
+        line = np.repeat(np.arange(len(self)), n_pieces)
+        starts = np.cumsum(n_pieces) - n_pieces
+        k = np.arange(len(line)) - starts[line]
+
+        # Piece k runs from point k to point k + 1, where point 0 is (x1, y1),
+        # point i (1..n_cross) is the i-th crossed boundary and point n_cross + 1 is (x2, y2)
+        def point(i):
+            is_start = i == 0
+            is_end = i == n_pieces[line]
+            bx = b[np.clip(first[line] + i - 1, 0, len(b) - 1)].astype(float)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                slope = (y2[line] - y1[line]) / (x2[line] - x1[line])
+            by = y1[line] + slope * (bx - x1[line])
+            px = np.where(is_start, x1[line], np.where(is_end, x2[line], bx))
+            py = np.where(is_start, y1[line], np.where(is_end, y2[line], by))
+            return px, py
+
+        sx, sy = point(k)
+        ex, ey = point(k + 1)
+
+        x_start = np.minimum(sx, ex)
+        j = np.searchsorted(b, x_start, side="right") - 1
+        cluster = np.where((j >= 0) & (j <= len(b) - 2), j + 1, np.nan)
+
+        return LineSet(
+            sx, sy, ex, ey, cluster=cluster, case=self.case[line], type=self.type[line],
+            source=self.source[line], part=k + 1,
+        )
+
+    # ------------------------------------------------------------------
+    # Top / bottom ranking and distances
+    # ------------------------------------------------------------------
+    def assign_top_bottom(self):
+        """
+        Within each (cluster, case) group of at least two lines, mark the line with the smallest
+        min(y1, y2) as TYPE_TOP and the next one as TYPE_BOTTOM; all other lines get TYPE_NONE.
+        Ties keep the original line order. Lines with a NaN cluster or case stay TYPE_NONE.
+        """
+        self.type = np.full(len(self), TYPE_NONE, dtype=np.int8)
+        gid, n_groups = _group_ids(self.cluster, self.case)
+        valid = gid >= 0
+        if n_groups == 0:
+            return self.type
+
+        y_min = np.minimum(self.y1, self.y2).astype(float)
+        idx = np.flatnonzero(valid)
+        order = idx[np.lexsort((y_min[idx], gid[idx]))]   # by group, then y_min (stable)
+
+        counts = np.bincount(gid[idx], minlength=n_groups)
+        group_start = np.cumsum(counts) - counts
+        rank = np.arange(len(order)) - group_start[gid[order]]
+        big_group = counts[gid[order]] >= 2
+
+        self.type[order[big_group & (rank == 0)]] = TYPE_TOP
+        self.type[order[big_group & (rank == 1)]] = TYPE_BOTTOM
+        return self.type
+
+    def distances(self, central_line_y=CENTRAL_LINE_Y):
+        """
+        Distances used by the width equations.
+
+        Returns:
+        - dist_btwn: Distance between the midpoints of the top and bottom line of each (cluster, case)
+          group that has exactly one of each (NaN elsewhere).
+        - dist_central_abs, dist_central: |mid_y - central_line_y| and mid_y - central_line_y
+          (NaN for lines with a NaN cluster or case).
+        """
+        n = len(self)
+        mid_x = (self.x1 + self.x2) / 2
+        mid_y = (self.y1 + self.y2) / 2
+        gid, n_groups = _group_ids(self.cluster, self.case)
+        valid = gid >= 0
+
+        dist_central = np.where(valid, mid_y - central_line_y, np.nan)
+        dist_central_abs = np.abs(dist_central)
+
+        dist_btwn = np.full(n, np.nan)
+        if n_groups:
+            is_top = valid & (self.type == TYPE_TOP)
+            is_bottom = valid & (self.type == TYPE_BOTTOM)
+            n_top = np.bincount(gid[is_top], minlength=n_groups)
+            n_bottom = np.bincount(gid[is_bottom], minlength=n_groups)
+            paired = (n_top == 1) & (n_bottom == 1)
+
+            top_x = np.full(n_groups, np.nan)
+            top_y = np.full(n_groups, np.nan)
+            bottom_x = np.full(n_groups, np.nan)
+            bottom_y = np.full(n_groups, np.nan)
+            top_x[gid[is_top]] = mid_x[is_top]
+            top_y[gid[is_top]] = mid_y[is_top]
+            bottom_x[gid[is_bottom]] = mid_x[is_bottom]
+            bottom_y[gid[is_bottom]] = mid_y[is_bottom]
+            group_dist = np.sqrt((bottom_x - top_x) ** 2 + (bottom_y - top_y) ** 2)
+
+            on_pair = (is_top | is_bottom) & paired[np.where(valid, gid, 0)]
+            dist_btwn[on_pair] = group_dist[gid[on_pair]]
+
+        return dist_btwn, dist_central_abs, dist_central
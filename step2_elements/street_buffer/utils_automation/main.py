@@ -1,166 +1,220 @@
 import os
+import time
+import argparse
 import warnings
-import torch
+from functools import partial
 import pandas as pd
 import numpy as np
+import pyarrow as pa
 
-from config import API_KEY, OUTPUT_DIR, GEOJSON_PATH
+from config import API_KEY, OUTPUT_DIR, GEOJSON_PATH, SEG_BATCH_SIZE, LINKS_PER_BATCH, DOWNLOAD_THREADS, GEOMETRY_WORKERS, QUEUE_SIZE, MASK_FORMAT, RUN_JOURNAL_PATH, RESULT_FORMAT, RESULT_DIR, RESULT_BATCH_ROWS, COMBINED_SIDEWALK, REPORT_PATH, SEG_ROI, GATE_MIN_SIDEWALK_FRACTION, IN_MEMORY_IMAGES, GEOMETRY_PARAMS, SEG_BACKEND, SEG_INT8, SEG_INPUT_SIZE
 from load_points import load_midpoints
-from download_image import download_images_for_temp
-from segmentation import load_segmentation_model, run_segmentation
-from sidewalk_processing import process_sidewalk_edges
+from download_image import download_images_for_temp, take_decoded, fetcher
+from segmentation import load_segmentation_model, segment_images, horizon_row
+from pipeline import run_pipeline
+from run_journal import RunJournal, resumable_download, resumable_segment, finished_link
+from result_sink import ParquetResultSink
+from instrumentation import RunReport, activate, stage
+from pano_gate import GateStats, rejected_units, timed_measure
+from sidewalk_processing import process_sidewalk_edges, estimate_sidewalk_width_from_typed
+from image_processing_c import assign_top_or_bottom_and_filter
 from road_processing import process_road_edges, filter_top_road_edge
 from buffer_calculation import combine_sidewalk_and_road_edges, calculate_buffer_width
 
 # Suppress PyTorch / Python warnings
 warnings.filterwarnings("ignore")
-torch._C._jit_set_profiling_mode(False)
-torch._C._jit_set_profiling_executor(False)
 
 # ==============================
 # Parameters
 # ==============================
 PITCH_VALUES = [0, -10]   # Pitches we want
 FOV = 80                  # Field of View (degrees)
+SIDEWALK_COLUMNS = ["width", "error_code"] if COMBINED_SIDEWALK else []   # Sidewalk results of the combined mode
+OUTPUT_COLUMNS = ["buffer_width", "buffer_error_code"] + SIDEWALK_COLUMNS   # Results checkpointed per side in the run journal
+RESULT_SCHEMA = pa.schema([               # Columns saved per side ('buffer_width' = "None" is stored as no_buffer=True)
+    ("link_id", pa.string()), ("point_id", pa.int32()), ("bearing", pa.float64()), ("side", pa.string()),
+    ("pano_id", pa.string()), ("pano_lat", pa.float64()), ("pano_lon", pa.float64()),
+    ("pano_heading", pa.float64()), ("pano_date", pa.string()),
+    ("buffer_width", pa.float64()), ("no_buffer", pa.bool_()), ("buffer_error_code", pa.int8()),
+] + ([("width", pa.float64()), ("error_code", pa.int8())] if COMBINED_SIDEWALK else []))
+
+
+def sidewalk_width_for_side(sidewalk_typed, sidewalk_err, save_dir, link_id, side):
+    """
+    Combined mode: sidewalk (width, error_code) of one side from its labelled sidewalk edges,
+    with the error codes of the sidewalk pipeline.
+    """
+    if sidewalk_typed is None:
+        if sidewalk_err == 0:
+            return 0, None  # no sidewalk → width=0
+        return None, 1 if sidewalk_err is None else sidewalk_err
+
+    width = estimate_sidewalk_width_from_typed(sidewalk_typed.copy(), save_dir, link_id=link_id, side=side)
+    if width is None:
+        return None, 3
+    if width < 0:
+        return None, 4
+    return width, None
+
+
+def measure_link(temp_gdf, results, seg_results, journal=None, report=None, params=GEOMETRY_PARAMS):
+    """
+    Run sidewalk/road edge detection and buffer width estimation for one link
+    (and sidewalk width estimation from the same edges with COMBINED_SIDEWALK).
+
+    Parameters:
+    - temp_gdf: Rows of the link (one per side).
+    - results: {(link_id, side, panoid, pitch): img_path} for the link's downloaded images.
+    - seg_results: {(link_id, side, panoid, pitch): mask} for the link's segmented images.
+    - journal: Optional RunJournal; sides with an 'edges' or 'width' checkpoint resume from it,
+      and newly finished stages are checkpointed.
+    - report: Optional RunReport receiving the stage timings (activated in the worker process).
+    - params: Edge detection and width thresholds (GEOMETRY_PARAMS; replay.py passes other values).
+
+    Returns:
+    - temp_gdf with 'buffer_width' and 'buffer_error_code' columns (and 'width' and 'error_code' with COMBINED_SIDEWALK).
+    """
+    if report is not None:
+        activate(report)
+    print(f"\n=== Processing {temp_gdf['link_id'].iloc[0]} ({len(temp_gdf)} rows) ===")
+    unit_rows = {(row["link_id"], row["side"]): row for _, row in temp_gdf.iterrows()}
 
-# ==============================
-# Main Entry
-# ==============================
-if __name__ == "__main__":
     # ------------------------------
-    # Step 0: Load candidate points
+    # Step 4: Extract sidewalk edges
     # ------------------------------
-    print("⏳ Loading midpoints...")
-    link_groups = load_midpoints(GEOJSON_PATH)
+    print("\n⏳ Detecting sidewalk edges...")
+    sidewalk_edge_results = {}
+    sidewalk_error_map = {}
+    road_edge_results = {}
+    road_error_map = {}
+    resumed_edges = set()
+    resumed_widths = {}
+
+    if journal is not None:
+        for unit, row in unit_rows.items():
+            widths = journal.load(row, "width")
+            if widths is not None:
+                resumed_widths[unit] = widths
+            edges = journal.load(row, "edges")
+            if edges is not None:
+                sidewalk_edge_results.update(edges["sidewalk_lines"])
+                sidewalk_error_map.update(edges["sidewalk_errors"])
+                road_edge_results.update(edges["road_lines"])
+                road_error_map.update(edges["road_errors"])
+                resumed_edges.add(unit)
+
+    # Early rejection: sides whose first pitch shows (almost) no sidewalk are marked "no sidewalk" (error 0)
+    # without edge detection, like sides where edge detection finds none
+    gated = rejected_units(seg_results, PITCH_VALUES[0], GATE_MIN_SIDEWALK_FRACTION)
+    seg_results = {key: mask for key, mask in seg_results.items() if key[:2] not in gated}
+    for unit in gated:
+        sidewalk_error_map[unit] = 0
+
+    for key, mask in seg_results.items():
+        link_id, side, panoid, pitch = key
+        save_dir = os.path.dirname(results[key])
+
+        with stage("sidewalk_edges", link_id=link_id, side=side, pitch=pitch) as record:
+            lines_df, err = process_sidewalk_edges(mask, results[key], save_dir, pitch, params=params)
+            record["items"] = 0 if lines_df is None else len(lines_df)
+        if lines_df is not None:
+            sidewalk_edge_results[key] = lines_df
+            sidewalk_error_map[(link_id, side)] = None
+        else:
+            sidewalk_error_map[(link_id, side)] = err
 
     # ------------------------------
-    # Step 1: Load segmentation model once
+    # Step 5: Extract road edges
     # ------------------------------
-    print("\n⏳ Loading segmentation model...")
-    model = load_segmentation_model()
+    print("\n⏳ Detecting road edges...")
+
+    for key, mask in seg_results.items():
+        link_id, side, panoid, pitch = key
+        save_dir = os.path.dirname(results[key])
+
+        with stage("road_edges", link_id=link_id, side=side, pitch=pitch) as record:
+            road_lines_df, err = process_road_edges(mask, results[key], save_dir, pitch, params=params)
+            record["items"] = 0 if road_lines_df is None else len(road_lines_df)
+            # Filter to keep only top edge
+            road_top_df = None if road_lines_df is None else filter_top_road_edge(road_lines_df)
+        if road_lines_df is not None:
+            road_edge_results[key] = road_top_df
+            road_error_map[(link_id, side)] = None
+        else:
+            road_error_map[(link_id, side)] = err
+
+    if journal is not None:
+        for unit, row in unit_rows.items():
+            if unit not in resumed_edges and journal.done(row, "segmented"):
+                journal.record(row, "edges", {
+                    "sidewalk_lines": {key: df for key, df in sidewalk_edge_results.items() if key[:2] == unit},
+                    "sidewalk_errors": {unit: sidewalk_error_map[unit]} if unit in sidewalk_error_map else {},
+                    "road_lines": {key: df for key, df in road_edge_results.items() if key[:2] == unit},
+                    "road_errors": {unit: road_error_map[unit]} if unit in road_error_map else {},
+                })
 
     # ------------------------------
-    # Process each link_id separately
+    # Step 6: Calculate buffer widths per side
     # ------------------------------
-    for link_id, temp_gdf in link_groups.items():
-        print(f"\n=== Processing {link_id} ({len(temp_gdf)} rows) ===")
-
-        # ------------------------------
-        # Step 2: Download Street View images
-        # ------------------------------
-        print("\n⏳ Downloading Street View images...")
-        results = download_images_for_temp(temp_gdf, pitch_values=PITCH_VALUES, fov=FOV)
-
-        # ------------------------------
-        # Step 3: Run segmentation
-        # ------------------------------
-        print("\n⏳ Running segmentation on downloaded images...")
-        seg_results = {}
-        for key, img_path in results.items():
-            link_id, side, panoid, pitch = key
-            save_dir = os.path.dirname(img_path)
-
-            pixel_df = run_segmentation(model, img_path, save_dir)
-            if pixel_df is None or pixel_df.empty:
-                print(f"⚠️ Skipping segmentation for {img_path} (empty result).")
+    print("\n⏳ Calculating buffer widths...")
+    buffer_width_results = {}
+    buffer_error_results = {}
+    sidewalk_width_results = {}
+    sidewalk_error_results = {}
+
+    # Create grouped dataframe for edges that exist
+    if sidewalk_edge_results:
+        edge_grouped = pd.DataFrame(list(sidewalk_edge_results.keys()), 
+                                   columns=["link_id", "side", "panoid", "pitch"])
+
+        for (lid, side), group in edge_grouped.groupby(["link_id", "side"]):
+            if (lid, side) in resumed_widths:
                 continue
+            # Combine sidewalk edges (with top/bottom labels)
+            combined_sidewalk = pd.DataFrame()
+            combined_road = pd.DataFrame()
 
-            seg_results[key] = pixel_df
-            print(f"✅ Segmentation done for {img_path}")
-
-        print(f"\n🎉 Total images segmented: {len(seg_results)}")
-
-        # ------------------------------
-        # Step 4: Extract sidewalk edges
-        # ------------------------------
-        print("\n⏳ Detecting sidewalk edges...")
-        sidewalk_edge_results = {}
-        sidewalk_error_map = {}
-        
-        for key, pixel_df in seg_results.items():
-            link_id, side, panoid, pitch = key
-            save_dir = os.path.dirname(results[key])
-
-            lines_df, err = process_sidewalk_edges(pixel_df, results[key], save_dir, pitch)
-            if lines_df is not None:
-                sidewalk_edge_results[key] = lines_df
-                sidewalk_error_map[(link_id, side)] = None
-            else:
-                sidewalk_error_map[(link_id, side)] = err
-
-        # ------------------------------
-        # Step 5: Extract road edges
-        # ------------------------------
-        print("\n⏳ Detecting road edges...")
-        road_edge_results = {}
-        road_error_map = {}
-        
-        for key, pixel_df in seg_results.items():
-            link_id, side, panoid, pitch = key
-            save_dir = os.path.dirname(results[key])
-
-            road_lines_df, err = process_road_edges(pixel_df, results[key], save_dir, pitch)
-            if road_lines_df is not None:
-                # Filter to keep only top edge
-                road_top_df = filter_top_road_edge(road_lines_df)
-                road_edge_results[key] = road_top_df
-                road_error_map[(link_id, side)] = None
-            else:
-                road_error_map[(link_id, side)] = err
-
-        # ------------------------------
-        # Step 6: Calculate buffer widths per side
-        # ------------------------------
-        print("\n⏳ Calculating buffer widths...")
-        buffer_width_results = {}
-        buffer_error_results = {}
-        
-        # Create grouped dataframe for edges that exist
-        if sidewalk_edge_results:
-            edge_grouped = pd.DataFrame(list(sidewalk_edge_results.keys()), 
-                                       columns=["link_id", "side", "panoid", "pitch"])
-            
-            for (lid, side), group in edge_grouped.groupby(["link_id", "side"]):
-                # Combine sidewalk edges (with top/bottom labels)
-                combined_sidewalk = pd.DataFrame()
-                combined_road = pd.DataFrame()
-                
-                for _, row in group.iterrows():
-                    key = (row["link_id"], row["side"], row["panoid"], row["pitch"])
-                    
-                    # Get sidewalk edges
-                    if key in sidewalk_edge_results:
-                        sw_df = sidewalk_edge_results[key].copy()
-                        sw_df["pitch"] = row["pitch"]
-                        combined_sidewalk = pd.concat([combined_sidewalk, sw_df], ignore_index=True)
-                    
-                    # Get road edges
-                    if key in road_edge_results:
-                        rd_df = road_edge_results[key].copy()
-                        rd_df["pitch"] = row["pitch"]
-                        combined_road = pd.concat([combined_road, rd_df], ignore_index=True)
-                
-                # Check if we have both sidewalk and road data
-                if combined_sidewalk.empty or combined_road.empty:
-                    buffer_width_results[(lid, side)] = None
-                    
-                    if combined_sidewalk.empty and combined_road.empty:
-                        buffer_error_results[(lid, side)] = 5  # Both missing
-                    elif combined_sidewalk.empty:
-                        buffer_error_results[(lid, side)] = 6  # Sidewalk missing
-                    else:
-                        buffer_error_results[(lid, side)] = 7  # Road missing
-                    continue
-                
-                # Need to assign top/bottom to sidewalk edges first
-                from image_processing_c import assign_top_or_bottom_and_filter
-                
-                combined_sidewalk_typed = assign_top_or_bottom_and_filter(combined_sidewalk)
-
-                first = group.iloc[0]
-                img_key = (first["link_id"], first["side"], first["panoid"], first["pitch"])
-                save_dir = os.path.dirname(results[img_key])
-                
+            for _, row in group.iterrows():
+                key = (row["link_id"], row["side"], row["panoid"], row["pitch"])
+
+                # Get sidewalk edges
+                if key in sidewalk_edge_results:
+                    sw_df = sidewalk_edge_results[key].copy()
+                    sw_df["pitch"] = row["pitch"]
+                    combined_sidewalk = pd.concat([combined_sidewalk, sw_df], ignore_index=True)
+
+                # Get road edges
+                if key in road_edge_results:
+                    rd_df = road_edge_results[key].copy()
+                    rd_df["pitch"] = row["pitch"]
+                    combined_road = pd.concat([combined_road, rd_df], ignore_index=True)
+
+            first = group.iloc[0]
+            img_key = (first["link_id"], first["side"], first["panoid"], first["pitch"])
+            save_dir = os.path.dirname(results[img_key])
+
+            # Need to assign top/bottom to sidewalk edges first
+            combined_sidewalk_typed = None if combined_sidewalk.empty else assign_top_or_bottom_and_filter(combined_sidewalk)
+
+            if COMBINED_SIDEWALK:
+                with stage("width", link_id=lid, side=side, items=len(combined_sidewalk)):
+                    sidewalk_width_results[(lid, side)], sidewalk_error_results[(lid, side)] = sidewalk_width_for_side(
+                        combined_sidewalk_typed, sidewalk_error_map.get((lid, side)), save_dir, lid, side
+                    )
+
+            # Check if we have both sidewalk and road data
+            if combined_sidewalk.empty or combined_road.empty:
+                buffer_width_results[(lid, side)] = None
+
+                if combined_sidewalk.empty and combined_road.empty:
+                    buffer_error_results[(lid, side)] = 5  # Both missing
+                elif combined_sidewalk.empty:
+                    buffer_error_results[(lid, side)] = 6  # Sidewalk missing
+                else:
+                    buffer_error_results[(lid, side)] = 7  # Road missing
+                continue
+
+            with stage("buffer_width", link_id=lid, side=side, items=len(combined_sidewalk) + len(combined_road)):
                 # Combine sidewalk bottom with road top
                 combined_for_buffer = combine_sidewalk_and_road_edges(
                     combined_sidewalk_typed, 
@@ -169,93 +223,277 @@ if __name__ == "__main__":
                     link_id=lid,   # ADD THIS
                     side=side      # ADD THIS
                 )
-                        
-                if combined_for_buffer.empty:
-                    buffer_width_results[(lid, side)] = None
-                    buffer_error_results[(lid, side)] = None  # treat as "no buffer info"
-                    continue
-                
-                buffer_width = calculate_buffer_width(
+
+                buffer_width = None if combined_for_buffer.empty else calculate_buffer_width(
                     combined_for_buffer, 
                     save_dir=save_dir, 
                     link_id=lid, 
-                    side=side
+                    side=side,
+                    proximity_threshold=params["proximity_threshold"],
+                    alignment_threshold=params["alignment_threshold"],
+                    alignment_ratio_threshold=params["alignment_ratio_threshold"],
                 )
-                
-                if buffer_width is None:
-                    buffer_width_results[(lid, side)] = None  # No buffer (edges touching)
-                    buffer_error_results[(lid, side)] = None  # Not an error, just no buffer
-                elif buffer_width < 0:
-                    buffer_width_results[(lid, side)] = None
-                    buffer_error_results[(lid, side)] = 8  # Negative width
-                else:
-                    buffer_width_results[(lid, side)] = buffer_width
-                    buffer_error_results[(lid, side)] = None
-
-        # ------------------------------
-        # Step 7: Merge buffer widths into temp_gdf
-        # ------------------------------
-        temp_gdf["buffer_width"] = np.nan
-        temp_gdf["buffer_error_code"] = None
-
-        for idx, row in temp_gdf.iterrows():
-            key = (row["link_id"], row["side"])
-        
-            buffer_val = buffer_width_results.get(key, None)
-            buffer_err_val = buffer_error_results.get(key, None)
-        
-            sidewalk_err = sidewalk_error_map.get(key, None)
-            road_err = road_error_map.get(key, None)
-        
-            final_err_code = buffer_err_val
-        
-            # 1) If buffer_error_results already has a code (5,6,7,8...),
-            if buffer_err_val is not None:
-                temp_gdf.at[idx, "buffer_width"] = np.nan
-        
-            # 2) Else, if detection failed (sidewalk or road error),
-            elif (sidewalk_err is not None) or (road_err is not None):
-                temp_gdf.at[idx, "buffer_width"] = np.nan
-        
-                if final_err_code is None:
-                    final_err_code = sidewalk_err if sidewalk_err is not None else road_err
-        
-            # 3) No errors anywhere → detection OK
+
+            if combined_for_buffer.empty:
+                buffer_width_results[(lid, side)] = None
+                buffer_error_results[(lid, side)] = None  # treat as "no buffer info"
+                continue
+
+            if buffer_width is None:
+                buffer_width_results[(lid, side)] = None  # No buffer (edges touching)
+                buffer_error_results[(lid, side)] = None  # Not an error, just no buffer
+            elif buffer_width < 0:
+                buffer_width_results[(lid, side)] = None
+                buffer_error_results[(lid, side)] = 8  # Negative width
             else:
-                if buffer_val is None:
-                    # Edges detected, but classified as NO STREET BUFFER
-                    temp_gdf.at[idx, "buffer_width"] = "None"
-                else:
-                    temp_gdf.at[idx, "buffer_width"] = round(buffer_val, 2)
-        
-            temp_gdf.at[idx, "buffer_error_code"] = final_err_code
+                buffer_width_results[(lid, side)] = buffer_width
+                buffer_error_results[(lid, side)] = None
+
+    # Combined mode: sides without sidewalk edges (no sidewalk, failed detection) get the sidewalk pipeline's outcome
+    if COMBINED_SIDEWALK:
+        for unit, err in sidewalk_error_map.items():
+            if unit not in sidewalk_width_results and unit not in resumed_widths:
+                sidewalk_width_results[unit], sidewalk_error_results[unit] = sidewalk_width_for_side(None, err, None, *unit)
 
+    # ------------------------------
+    # Step 7: Merge buffer widths into temp_gdf
+    # ------------------------------
+    temp_gdf["buffer_width"] = np.nan
+    temp_gdf["buffer_error_code"] = None
+    if COMBINED_SIDEWALK:
+        temp_gdf["width"] = np.nan
+        temp_gdf["error_code"] = None
 
+    for idx, row in temp_gdf.iterrows():
+        key = (row["link_id"], row["side"])
+        if key in resumed_widths:
+            for col in OUTPUT_COLUMNS:
+                temp_gdf.at[idx, col] = resumed_widths[key][col]
+            continue
 
-        print("\n" + "="*60)
-        print(temp_gdf[["link_id", "side", "buffer_width", "buffer_error_code"]])
-        print("="*60)
+        buffer_val = buffer_width_results.get(key, None)
+        buffer_err_val = buffer_error_results.get(key, None)
 
-        # ------------------------------
-        # Step 8: Save results per panoid
-        # ------------------------------
-        cols_to_keep = [
-            "link_id", "point_id", "bearing", "side", "pano_id", 
-            "pano_lat", "pano_lon", "pano_heading", "pano_date", 
-            "buffer_width", "buffer_error_code"
-        ]
+        sidewalk_err = sidewalk_error_map.get(key, None)
+        road_err = road_error_map.get(key, None)
+
+        final_err_code = buffer_err_val
+
+        # 1) If buffer_error_results already has a code (5,6,7,8...),
+        if buffer_err_val is not None:
+            temp_gdf.at[idx, "buffer_width"] = np.nan
+
+        # 2) Else, if detection failed (sidewalk or road error),
+        elif (sidewalk_err is not None) or (road_err is not None):
+            temp_gdf.at[idx, "buffer_width"] = np.nan
 
-        panoid = temp_gdf["pano_id"].iloc[0]
-        output_path = os.path.join(OUTPUT_DIR, f"{panoid}.csv")
+            if final_err_code is None:
+                final_err_code = sidewalk_err if sidewalk_err is not None else road_err
+
+        # 3) No errors anywhere → detection OK
+        else:
+            if buffer_val is None:
+                # Edges detected, but classified as NO STREET BUFFER
+                temp_gdf.at[idx, "buffer_width"] = "None"
+            else:
+                temp_gdf.at[idx, "buffer_width"] = round(buffer_val, 2)
+
+        temp_gdf.at[idx, "buffer_error_code"] = final_err_code
+
+        if COMBINED_SIDEWALK:
+            width_val = sidewalk_width_results.get(key, None)
+            temp_gdf.at[idx, "width"] = np.nan if width_val is None else round(width_val, 2)
+            temp_gdf.at[idx, "error_code"] = sidewalk_error_results.get(key, None)
+
+        if journal is not None and journal.done(row, "edges"):
+            journal.record(row, "width", {col: temp_gdf.at[idx, col] for col in OUTPUT_COLUMNS})
+
+
+
+    print("\n" + "="*60)
+    print(temp_gdf[["link_id", "side"] + OUTPUT_COLUMNS])
+    print("="*60)
+    return temp_gdf
+
+
+def link_output_path(temp_gdf):
+    """OUTPUT_DIR/<first panoid>.csv of one link."""
+    return os.path.join(OUTPUT_DIR, f"{temp_gdf['pano_id'].iloc[0]}.csv")
+
+
+def save_link(temp_gdf, sink=None):
+    """Step 8: Save results of one link to the ParquetResultSink `sink`, or as OUTPUT_DIR/<first panoid>.csv."""
+    cols_to_keep = [
+        "link_id", "point_id", "bearing", "side", "pano_id", 
+        "pano_lat", "pano_lon", "pano_heading", "pano_date", 
+        "buffer_width", "buffer_error_code"
+    ] + SIDEWALK_COLUMNS
+
+    with stage("save", link_id=temp_gdf["link_id"].iloc[0], items=len(temp_gdf)):
+        if sink is not None:
+            sink.append(temp_gdf[cols_to_keep].assign(no_buffer=temp_gdf["buffer_width"].eq("None")))
+            print(f"\n✅ Saved {temp_gdf['link_id'].iloc[0]} to {sink.result_dir}")
+            return
+
+        output_path = link_output_path(temp_gdf)
         temp_gdf[cols_to_keep].to_csv(output_path, index=False)
         print(f"\n✅ Saved {output_path}")
-        
-        # Print error code legend
-        # print("\n📋 Buffer Error Code Legend:")
-        # print("  5 = Both sidewalk and road edges missing")
-        # print("  6 = Sidewalk edges missing")
-        # print("  7 = Road edges missing")
-        # print("  8 = Negative buffer width calculated")
-        # print("  None (no error) = Either buffer exists OR edges touching (no buffer)")
-        # print("  buffer_width=None + buffer_error_code=None → Edges are touching (no buffer)")
-        # print("  buffer_width=value + buffer_error_code=None → Buffer exists")
\ No newline at end of file
+
+
+# ==============================
+# Main Entry
+# ==============================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimate street buffer widths for the points in GEOJSON_PATH (see config.py).")
+    parser.add_argument("--profile", nargs="+", default=[], metavar="STAGE",
+                        help="Also run these stages under cProfile ('all' for every stage): "
+                             "model, download, segmentation, sidewalk_edges, road_edges, buffer_width, width, plotting, save")
+    args = parser.parse_args()
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    # Per-stage timings (wall/CPU time, peak RSS, item counts) as JSON lines
+    report = None
+    if REPORT_PATH or args.profile:
+        report = RunReport(REPORT_PATH or os.path.join(OUTPUT_DIR, "reports", "run_report.jsonl"), profile=args.profile)
+        activate(report)
+        print(f"📊 Run report: {report.path} (run {report.run_id})")
+
+    # ------------------------------
+    # Step 0: Load candidate points
+    # ------------------------------
+    print("⏳ Loading midpoints...")
+    link_groups = load_midpoints(GEOJSON_PATH)
+
+    # ------------------------------
+    # Resume: skip links finished by an earlier (interrupted) run
+    # ------------------------------
+    sink = ParquetResultSink(RESULT_DIR, RESULT_SCHEMA, batch_rows=RESULT_BATCH_ROWS) if RESULT_FORMAT == "parquet" else None
+    journal = None
+    if RUN_JOURNAL_PATH:
+        saved_links = sink.links() if sink is not None else None
+        params = {"element": "street_buffer", "pitch_values": PITCH_VALUES, "fov": FOV, "combined_sidewalk": COMBINED_SIDEWALK}
+        if GATE_MIN_SIDEWALK_FRACTION is not None:
+            params["gate"] = GATE_MIN_SIDEWALK_FRACTION  # changes which pitches are segmented
+        params["seg_backend"] = SEG_BACKEND  # masks of another backend are segmented again
+        if SEG_BACKEND != "mmseg":
+            params["seg_int8"], params["seg_input_size"] = SEG_INT8, SEG_INPUT_SIZE
+        if SEG_ROI is not None:
+            params["seg_roi"] = SEG_ROI  # masks cropped to another band are segmented again
+        params["geometry"] = GEOMETRY_PARAMS  # links measured with other thresholds are processed again
+        journal = RunJournal(RUN_JOURNAL_PATH, params=params)
+        pending = {}
+        for link_id, temp_gdf in link_groups.items():
+            done_gdf = finished_link(journal, temp_gdf, OUTPUT_COLUMNS)
+            if done_gdf is None:
+                pending[link_id] = temp_gdf
+            elif sink is not None and str(link_id) not in saved_links:
+                save_link(done_gdf, sink)
+            elif sink is None and not os.path.exists(link_output_path(done_gdf)):
+                save_link(done_gdf)
+        print(f"♻️ Run journal: {len(link_groups) - len(pending)} links already finished, {len(pending)} to process")
+        link_groups = pending
+    unit_rows = {(row["link_id"], row["side"]): row for temp_gdf in link_groups.values() for _, row in temp_gdf.iterrows()}
+
+    # ------------------------------
+    # Step 1: Load segmentation model once
+    # ------------------------------
+    print("\n⏳ Loading segmentation model...")
+    with stage("model"):
+        model = load_segmentation_model()
+    if SEG_ROI is not None and SEG_ROI[0] > horizon_row(min(PITCH_VALUES), FOV):
+        print(f"⚠️ SEG_ROI starts at row {SEG_ROI[0]}, below the horizon at pitch {min(PITCH_VALUES)} "
+              f"(row {horizon_row(min(PITCH_VALUES), FOV):.0f}); edges above it are not segmented")
+
+    # ------------------------------
+    # Steps 2-8: Stream links through download → segmentation → edges/widths → output
+    # (stages run concurrently with bounded queues; segmentation batches span several links)
+    # ------------------------------
+    # Early rejection: only the first pitch is downloaded and segmented up front; the other pitches
+    # only for sides whose first-pitch mask shows enough sidewalk
+    gate_stats = GateStats() if GATE_MIN_SIDEWALK_FRACTION is not None else None
+    first_pitches = PITCH_VALUES[:1] if gate_stats is not None else PITCH_VALUES
+
+    def download_rows(rows, pitch_values=PITCH_VALUES):
+        print(f"\n=== Downloading {rows['link_id'].iloc[0]} ({len(rows)} rows) ===")
+        t0 = time.perf_counter()
+        with stage("download", link_id=rows["link_id"].iloc[0]) as record:
+            img_results = download_images_for_temp(rows, pitch_values=pitch_values, fov=FOV)
+            record["items"] = len(img_results)
+        if gate_stats is not None:
+            gate_stats.add_time("download", time.perf_counter() - t0, len(img_results))
+        return img_results
+
+    def segment_all(img_results, images=None):
+        print("\n⏳ Running segmentation on downloaded images...")
+        t0 = time.perf_counter()
+        with stage("segmentation", items=len(img_results), links=len({key[0] for key in img_results})):
+            seg_results = segment_images(model, img_results, batch_size=SEG_BATCH_SIZE, images=images)
+        if gate_stats is not None:
+            gate_stats.add_time("segmentation", time.perf_counter() - t0, len(img_results))
+        return seg_results
+
+    def download(temp_gdf):
+        return resumable_download(journal, temp_gdf, partial(download_rows, pitch_values=first_pitches),
+                                  n_images=len(first_pitches))
+
+    def gate(temp_gdf, results, seg_results):
+        """Rows of a link that pass the gate and need their other pitches."""
+        rejected = rejected_units(seg_results, PITCH_VALUES[0], GATE_MIN_SIDEWALK_FRACTION)
+        gate_stats.add_gate(len(temp_gdf), len(rejected), len(PITCH_VALUES))
+        keep = [
+            (row["link_id"], row["side"]) not in rejected and not (journal is not None and journal.done(row, "edges"))
+            for _, row in temp_gdf.iterrows()
+        ]
+        return temp_gdf[keep]
+
+    def download_more(rows):
+        return download_rows(rows, pitch_values=PITCH_VALUES[1:])
+
+    def segment(img_results):
+        # Images decoded at download (IN_MEMORY_IMAGES) are taken here, also for units the journal skips
+        images = take_decoded(img_results) if IN_MEMORY_IMAGES else None
+        return resumable_segment(journal, unit_rows, img_results, partial(segment_all, images=images), MASK_FORMAT)
+
+    measure = partial(measure_link, journal=journal, report=report)
+    save = partial(save_link, sink=sink)
+    if gate_stats is not None:
+        measure = partial(timed_measure, measure, PITCH_VALUES[0], GATE_MIN_SIDEWALK_FRACTION)
+        save = gate_stats.saving(save)
+
+    try:
+        with stage("run", items=len(link_groups)):
+            n_links = run_pipeline(
+                link_groups.items(), download, segment, measure, save,
+                download_threads=DOWNLOAD_THREADS,
+                geometry_workers=GEOMETRY_WORKERS,
+                queue_size=QUEUE_SIZE,
+                images_per_batch=SEG_BATCH_SIZE,
+                links_per_batch=LINKS_PER_BATCH,
+                gate=gate if gate_stats is not None else None,
+                download_more=download_more,
+            )
+    finally:
+        fetcher.close()  # waits for downloads still being written in the background
+        if sink is not None:
+            sink.close()
+    if sink is not None:
+        print(f"✅ Results: {sink.compact()}")
+    print(f"\n🎉 Total links processed: {n_links}")
+    if gate_stats is not None:
+        gate_stats.print_summary()
+
+    if report is not None:
+        print(f"\n📊 Stage summary (run {report.run_id}):")
+        report.write_summary()
+        if args.profile:
+            report.write_profiles()
+
+    # Print error code legend
+    # print("\n📋 Buffer Error Code Legend:")
+    # print("  5 = Both sidewalk and road edges missing")
+    # print("  6 = Sidewalk edges missing")
+    # print("  7 = Road edges missing")
+    # print("  8 = Negative buffer width calculated")
+    # print("  None (no error) = Either buffer exists OR edges touching (no buffer)")
+    # print("  buffer_width=None + buffer_error_code=None → Edges are touching (no buffer)")
+    # print("  buffer_width=value + buffer_error_code=None → Buffer exists")
\ No newline at end of file
@@ -0,0 +1,232 @@
+import os
+import queue
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+# End-of-stream marker sent by each download thread, and "nothing to get" marker of _get
+_END = object()
+_DONE = object()
+
+# Geometry workers must not be forked from this process once the download/model threads run and torch is
+# loaded (a fork copies locks those threads hold); they start from a clean forkserver (or spawned) process
+_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+class _Stage:
+    """Shared state of a running pipeline: first error raised by any stage thread."""
+
+    def __init__(self):
+        self.error = None
+        self.lock = threading.Lock()
+
+    def fail(self, exc):
+        with self.lock:
+            if self.error is None:
+                self.error = exc
+
+
+def _put(state, q, item):
+    """Put with back-pressure, giving up once another stage has failed (so no thread blocks forever)."""
+    while True:
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            if state.error is not None:
+                return False
+
+
+def _get(state, q, timeout=None):
+    """Get from q; returns _DONE if nothing arrives within `timeout` or another stage has failed."""
+    waited = 0.0
+    while True:
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            waited += 0.1
+            if state.error is not None or (timeout is not None and waited >= timeout):
+                return _DONE
+
+
+def _download_worker(state, link_iter, iter_lock, download, out_q):
+    """I/O thread: take the next link, download its images, pass it on (blocks when out_q is full)."""
+    try:
+        while state.error is None:
+            with iter_lock:
+                item = next(link_iter, _DONE)
+            if item is _DONE:
+                break
+            link_id, temp_gdf = item
+            if not _put(state, out_q, (link_id, temp_gdf, download(temp_gdf), None)):
+                break
+    except Exception as exc:
+        state.fail(exc)
+    finally:
+        _put(state, out_q, _END)
+
+
+def _more_worker(state, in_q, download_more, out_q):
+    """
+    I/O thread of the second pass: download the remaining images of links let through by the gate
+    and send them back to the model thread with the masks of their first pass.
+    """
+    try:
+        while state.error is None:
+            item = _get(state, in_q)
+            if item is _DONE or item is _END:
+                break
+            link_id, temp_gdf, rows, first_pass = item
+            if not _put(state, out_q, (link_id, temp_gdf, download_more(rows), first_pass)):
+                break
+    except Exception as exc:
+        state.fail(exc)
+
+
+def _model_worker(state, in_q, segment, out_q, n_producers, images_per_batch, links_per_batch,
+                  gate=None, more_q=None):
+    """
+    Model thread: gather downloaded links until a batch holds `images_per_batch` images
+    (or `links_per_batch` links, or nothing else is waiting), segment them together,
+    and pass each link on with its masks.
+
+    With a `gate`, links that need more images after their first pass go to `more_q` instead,
+    and come back through `in_q` with the new images (and their first-pass images and masks).
+    """
+    done = 0
+    pending = 0   # links waiting for their second pass
+    try:
+        while (done < n_producers or pending) and state.error is None:
+            batch = []
+            n_images = 0
+            while (done < n_producers or pending) and state.error is None:
+                # Wait for the first link of a batch; afterwards only take links that are already waiting
+                item = _get(state, in_q, timeout=0.1 if batch else None)
+                if item is _DONE:
+                    if batch or state.error is not None:
+                        break
+                    continue
+                if item is _END:
+                    done += 1
+                    continue
+                batch.append(item)
+                n_images += len(item[2])
+                if n_images >= images_per_batch or len(batch) >= links_per_batch:
+                    break
+
+            if not batch or state.error is not None:
+                continue
+            img_results = {key: path for _, _, results, _ in batch for key, path in results.items()}
+            seg_results = segment(img_results) if img_results else {}
+            for link_id, temp_gdf, results, first_pass in batch:
+                link_seg = {key: seg_results[key] for key in results if key in seg_results}
+                if first_pass is not None:
+                    pending -= 1
+                    results, link_seg = {**first_pass[0], **results}, {**first_pass[1], **link_seg}
+                elif gate is not None:
+                    rows = gate(temp_gdf, results, link_seg)
+                    if rows is not None and len(rows):
+                        more_q.put((link_id, temp_gdf, rows, (results, link_seg)))
+                        pending += 1
+                        continue
+                if not _put(state, out_q, (link_id, temp_gdf, results, link_seg)):
+                    return
+    except Exception as exc:
+        state.fail(exc)
+    finally:
+        if more_q is not None:
+            for _ in range(n_producers):
+                more_q.put(_END)
+        # Always reached by the consumer, even after a failure, so it can stop
+        out_q.put(_DONE)
+
+
+def run_pipeline(link_items, download, segment, measure, save,
+                 download_threads=4, geometry_workers=None, queue_size=8,
+                 images_per_batch=8, links_per_batch=16, gate=None, download_more=None):
+    """
+    Stream links through download → segmentation → geometry → save with bounded queues,
+    so network, model and CPU work overlap and memory stays flat for any number of links.
+
+    Stages:
+    - `download_threads` I/O threads call download(temp_gdf) → {key: img_path}.
+    - One model thread calls segment({key: img_path}) → {key: mask} on batches spanning links.
+    - A pool of `geometry_workers` processes calls measure(temp_gdf, results, seg_results)
+      (0 runs it in the calling thread; None uses all cores).
+    - The calling thread calls save(measured_gdf) as results come back.
+    - Optional early rejection: after a link's first pass, the model thread calls
+      gate(temp_gdf, results, seg_results) → rows that need more images (None or empty: go on to
+      geometry as is). `download_threads` more I/O threads call download_more(rows) → {key: img_path};
+      those images are segmented and the link goes on with the images and masks of both passes.
+
+    Each queue holds at most `queue_size` links and at most 2 * geometry_workers links are in
+    the process pool, so a slow stage blocks the ones before it instead of piling up work.
+
+    Returns:
+    - Number of links saved.
+    """
+    state = _Stage()
+    downloaded_q = queue.Queue(maxsize=queue_size)
+    segmented_q = queue.Queue(maxsize=queue_size)
+    link_iter = iter(link_items)
+    iter_lock = threading.Lock()
+
+    threads = [
+        threading.Thread(target=_download_worker, args=(state, link_iter, iter_lock, download, downloaded_q),
+                         name=f"download-{i}", daemon=True)
+        for i in range(download_threads)
+    ]
+    # Unbounded: the model thread must never block on it while second-pass threads wait for downloaded_q
+    more_q = queue.Queue() if gate is not None else None
+    if gate is not None:
+        threads += [
+            threading.Thread(target=_more_worker, args=(state, more_q, download_more, downloaded_q),
+                             name=f"download-more-{i}", daemon=True)
+            for i in range(download_threads)
+        ]
+    threads.append(threading.Thread(
+        target=_model_worker,
+        args=(state, downloaded_q, segment, segmented_q, download_threads, images_per_batch, links_per_batch,
+              gate, more_q),
+        name="segmentation", daemon=True,
+    ))
+    for t in threads:
+        t.start()
+
+    n_saved = 0
+    try:
+        if geometry_workers == 0:
+            while True:
+                item = segmented_q.get()
+                if item is _DONE:
+                    break
+                _, temp_gdf, results, seg_results = item
+                save(measure(temp_gdf, results, seg_results))
+                n_saved += 1
+        else:
+            workers = geometry_workers or os.cpu_count() or 1
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(_START_METHOD)) as pool:
+                in_flight = set()
+                while True:
+                    item = segmented_q.get()
+                    if item is _DONE:
+                        break
+                    _, temp_gdf, results, seg_results = item
+                    in_flight.add(pool.submit(measure, temp_gdf, results, seg_results))
+                    if len(in_flight) >= 2 * workers:
+                        finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            save(future.result())
+                            n_saved += 1
+                for future in wait(in_flight).done:
+                    save(future.result())
+                    n_saved += 1
+    except BaseException as exc:
+        state.fail(exc)
+        raise
+
+    for t in threads:
+        t.join()
+    if state.error is not None:
+        raise state.error
+    return n_saved
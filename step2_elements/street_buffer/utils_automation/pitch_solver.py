@@ -0,0 +1,92 @@
+import numpy as np
+
+from calculation import equations_top
+
+CAMERA_HEIGHT = 2.5  # Street View camera height (m) used by the width formula
+PITCH_STEP = 10      # Degrees between the two pitches (0° and -10°)
+
+
+def _ratio_and_derivative(T, above):
+    """
+    tan(T) / tan(10 - T) (edge below the horizon at -10°, `above` False) or
+    tan(T) / tan(T - 10) (`above` True), and its derivative in T (degrees).
+    """
+    a = np.radians(T)
+    b = np.radians(np.where(above, T - PITCH_STEP, PITCH_STEP - T))
+    tan_a, tan_b = np.tan(a), np.tan(b)
+    sec2_a, sec2_b = 1 + tan_a ** 2, 1 + tan_b ** 2
+    ratio = tan_a / tan_b
+    db = np.where(above, 1.0, -1.0)
+    d_ratio = np.radians(1) * (sec2_a / tan_b - db * tan_a * sec2_b / tan_b ** 2)
+    return ratio, d_ratio
+
+
+def solve_target_pitch(p_0, p_10, xtol=1.49012e-08, rtol=1e-9, max_iter=50, fallback=True):
+    """
+    Solve equations_top / equations_bottom for many (p_0, p_10) pairs at once.
+
+    Newton iterations run on all pairs together from fsolve's starting points
+    (8° if p_10 < 0 else 13°), kept inside the interval around the start on which the equation
+    is continuous (-80° to 10° or 10° to 90°), so they cannot jump over a pole to an unrelated root.
+    Pairs that do not converge are handed to scipy's fsolve one by one when `fallback` is set.
+
+    Parameters:
+    - p_0, p_10: Arrays of dist_central at pitch 0° and -10° (pixels from the image center).
+    - xtol: Relative step size at which an iteration counts as converged (fsolve's default).
+    - rtol: Largest accepted |residual|, relative to max(1, |p_0 / p_10|).
+    - max_iter: Maximum number of Newton iterations.
+    - fallback: Retry non-converged pairs with fsolve.
+
+    Returns:
+    - T: Target pitch (degrees) per pair.
+    - converged: True where the solution converged.
+    - residual: Equation value at T.
+    """
+    p_0 = np.atleast_1d(np.asarray(p_0, dtype=float))
+    p_10 = np.atleast_1d(np.asarray(p_10, dtype=float))
+    above = p_10 >= 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        target = p_0 / np.abs(p_10)
+    # Interval around the starting point on which the equation is continuous
+    lo = np.where(above, PITCH_STEP, PITCH_STEP - 90.0)
+    hi = np.where(above, 90.0, PITCH_STEP)
+
+    T = np.where(above, 13.0, 8.0)
+    converged = np.zeros(len(T), dtype=bool)
+    active = np.isfinite(target)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        for _ in range(max_iter):
+            if not active.any():
+                break
+            ratio, d_ratio = _ratio_and_derivative(T[active], above[active])
+            step = (ratio - target[active]) / d_ratio
+            T_new = T[active] - step
+
+            # Stay inside the interval: halve the distance to the violated bound instead
+            T_new = np.where(T_new <= lo[active], (T[active] + lo[active]) / 2, T_new)
+            T_new = np.where(T_new >= hi[active], (T[active] + hi[active]) / 2, T_new)
+
+            done = np.abs(T_new - T[active]) <= xtol * (1 + np.abs(T_new))
+            T[active] = T_new
+            idx = np.flatnonzero(active)
+            converged[idx[done]] = True
+            active[idx[done | ~np.isfinite(T_new)]] = False
+
+        residual = _ratio_and_derivative(T, above)[0] - target
+        converged &= np.abs(residual) <= rtol * np.maximum(1, np.abs(target))
+
+    if fallback and not converged.all():
+        from scipy.optimize import fsolve  # only for the few pairs Newton did not solve
+        for k in np.flatnonzero(~converged):
+            T_init = 8 if p_10[k] < 0 else 13
+            T_sol, info, ier, _ = fsolve(equations_top, T_init, args=(p_0[k], p_10[k]), full_output=True)
+            T[k] = T_sol[0]
+            residual[k] = info["fvec"][0]
+            converged[k] = ier == 1
+
+    return T, converged, residual
+
+
+def width_from_pitches(T_top, T_bottom, camera_height=CAMERA_HEIGHT):
+    """Horizontal distance (m) between two edges seen at target pitches T_top and T_bottom (degrees)."""
+    return camera_height * (1 / np.tan(np.radians(T_top)) - 1 / np.tan(np.radians(T_bottom)))
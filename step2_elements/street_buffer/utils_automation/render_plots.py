@@ -0,0 +1,110 @@
+import os
+import glob
+import argparse
+from multiprocessing import Pool
+
+import pandas as pd
+
+from config import OUTPUT_DIR, RESULT_FORMAT, RESULT_DIR
+from plotting import PLOT_SPEC_SUFFIX, render_plot_spec
+from result_sink import read_results
+
+
+def find_plot_specs(output_dir=OUTPUT_DIR):
+    """Return every deferred plot spec under output_dir, sorted."""
+    specs = []
+    for dirpath, _, filenames in os.walk(output_dir):
+        specs.extend(os.path.join(dirpath, f) for f in filenames if f.endswith(PLOT_SPEC_SUFFIX))
+    return sorted(specs)
+
+
+def load_link_results(output_dir=OUTPUT_DIR, result_dir=RESULT_DIR, result_format=RESULT_FORMAT):
+    """Results written by main.py: the Parquet parts in result_dir, or the per-link CSVs in output_dir."""
+    empty = pd.DataFrame(columns=["link_id", "side", "pano_id"])
+    if result_format == "parquet":
+        results_df = read_results(result_dir)
+        return results_df if len(results_df.columns) else empty
+    csv_files = sorted(glob.glob(os.path.join(output_dir, "*.csv")))
+    if not csv_files:
+        return empty
+    return pd.concat([_read_link_csv(f) for f in csv_files], ignore_index=True)
+
+
+def _read_link_csv(path):
+    """One per-link result CSV, with the no_buffer flag of the Parquet results ('buffer_width' = "None" reads as NaN)."""
+    df = pd.read_csv(path)
+    if "buffer_width" in df.columns and "no_buffer" not in df.columns:
+        raw = pd.read_csv(path, usecols=["buffer_width"], dtype=str, keep_default_na=False)["buffer_width"]
+        df["no_buffer"] = raw.eq("None").to_numpy()
+    return df
+
+
+def flagged_rows(results_df):
+    """Rows whose measurement failed: any error code set or a missing width (a side without buffer is not a failure)."""
+    flagged = pd.Series(False, index=results_df.index)
+    no_buffer = results_df.get("no_buffer", pd.Series(False, index=results_df.index)).fillna(False).astype(bool)
+    for col in results_df.columns:
+        if col.endswith("error_code"):
+            flagged |= results_df[col].notna()
+        elif col == "buffer_width":
+            flagged |= results_df[col].isna() & ~no_buffer
+        elif col.endswith("width"):
+            flagged |= results_df[col].isna()
+    return results_df[flagged]
+
+
+def spec_dirs_for(results_df, output_dir=OUTPUT_DIR):
+    """Image folders (<output_dir>/<pano_id>/<side>) of the given result rows."""
+    return {
+        os.path.join(output_dir, str(row["pano_id"]), str(row["side"]))
+        for _, row in results_df.iterrows()
+    }
+
+
+def _render(args):
+    spec_path, keep_spec = args
+    try:
+        return render_plot_spec(spec_path, keep_spec=keep_spec), None
+    except Exception as e:
+        return None, f"{spec_path}: {e}"
+
+
+def render_plots(spec_paths, workers=None, keep_specs=False):
+    """Draw the given plot specs with a pool of `workers` processes. Returns (rendered, failed)."""
+    rendered, failed = [], []
+    jobs = [(path, keep_specs) for path in spec_paths]
+    with Pool(processes=workers) as pool:
+        for out_path, err in pool.imap_unordered(_render, jobs, chunksize=4):
+            if err is None:
+                rendered.append(out_path)
+            else:
+                failed.append(err)
+    return rendered, failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Draw the debug figures saved with PLOT_MODE = 'deferred'.")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="Pipeline output folder (default: config.OUTPUT_DIR)")
+    parser.add_argument("--result-dir", default=RESULT_DIR, help="Parquet result folder (default: config.RESULT_DIR)")
+    parser.add_argument("--links", nargs="+", help="Only draw the figures of these link_ids")
+    parser.add_argument("--flagged", action="store_true", help="Only draw the figures of links with an error code or no width")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--keep-specs", action="store_true", help="Keep the *.plot.pkl files after drawing")
+    args = parser.parse_args()
+
+    spec_paths = find_plot_specs(args.output_dir)
+
+    if args.links or args.flagged:
+        results_df = load_link_results(args.output_dir, args.result_dir)
+        if args.links:
+            results_df = results_df[results_df["link_id"].astype(str).isin(args.links)]
+        if args.flagged:
+            results_df = flagged_rows(results_df)
+        dirs = spec_dirs_for(results_df, args.output_dir)
+        spec_paths = [p for p in spec_paths if os.path.dirname(p) in dirs]
+
+    print(f"⏳ Rendering {len(spec_paths)} figures...")
+    rendered, failed = render_plots(spec_paths, workers=args.workers, keep_specs=args.keep_specs)
+    for err in failed:
+        print(f"⚠️ {err}")
+    print(f"✅ Rendered {len(rendered)} figures ({len(failed)} failed)")
\ No newline at end of file
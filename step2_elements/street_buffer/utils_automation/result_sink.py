@@ -0,0 +1,150 @@
+import os
+import glob
+import time
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+UNIT_COLUMNS = ["link_id", "side"]
+
+
+def _part_paths(result_dir):
+    """Part files in write order (names start with a zero-padded time stamp)."""
+    return sorted(glob.glob(os.path.join(result_dir, "part-*.parquet")))
+
+
+def _to_table(df, schema):
+    """Cast a result DataFrame to `schema` (missing values become nulls, ints become nullable)."""
+    columns = {}
+    for field in schema:
+        col = df[field.name] if field.name in df.columns else pd.Series([None] * len(df), index=df.index)
+        if pa.types.is_integer(field.type) or pa.types.is_floating(field.type):
+            col = pd.to_numeric(col, errors="coerce")
+            if pa.types.is_integer(field.type):
+                col = col.astype("Int64")
+        elif pa.types.is_boolean(field.type):
+            col = col.astype("boolean")
+        elif pa.types.is_string(field.type):
+            col = col.where(col.notna(), None).map(lambda v: v if v is None else str(v))
+        columns[field.name] = pa.array(col.tolist(), type=field.type, from_pandas=True)
+    return pa.Table.from_pydict(columns, schema=schema)
+
+
+def _write_atomic(table, path, row_group_size=None):
+    """Write a complete Parquet file under a temporary name and rename it, so readers never see a truncated file."""
+    tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+    try:
+        pq.write_table(table, tmp_path, row_group_size=row_group_size, compression="zstd")
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class ParquetResultSink:
+    """
+    Append-only writer of per-side results as typed Parquet, replacing one CSV per link.
+
+    Rows are buffered and every `batch_rows` rows are flushed as one row group in a new part file
+    <result_dir>/part-<time stamp>-<id>.parquet. Parts are written under a temporary name and renamed
+    once complete, so an interrupted run never leaves a truncated file; at most the unflushed rows are
+    lost, and those links are written again from the run journal on the next run.
+    compact() merges all parts into one file.
+
+    Parameters:
+    - result_dir: Sink folder (RESULT_DIR).
+    - schema: pyarrow schema of the result rows; must include link_id and side.
+    - batch_rows: Rows per flushed row group.
+    """
+
+    def __init__(self, result_dir, schema, batch_rows=5000):
+        self.result_dir = result_dir
+        self.schema = schema
+        self.batch_rows = batch_rows
+        os.makedirs(result_dir, exist_ok=True)
+        self._pending = []
+        self._n_pending = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, df):
+        """Buffer the rows of one link; flushes once `batch_rows` rows are waiting."""
+        self._pending.append(_to_table(df, self.schema))
+        self._n_pending += len(df)
+        if self._n_pending >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered rows as a new part file (one row group)."""
+        if not self._pending:
+            return None
+        table = pa.concat_tables(self._pending)
+        path = os.path.join(self.result_dir, f"part-{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.parquet")
+        _write_atomic(table, path)
+        self._pending = []
+        self._n_pending = 0
+        return path
+
+    def close(self):
+        self.flush()
+
+    def links(self):
+        """Set of link_ids already written (reads only the link_id column)."""
+        written = set()
+        for path in _part_paths(self.result_dir):
+            written.update(pq.read_table(path, columns=["link_id"]).column("link_id").to_pylist())
+        return written
+
+    def compact(self):
+        """
+        Merge all part files into one (latest row per (link_id, side), `batch_rows` rows per row group).
+        The merged file replaces the parts atomically; parts are only removed after it is in place.
+        """
+        self.flush()
+        parts = _part_paths(self.result_dir)
+        if len(parts) < 2:
+            return parts[0] if parts else None
+        table = pa.Table.from_pandas(read_results(self.result_dir, schema=self.schema), schema=self.schema,
+                                     preserve_index=False)
+        # Same time stamp as the newest part, so the merged file keeps its place in write order
+        stamp = os.path.basename(parts[-1]).split("-")[1]
+        path = os.path.join(self.result_dir, f"part-{stamp}-merged.parquet")
+        _write_atomic(table, path, row_group_size=self.batch_rows)
+        for part in parts:
+            if part != path:
+                os.remove(part)
+        return path
+
+
+def read_results(result_dir, columns=None, schema=None):
+    """
+    Whole city's results as one DataFrame.
+
+    Parts are read in write order; when a (link_id, side) was written more than once
+    (e.g. re-processed after its inputs changed), the latest row is kept.
+    Integer columns come back as nullable pandas integers (pd.NA where missing).
+
+    Parameters:
+    - result_dir: Sink folder (RESULT_DIR).
+    - columns: Optional subset of columns to return.
+    - schema: Optional schema to cast all parts to (defaults to the schema of the newest part).
+    """
+    parts = _part_paths(result_dir)
+    if not parts:
+        return pd.DataFrame(columns=columns or (schema.names if schema is not None else []))
+    read_columns = None if columns is None else list(dict.fromkeys(UNIT_COLUMNS + list(columns)))
+    tables = [pq.read_table(path, columns=read_columns) for path in parts]
+    target = schema if schema is not None else tables[-1].schema
+    if read_columns is not None:
+        target = pa.schema([target.field(name) for name in read_columns])
+    table = pa.concat_tables([t.select(target.names).cast(target) for t in tables])
+
+    df = table.to_pandas(types_mapper=lambda t: pd.Int64Dtype() if pa.types.is_integer(t) else None)
+    df = df.drop_duplicates(subset=UNIT_COLUMNS, keep="last").reset_index(drop=True)
+    return df if columns is None else df[list(columns)]
\ No newline at end of file
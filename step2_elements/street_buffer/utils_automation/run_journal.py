@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import threading
+
+from mask_store import mask_path_for_image, load_mask
+
+# Stages of one (link_id, side) unit, in pipeline order. A stage is only recorded once the
+# previous one is, so a recorded stage means all earlier ones are complete too.
+STAGES = ("downloaded", "segmented", "edges", "width")
+
+# Input row values that identify the work of one unit
+INPUT_COLUMNS = ("link_id", "side", "pano_id", "pano_heading", "bearing")
+
+
+class RunJournal:
+    """
+    Checkpoints of a long run, so an interrupted run resumes where it stopped.
+
+    For each (link_id, side) unit the journal keeps the payload of every completed stage
+    (downloaded → segmented → edges → width) with a hash of the unit's inputs (its INPUT_COLUMNS
+    values and the run parameters). Entries whose hash no longer matches are ignored and replaced,
+    so links whose inputs or parameters changed are processed again.
+
+    The journal is an SQLite file in WAL mode, written by the pipeline threads and the geometry
+    worker processes; it pickles to its path, so it can be handed to worker processes.
+    """
+
+    def __init__(self, path, params=None, input_columns=INPUT_COLUMNS):
+        self.path = path
+        self.params = params or {}
+        self.input_columns = list(input_columns)
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS stages ("
+            "link_id TEXT NOT NULL, side TEXT NOT NULL, stage TEXT NOT NULL, input_hash TEXT NOT NULL, "
+            "payload BLOB, updated REAL NOT NULL, PRIMARY KEY (link_id, side, stage))"
+        )
+
+    def __getstate__(self):
+        return {"path": self.path, "params": self.params, "input_columns": self.input_columns}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def _conn(self):
+        """SQLite connection of the calling thread (connections are not shared across threads or forks)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def input_hash(self, row):
+        values = [row[c] for c in self.input_columns]
+        text = json.dumps([values, self.params], default=str, sort_keys=True)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def load(self, row, stage):
+        """Payload of `stage` for the unit of `row`, or None if that stage is not complete for its current inputs."""
+        found = self._conn().execute(
+            "SELECT payload FROM stages WHERE link_id = ? AND side = ? AND stage = ? AND input_hash = ?",
+            (str(row["link_id"]), str(row["side"]), stage, self.input_hash(row)),
+        ).fetchone()
+        return None if found is None else pickle.loads(found[0])
+
+    def done(self, row, stage):
+        """True if `stage` is complete for the unit of `row` and its current inputs."""
+        return self._conn().execute(
+            "SELECT 1 FROM stages WHERE link_id = ? AND side = ? AND stage = ? AND input_hash = ?",
+            (str(row["link_id"]), str(row["side"]), stage, self.input_hash(row)),
+        ).fetchone() is not None
+
+    def record(self, row, stage, payload=None):
+        """Mark `stage` complete for the unit of `row`, dropping entries recorded for other inputs."""
+        if stage not in STAGES:
+            raise ValueError(f"Unknown stage '{stage}', expected one of {STAGES}")
+        unit = (str(row["link_id"]), str(row["side"]))
+        input_hash = self.input_hash(row)
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM stages WHERE link_id = ? AND side = ? AND input_hash != ?", (*unit, input_hash))
+            conn.execute(
+                "INSERT OR REPLACE INTO stages (link_id, side, stage, input_hash, payload, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                (*unit, stage, input_hash, pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL), time.time()),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def counts(self):
+        """{stage: number of units that completed it} (for progress reports)."""
+        rows = self._conn().execute("SELECT stage, COUNT(*) FROM stages GROUP BY stage").fetchall()
+        return {stage: dict(rows).get(stage, 0) for stage in STAGES}
+
+
+def _unit_keys(results, link_id, side):
+    return {key: value for key, value in results.items() if key[0] == link_id and key[1] == side}
+
+
+def resumable_download(journal, temp_gdf, download, n_images):
+    """
+    Download the images of a link, reusing the 'downloaded' checkpoint of units whose files still exist.
+
+    Parameters:
+    - download: download(rows) → {(link_id, side, panoid, pitch): img_path}.
+    - n_images: Images per unit; a unit is only checkpointed when all of them were downloaded.
+    """
+    if journal is None:
+        return download(temp_gdf)
+
+    results = {}
+    todo = []
+    for i, (_, row) in enumerate(temp_gdf.iterrows()):
+        paths = journal.load(row, "downloaded")
+        if paths is not None and all(os.path.exists(p) for p in paths.values()):
+            results.update(paths)
+        else:
+            todo.append(i)
+    if not todo:
+        return results
+
+    rows = temp_gdf.iloc[todo]
+    fresh = download(rows)
+    results.update(fresh)
+    for _, row in rows.iterrows():
+        paths = _unit_keys(fresh, row["link_id"], row["side"])
+        if len(paths) == n_images:
+            journal.record(row, "downloaded", paths)
+    return results
+
+
+def resumable_segment(journal, unit_rows, img_results, segment, mask_format):
+    """
+    Segment downloaded images, skipping units that are already past segmentation.
+
+    Units with an 'edges' checkpoint need no masks (their edges come from the journal); units with a
+    'segmented' checkpoint reload their stored masks; the rest are segmented and checkpointed.
+
+    Parameters:
+    - unit_rows: {(link_id, side): input row}.
+    - segment: segment({key: img_path}) → {key: mask}.
+    - mask_format: Format of the masks stored next to the images (MASK_FORMAT).
+    """
+    if journal is None:
+        return segment(img_results)
+
+    units = {}
+    for key in img_results:
+        units.setdefault((key[0], key[1]), []).append(key)
+
+    seg_results = {}
+    todo = {}
+    fresh_units = []
+    for unit, keys in units.items():
+        row = unit_rows[unit]
+        if journal.done(row, "edges"):
+            continue
+        mask_paths = journal.load(row, "segmented")
+        if (mask_paths is not None and all(key in mask_paths for key in keys)
+                and all(os.path.exists(mask_paths[key]) for key in keys)):
+            seg_results.update({key: load_mask(mask_paths[key], mmap=False) for key in keys})
+            continue
+        todo.update({key: img_results[key] for key in keys})
+        fresh_units.append(unit)
+
+    if todo:
+        fresh = segment(todo)
+        seg_results.update(fresh)
+        for unit in fresh_units:
+            row = unit_rows[unit]
+            if journal.done(row, "downloaded"):
+                # Merged with earlier passes (early rejection segments a unit's pitches in two passes)
+                journal.record(row, "segmented", {
+                    **(journal.load(row, "segmented") or {}),
+                    **{key: mask_path_for_image(img_results[key], mask_format) for key in units[unit] if key in fresh},
+                })
+    return seg_results
+
+
+def finished_link(journal, temp_gdf, output_columns):
+    """
+    temp_gdf with `output_columns` filled from the 'width' checkpoints if every unit of the link is
+    finished, else None.
+    """
+    if journal is None:
+        return None
+    outputs = []
+    for _, row in temp_gdf.iterrows():
+        values = journal.load(row, "width")
+        if values is None:
+            return None
+        outputs.append(values)
+    done_gdf = temp_gdf.copy()
+    for col in output_columns:
+        done_gdf[col] = [values[col] for values in outputs]
+    return done_gdf
@@ -0,0 +1,195 @@
+import os
+import json
+import hashlib
+
+import cv2
+import numpy as np
+
+from seg_cache import file_digest
+
+BACKENDS = ("mmseg", "onnx", "torchscript")
+
+
+def argmax_segmentor(model):
+    """
+    Tensor path of an mmseg EncoderDecoder: normalized (N, 3, H, W) image batch → (N, H, W) uint8
+    LABELS indices at the input size. Drops mmseg's data samples, test-time resize and sliding window,
+    so it can be traced and exported. (Defined here so importing this module does not import torch.)
+    """
+    import torch
+    import torch.nn.functional as F
+
+    class ArgmaxSegmentor(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+            self.align_corners = bool(getattr(model, "align_corners", False))
+
+        def forward(self, inputs):
+            feats = self.model.extract_feat(inputs)
+            logits = self.model.decode_head(feats)
+            logits = F.interpolate(logits, size=inputs.shape[2:], mode="bilinear", align_corners=self.align_corners)
+            return logits.argmax(dim=1).to(torch.uint8)
+
+    return ArgmaxSegmentor(model)
+
+
+def backend_tag(backend, int8, input_size):
+    """Short name of an exported model variant, e.g. 'onnx-int8-640x640'."""
+    return f"{backend}-{'int8' if int8 else 'fp32'}-{input_size[0]}x{input_size[1]}"
+
+
+def export_path(export_dir, config_file, checkpoint_file, backend, int8, input_size):
+    """
+    <export_dir>/<model key>-<backend tag>.onnx|.pt, where the model key changes with the config
+    file contents or the checkpoint (path, size, mtime), so a new checkpoint is exported again.
+    """
+    stat = os.stat(checkpoint_file)
+    h = hashlib.sha256()
+    h.update(file_digest(config_file).encode())
+    h.update(f"{os.path.abspath(checkpoint_file)}:{stat.st_size}:{stat.st_mtime}".encode())
+    ext = ".onnx" if backend == "onnx" else ".pt"
+    return os.path.join(export_dir, f"{h.hexdigest()[:16]}-{backend_tag(backend, int8, input_size)}{ext}")
+
+
+def preprocessing(model):
+    """Normalization of the mmseg data preprocessor (mean/std per channel, BGR → RGB)."""
+    pre = model.data_preprocessor
+    return {
+        "mean": [float(v) for v in pre.mean.flatten()],
+        "std": [float(v) for v in pre.std.flatten()],
+        "bgr_to_rgb": bool(getattr(pre, "_channel_conversion", True)),
+    }
+
+
+def export_segmenter(model, path, backend, input_size=(640, 640), int8=True):
+    """
+    Export an mmseg model (on CPU) to `path` with its preprocessing in <path>.json.
+
+    - onnx: ONNX graph with a dynamic batch axis; int8 applies onnxruntime dynamic quantization
+      (INT8 weights, activations quantized on the fly).
+    - torchscript: traced TorchScript module; int8 applies torch dynamic quantization to the Linear
+      layers (attention and MLP projections of the MiT encoder).
+    """
+    if backend not in BACKENDS[1:]:
+        raise ValueError(f"Cannot export to backend {backend!r} (expected one of {BACKENDS[1:]})")
+    import torch
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    model = model.cpu().eval()
+    segmentor = argmax_segmentor(model).eval()
+    dummy = torch.zeros(1, 3, *input_size)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+
+    with torch.no_grad():
+        if backend == "onnx":
+            torch.onnx.export(segmentor, dummy, tmp_path, input_names=["image"], output_names=["mask"],
+                              dynamic_axes={"image": {0: "batch"}, "mask": {0: "batch"}}, opset_version=17)
+            if int8:
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+                fp32_path, tmp_path = tmp_path, f"{path}.int8.tmp{os.getpid()}"
+                quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8)
+                os.remove(fp32_path)
+        else:
+            if int8:
+                segmentor = torch.ao.quantization.quantize_dynamic(segmentor, {torch.nn.Linear}, dtype=torch.qint8)
+            traced = torch.jit.trace(segmentor, dummy, check_trace=False)
+            torch.jit.save(traced, tmp_path)
+
+    with open(f"{path}.json", "w") as f:
+        json.dump({"backend": backend, "int8": int8, "input_size": list(input_size),
+                   "preprocessing": preprocessing(model)}, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+class ExportedSegmenter:
+    """
+    CPU segmentation with a model written by export_segmenter(), without mmseg.
+
+    Images (file paths or BGR arrays, e.g. ROI crops) are normalized like mmseg does and run at the
+    exported input size (resized only if they differ); predict() returns (H, W) uint8 LABELS-indexed
+    masks at each image's own size, the same as segmentation._result_to_mask() gives for mmseg results.
+
+    Parameters:
+    - path: Exported .onnx or .pt file (its preprocessing is read from <path>.json).
+    - num_threads: Fixed intra-op thread count (None = runtime default).
+    """
+
+    def __init__(self, path, num_threads=None):
+        with open(f"{path}.json") as f:
+            meta = json.load(f)
+        self.path = path
+        self.backend = meta["backend"]
+        self.int8 = meta["int8"]
+        self.input_size = tuple(meta["input_size"])
+        pre = meta["preprocessing"]
+        self._mean = np.asarray(pre["mean"], np.float32).reshape(3, 1, 1)
+        self._std = np.asarray(pre["std"], np.float32).reshape(3, 1, 1)
+        self._bgr_to_rgb = pre["bgr_to_rgb"]
+
+        if self.backend == "onnx":
+            import onnxruntime as ort
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+            options.inter_op_num_threads = 1
+            if num_threads:
+                options.intra_op_num_threads = num_threads
+            session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+            self._run = lambda batch: session.run(None, {"image": batch})[0]
+        else:
+            import torch
+            torch._C._jit_set_profiling_mode(False)
+            torch._C._jit_set_profiling_executor(False)
+            if num_threads:
+                torch.set_num_threads(num_threads)
+            module = torch.jit.load(path, map_location="cpu").eval()
+
+            def run(batch):
+                with torch.inference_mode():
+                    return module(torch.from_numpy(batch)).numpy()
+            self._run = run
+
+    @property
+    def tag(self):
+        return backend_tag(self.backend, self.int8, self.input_size)
+
+    def preprocess(self, img):
+        """(3, H, W) float32 network input of one image (path or BGR array), and the image's own (H, W)."""
+        if isinstance(img, str):
+            path, img = img, cv2.imread(img)
+            if img is None:
+                raise FileNotFoundError(f"Cannot read image {path}")
+        shape = img.shape[:2]
+        if shape != self.input_size:
+            img = cv2.resize(img, (self.input_size[1], self.input_size[0]), interpolation=cv2.INTER_LINEAR)
+        if self._bgr_to_rgb:
+            img = img[:, :, ::-1]
+        x = img.transpose(2, 0, 1).astype(np.float32)
+        return (x - self._mean) / self._std, shape
+
+    def predict(self, imgs):
+        """Label-index masks of the images (paths or BGR arrays), run as one batch."""
+        inputs, shapes = zip(*(self.preprocess(img) for img in imgs))
+        out = self._run(np.ascontiguousarray(np.stack(inputs)))
+        masks = []
+        for mask, shape in zip(out.astype(np.uint8), shapes):
+            if mask.shape != shape:
+                mask = cv2.resize(mask, (shape[1], shape[0]), interpolation=cv2.INTER_NEAREST)
+            masks.append(mask)
+        return masks
+
+
+def load_exported_segmenter(config_file, checkpoint_file, backend, export_dir, input_size=(640, 640),
+                            int8=True, num_threads=None):
+    """
+    ExportedSegmenter for `backend`, exporting the mmseg model first if this config/checkpoint
+    has not been exported with these settings yet (the only step that needs mmseg).
+    """
+    path = export_path(export_dir, config_file, checkpoint_file, backend, int8, input_size)
+    if not os.path.exists(path) or not os.path.exists(f"{path}.json"):
+        from mmseg.apis import init_model
+        print(f"⏳ Exporting segmentation model to {path} ...")
+        export_segmenter(init_model(config_file, checkpoint_file, device="cpu"), path, backend,
+                         input_size=input_size, int8=int8)
+    return ExportedSegmenter(path, num_threads=num_threads)
@@ -0,0 +1,91 @@
+import os
+import json
+import hashlib
+
+from mask_store import save_mask, load_mask
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """Return the SHA-256 hex digest of a file, read in chunks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class SegmentationCache:
+    """
+    Content-addressed cache of segmentation masks shared by the sidewalk and street_buffer pipelines.
+
+    A mask is keyed by the SHA-256 of the image bytes plus a model key built from the model config
+    file and the checkpoint digest, so any pipeline pointing at the same cache directory reuses masks
+    of identical images segmented by the identical model.
+
+    Layout: <cache_dir>/<model_key[:16]>/<image_digest[:2]>/<image_digest>.npy
+    """
+
+    def __init__(self, cache_dir, config_file, checkpoint_file, extra=""):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.model_key = self._model_key(config_file, checkpoint_file, extra)
+        self.model_dir = os.path.join(cache_dir, self.model_key[:16])
+        os.makedirs(self.model_dir, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def _model_key(self, config_file, checkpoint_file, extra):
+        h = hashlib.sha256()
+        h.update(file_digest(config_file).encode())
+        h.update(self._checkpoint_digest(checkpoint_file).encode())
+        h.update(str(extra).encode())
+        return h.hexdigest()
+
+    def _checkpoint_digest(self, checkpoint_file):
+        """
+        Digest of the checkpoint, memoized in <cache_dir>/checkpoints.json by (path, size, mtime)
+        so the large weights file is only hashed once.
+        """
+        index_path = os.path.join(self.cache_dir, "checkpoints.json")
+        stat = os.stat(checkpoint_file)
+        entry_key = os.path.abspath(checkpoint_file)
+
+        index = {}
+        if os.path.exists(index_path):
+            try:
+                with open(index_path) as f:
+                    index = json.load(f)
+            except (OSError, ValueError):
+                index = {}
+
+        entry = index.get(entry_key)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            return entry["sha256"]
+
+        digest = file_digest(checkpoint_file)
+        index[entry_key] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": digest}
+        tmp_path = f"{index_path}.tmp{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp_path, index_path)
+        return digest
+
+    def key_for(self, img_path):
+        """Return the cache key (image content digest) of an image file."""
+        return file_digest(img_path)
+
+    def path_for(self, key):
+        return os.path.join(self.model_dir, key[:2], f"{key}.npy")
+
+    def get(self, key):
+        """Return the cached mask for `key`, or None on a miss."""
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return load_mask(path, mmap=False)
+
+    def put(self, key, mask):
+        """Store the mask for `key`."""
+        save_mask(mask, self.path_for(key))
@@ -1,87 +1,118 @@
 import os
+import zlib
 import pandas as pd
 import geopandas as gpd
 from shapely.geometry import Point
 from zipfile import ZipFile, is_zipfile, BadZipFile
 from pandas.errors import EmptyDataError
+from concurrent.futures import ProcessPoolExecutor
+
+# Columns read from each GTFS file (None = all) and their dtypes; the typed columns (or the listed ones)
+# are required. IDs are read as strings as written in the feed; stop_times.txt, by far the largest
+# file, is read in chunks of STOP_TIMES_CHUNKSIZE rows.
+GTFS_COLUMNS = {
+    "stops.txt":      (None, {"stop_id": str}),
+    "routes.txt":     (["route_id", "route_type"], {"route_id": str}),
+    "trips.txt":      (["trip_id", "route_id", "service_id"], {"trip_id": str, "route_id": str, "service_id": str}),
+    "stop_times.txt": (["trip_id", "arrival_time", "departure_time", "stop_id"],
+                       {"trip_id": str, "arrival_time": str, "departure_time": str, "stop_id": str}),
+    "calendar.txt":   (None, {"service_id": str}),
+}
+STOP_TIMES_CHUNKSIZE = 1_000_000
+
+def _iter_chunks(z: ZipFile, filename: str, usecols: list, dtype: dict, chunksize: int):
+    with z.open(filename) as f:
+        for chunk in pd.read_csv(f, usecols=usecols, dtype=dtype, chunksize=chunksize):
+            yield chunk[usecols]
+
+def _read_gtfs_file(z: ZipFile, filename: str, chunksize: int | None = None):
+    """
+    Read one file of an open GTFS archive with the columns and dtypes of GTFS_COLUMNS (an iterator of
+    DataFrames with `chunksize`). Returns None if the file is missing or empty; raises a ValueError
+    if it lacks a required column.
+    """
+    if filename not in z.namelist():
+        return None
+    usecols, dtype = GTFS_COLUMNS[filename]
+    with z.open(filename) as f:
+        try:
+            header = pd.read_csv(f, nrows=0).columns
+        except EmptyDataError:
+            return None
+    missing = [col for col in (usecols or dtype) if col not in header]
+    if missing:
+        raise ValueError(f"Missing columns {missing} in {filename}")
+    if chunksize is not None:
+        return _iter_chunks(z, filename, usecols, dtype, chunksize)
+    with z.open(filename) as f:
+        df = pd.read_csv(f, usecols=usecols, dtype=dtype)
+    return df if usecols is None else df[usecols]
 
 def load_gtfs_from_zip(zip_path: str, filename: str) -> pd.DataFrame | None:
+    """One file of a GTFS archive (see GTFS_COLUMNS), or None if it cannot be read."""
     if not is_zipfile(zip_path):
         return None
     try:
         with ZipFile(zip_path) as z:
-            if z.testzip():
-                return None
-            if filename not in z.namelist():
-                return None
-            with z.open(filename) as f:
-                try:
-                    return pd.read_csv(f, low_memory=False)
-                except EmptyDataError:
-                    return None
-    except BadZipFile:
+            return _read_gtfs_file(z, filename)
+    except (BadZipFile, zlib.error, EOFError, ValueError):
         return None
 
-def process_single_gtfs_zip(zip_path: str, tag: str):
-    stops      = load_gtfs_from_zip(zip_path, "stops.txt")
-    routes     = load_gtfs_from_zip(zip_path, "routes.txt")
-    trips      = load_gtfs_from_zip(zip_path, "trips.txt")
-    stop_times = load_gtfs_from_zip(zip_path, "stop_times.txt")
-    calendar   = load_gtfs_from_zip(zip_path, "calendar.txt")
-
-    if any(df is None for df in (stops, routes, trips, stop_times, calendar)):
+def process_single_gtfs_zip(zip_path: str, tag: str, chunksize: int = STOP_TIMES_CHUNKSIZE):
+    """
+    Schedule of one GTFS archive: stop_times joined with trips, routes and calendar, with every ID
+    prefixed by `tag`. The archive is opened once; a corrupt member is detected by its CRC check
+    while it is read. Returns (merged, stops, trips, routes, calendar), or None to skip the feed.
+    """
+    if not is_zipfile(zip_path):
         print(f"⚠️[SKIP] Required File does not exist in GTFS: {zip_path}")
         return None
+    try:
+        with ZipFile(zip_path) as z:
+            stops    = _read_gtfs_file(z, "stops.txt")
+            routes   = _read_gtfs_file(z, "routes.txt")
+            trips    = _read_gtfs_file(z, "trips.txt")
+            calendar = _read_gtfs_file(z, "calendar.txt")
+            stop_times = _read_gtfs_file(z, "stop_times.txt", chunksize=chunksize)
+            if any(df is None for df in (stops, routes, trips, stop_times, calendar)):
+                print(f"⚠️[SKIP] Required File does not exist in GTFS: {zip_path}")
+                return None
 
-    required_columns_map = [
-        (trips, ["trip_id", "route_id", "service_id"]),
-        (routes, ["route_id"]),
-        (stop_times, ["trip_id", "stop_id"]),
-        (stops, ["stop_id"])
-    ]
-
-    for df, cols in required_columns_map:
-        missing = [col for col in cols if col not in df.columns]
-        if missing:
-            print(f"⚠️ [SKIP] Missing columns {missing} in GTFS: {zip_path}")
-            return None
-        for col in cols:
-            df[col] = df[col].astype(str)
-
-    # Processing Calendar (Skip if service_id does not exist)
-    if calendar is not None:
-        if "service_id" not in calendar.columns:
-            print(f"⚠️ [SKIP] 'service_id' column missing in calendar.txt: {zip_path}")
-            return None
-        calendar["service_id"] = calendar["service_id"].astype(str)
-        calendar["service_id"] = tag + "_" + calendar["service_id"]
-
-    # Tagging IDs
-    for df, mapping in [
-        (trips,    {"trip_id":tag+"_","route_id":tag+"_","service_id":tag+"_"}),
-        (routes,   {"route_id":tag+"_"}),
-        (stop_times,{"trip_id":tag+"_", "stop_id":tag+"_"}),
-        (stops, {"stop_id": tag+"_"})
-    ]:
-        for col, prefix in mapping.items():
-            df[col] = prefix + df[col]
-        
-    # Merging DataFrames
-    merged = (
-        stop_times[["trip_id", "arrival_time", "departure_time", "stop_id"]]
-        .merge(trips[["trip_id","route_id","service_id"]], on="trip_id", how="left")
-        .merge(routes[["route_id","route_type"]], on="route_id", how="left")
-    )
+            # Tagging IDs
+            calendar["service_id"] = tag + "_" + calendar["service_id"]
+            stops["stop_id"] = tag + "_" + stops["stop_id"]
+            routes["route_id"] = tag + "_" + routes["route_id"]
+            for col in ["trip_id", "route_id", "service_id"]:
+                trips[col] = tag + "_" + trips[col]
+
+            # Merging DataFrames, one chunk of stop_times at a time
+            parts = []
+            for chunk in stop_times:
+                chunk["trip_id"] = tag + "_" + chunk["trip_id"]
+                chunk["stop_id"] = tag + "_" + chunk["stop_id"]
+                parts.append(
+                    chunk
+                    .merge(trips, on="trip_id", how="left")
+                    .merge(routes, on="route_id", how="left")
+                    .merge(calendar, on="service_id", how="left")
+                )
+    except ValueError as e:
+        print(f"⚠️ [SKIP] {e} in GTFS: {zip_path}")
+        return None
+    except (BadZipFile, zlib.error, EOFError) as e:
+        print(f"⚠️ [SKIP] Corrupt GTFS archive ({e}): {zip_path}")
+        return None
 
-    if calendar is not None:
-        merged = merged.merge(calendar, on="service_id", how="left")
+    if not parts:
+        print(f"⚠️[SKIP] Required File does not exist in GTFS: {zip_path}")
+        return None
+    merged = pd.concat(parts, ignore_index=True)
 
     merged["source"] = tag
     stops["source"] = tag
     trips["source"] = tag
     routes["source"] = tag
-    if calendar is not None:
-        calendar["source"] = tag
+    calendar["source"] = tag
 
     return merged, stops, trips, routes, calendar
 
@@ -130,17 +161,27 @@ def stops_bymodes(sched_merged, stops_merged):
 
     return station_modes_gdf
 
-def concat_dataframes(dl_dir: str):
+def concat_dataframes(dl_dir: str, workers: int | None = 1):
+    """
+    Load every GTFS archive in `dl_dir`, one after the other in this process (default) or with
+    `workers` processes (None: one per archive up to the number of cores). Each worker sends its
+    whole merged schedule back to this process, so the pool holds every schedule in memory twice;
+    use it when memory is plentiful and there are several large archives.
+    """
     merged_list = []
     stops_list = []
 
-    for fname in os.listdir(dl_dir):
-        if not fname.endswith(".zip"):
-            continue
-
-        tag = fname.replace(".zip", "")
-        result = process_single_gtfs_zip(os.path.join(dl_dir, fname), tag)
-
+    fnames = [fname for fname in os.listdir(dl_dir) if fname.endswith(".zip")]
+    tags = [fname.replace(".zip", "") for fname in fnames]
+    paths = [os.path.join(dl_dir, fname) for fname in fnames]
+    workers = min(workers or os.cpu_count() or 1, max(len(fnames), 1))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(process_single_gtfs_zip, paths, tags))
+    else:
+        results = map(process_single_gtfs_zip, paths, tags)
+
+    for tag, result in zip(tags, results):
         if result is None:
             continue
 